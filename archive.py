@@ -0,0 +1,129 @@
+import os
+import time
+import logging
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from bulk_load import prepare_frame, TRANSPORT_KEY, AIR_KEY
+from metrics import INGEST_STAGE_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+# Формат архивных копий загруженных данных: "csv" (как раньше), "parquet" или "both"
+ARCHIVE_FORMAT = os.environ.get("ARCHIVE_FORMAT", "csv")
+WRITE_CSV = ARCHIVE_FORMAT in ("csv", "both")
+WRITE_PARQUET = ARCHIVE_FORMAT in ("parquet", "both")
+
+# Каталог архива Parquet: <ARCHIVE_DIR>/<набор>/Дата=ГГГГ-ММ-ДД/<хеш файла>-<часть>.parquet
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+
+TRAFFIC_DATASET = "transport_metrics"
+AIR_DATASET = "air_pollution"
+
+# Естественные ключи строк набора, как в таблицах БД
+DATASET_KEYS = {TRAFFIC_DATASET: TRANSPORT_KEY, AIR_DATASET: AIR_KEY}
+
+# Секции по дате в формате hive: фильтр по дате отбрасывает каталоги целиком
+PARTITIONING = ds.partitioning(pa.schema([("Дата", pa.date32())]), flavor="hive")
+
+
+def to_archive_table(df, columns):
+    """Типизированная таблица Arrow: адрес - словарь, дата и время - собственные типы"""
+    rows = prepare_frame(df, columns)
+    rows["Адрес"] = rows["Адрес"].astype("category")
+    rows["Время"] = pd.to_datetime(rows["Время"], format="%H:%M:%S", errors="coerce").dt.time
+    rows["Дата"] = pd.to_datetime(rows["Дата"]).dt.date
+    return pa.Table.from_pandas(rows.dropna(subset=["Дата"]), preserve_index=False)
+
+
+def _replace_rows(path, table, key, stem):
+    """Убирает из частей других файлов в затронутых секциях строки с теми же ключами, что и в table.
+
+    Так архив повторяет upsert в БД: исправленная выгрузка за уже загруженный день заменяет прежние строки,
+    а не дописывается рядом с ними.
+    """
+    other = [column for column in key if column != "Дата"]
+    replaced = 0
+    for day, keys in table.select(key).to_pandas().groupby("Дата"):
+        folder = os.path.join(path, f"Дата={day.isoformat()}")
+        if not os.path.isdir(folder):
+            continue
+        new_keys = pd.MultiIndex.from_frame(keys[other].astype(object))
+        for name in os.listdir(folder):
+            # Свои части (то же содержимое) перезапишет сама запись
+            if name.startswith(f"{stem}-") or not name.endswith(".parquet"):
+                continue
+            file = os.path.join(folder, name)
+            part = pq.read_table(file)
+            keep = ~pd.MultiIndex.from_frame(part.select(other).to_pandas().astype(object)).isin(new_keys)
+            if keep.all():
+                continue
+            replaced += int((~keep).sum())
+            if not keep.any():
+                os.remove(file)
+                continue
+            # Через временный файл: читатели архива не видят часть недописанной
+            tmp = os.path.join(folder, f".{name}.tmp")
+            pq.write_table(part.filter(pa.array(keep)), tmp)
+            os.replace(tmp, file)
+    return replaced
+
+
+def write_parquet(df, dataset, columns, digest, part=0):
+    """Дописывает строки в архив Parquet; строки с теми же ключами из других файлов заменяются.
+
+    Вызывается после фиксации строк в БД, чтобы в архиве не было данных откатившейся загрузки.
+    """
+    start = time.perf_counter()
+    # Имя части - хеш содержимого файла (file_registry.file_hash) и номер пачки: одноименные файлы
+    # не затирают друг друга, а тот же файл под другим именем не попадает в архив дважды
+    stem = digest[:16]
+    table = to_archive_table(df, columns)
+    path = os.path.join(ARCHIVE_DIR, dataset)
+    replaced = _replace_rows(path, table, DATASET_KEYS[dataset], stem) if dataset in DATASET_KEYS else 0
+    ds.write_dataset(
+        table,
+        path,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template=f"{stem}-{part}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore"
+    )
+    elapsed = time.perf_counter() - start
+    INGEST_STAGE_SECONDS.observe(elapsed, source=dataset, stage="archive")
+    logger.info(f"Архив {dataset}: {len(df)} строк записано (заменено прежних {replaced}) за {elapsed:.2f} с")
+
+
+def read_archive(dataset, columns=None, start_date=None, end_date=None):
+    """Читает из архива только нужные колонки и секции дат"""
+    path = os.path.join(ARCHIVE_DIR, dataset)
+    if not os.path.isdir(path):
+        return pd.DataFrame(columns=columns)
+
+    start = time.perf_counter()
+    archive = ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+    date = ds.field("Дата")
+    condition = None
+    if start_date is not None:
+        condition = date >= pd.to_datetime(start_date).date()
+    if end_date is not None:
+        upper = date <= pd.to_datetime(end_date).date()
+        condition = upper if condition is None else condition & upper
+
+    table = archive.to_table(columns=columns, filter=condition)
+    logger.info(f"Архив {dataset}: прочитано {table.num_rows} строк за {time.perf_counter() - start:.2f} с")
+    return table.to_pandas()
+
+
+def date_range(dataset):
+    """Первая и последняя даты архива по именам каталогов секций"""
+    path = os.path.join(ARCHIVE_DIR, dataset)
+    prefix = "Дата="
+    dates = sorted(
+        pd.to_datetime(name[len(prefix):]).date()
+        for name in (os.listdir(path) if os.path.isdir(path) else [])
+        if name.startswith(prefix)
+    )
+    return (dates[0], dates[-1]) if dates else (None, None)
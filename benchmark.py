@@ -0,0 +1,537 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import logging
+import argparse
+import platform
+import tempfile
+import uuid
+import statistics
+import subprocess
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+
+logger = logging.getLogger(__name__)
+
+# Масштаб 1 - одни сутки выгрузки, как transport_mertics_2025-03-17.csv (211 датчиков, ~4300 строк)
+# и air_mertics_2025-03-17.csv (посты контроля, по строке в час)
+DEFAULT_SCALES = (1, 30, 365)
+SENSORS = 211
+POSTS = 3
+# Доля часов, за которые у полосы есть запись (в исходной выгрузке пропусков много)
+TRAFFIC_HOUR_SHARE = 0.42
+START_DATE = pd.Timestamp("2025-03-17")
+
+# Сколько адресов выбирается в замере поиска по адресу (один поиск короче точности замера)
+LOOKUP_ADDRESSES = 20
+
+# Больше строк на листе Excel не помещается
+EXCEL_MAX_ROWS = 1048575
+
+# Префикс схемы PostgreSQL для замеров: каждый запуск создает свою схему bench_<случайный суффикс>
+# и удаляет только ее
+BENCH_SCHEMA = "bench"
+
+TRAFFIC_SHEET_COLUMNS = {
+    "Скорость": "Средняя скорость, км/ч (за период)",
+    "Поток": "Интенсивность, авто (за период)",
+}
+POLLUTANTS = ["CO(мг/м3)", "NO(мг/м3)", "NO2(мг/м3)", "SO2(мг/м3)"]
+
+
+def _sensors(rng):
+    """Адреса датчиков с координатами вокруг Тулы и числом направлений и полос"""
+    return pd.DataFrame({
+        "Адрес": [f"({2000 + i}) г. Тула, синтетический участок {i}" for i in range(SENSORS)],
+        "Долгота": 37.62 + rng.normal(0, 0.08, SENSORS),
+        "Широта": 54.19 + rng.normal(0, 0.05, SENSORS),
+        "directions": rng.integers(1, 3, SENSORS),
+        "lanes": rng.integers(1, 3, SENSORS),
+    })
+
+
+def make_traffic_frame(scale, seed=0):
+    """Транспортные данные за scale суток в виде transport_mertics_*.csv"""
+    rng = np.random.default_rng(seed)
+    sensors = _sensors(rng)
+    # Все сочетания датчик - направление - полоса
+    lanes = sensors.loc[sensors.index.repeat(sensors["directions"] * sensors["lanes"])].copy()
+    per_sensor = lanes.groupby(level=0).cumcount().to_numpy()
+    lanes["Направление"] = per_sensor // lanes["lanes"].to_numpy() + 1
+    lanes["Номер полосы"] = per_sensor % lanes["lanes"].to_numpy() + 1
+    lanes = lanes.reset_index(drop=True)
+
+    hours = scale * 24
+    keep = rng.random((len(lanes), hours)) < TRAFFIC_HOUR_SHARE
+    lane_idx, hour_idx = np.nonzero(keep)
+    rows = lanes.iloc[lane_idx].reset_index(drop=True)
+    stamps = START_DATE + pd.to_timedelta(hour_idx, unit="h")
+
+    n = len(rows)
+    # Немного строк с нулевыми показателями, которые отбрасывает очистка
+    speed = np.clip(rng.normal(45, 15, n), 0, 110).round(1)
+    speed[rng.random(n) < 0.02] = 0
+    flow = rng.poisson(25, n)
+    return pd.DataFrame({
+        "Адрес": rows["Адрес"],
+        "Направление": rows["Направление"],
+        "Номер полосы": rows["Номер полосы"],
+        "Дата": stamps.strftime("%d.%m.%Y"),
+        "Время": stamps.strftime("%H:%M:%S"),
+        "Скорость": speed,
+        "Поток": flow,
+        "Долгота": rows["Долгота"],
+        "Широта": rows["Широта"],
+    })
+
+
+def make_air_frame(scale, seed=0):
+    """Экологические данные за scale суток в виде air_mertics_*.csv"""
+    rng = np.random.default_rng(seed + 1)
+    hours = scale * 24
+    stamps = START_DATE + pd.to_timedelta(np.tile(np.arange(hours), POSTS), unit="h")
+    n = len(stamps)
+    frame = pd.DataFrame({
+        "Адрес": np.repeat([f"г. Тула, синтетический пост {i}" for i in range(POSTS)], hours),
+        "Дата": stamps.strftime("%d.%m.%Y"),
+        "Время": stamps.strftime("%H:%M:%S"),
+    })
+    for pollutant, mean in zip(POLLUTANTS, (3.7, 0.5, 15.2, 0.6)):
+        frame[pollutant] = rng.exponential(mean, n).round(3)
+    return frame
+
+
+def air_sheets(frame):
+    """Листы книги загрязнений: по показателю на лист, как в исходных выгрузках"""
+    return [frame[["Адрес", "Дата", "Время", pollutant]] for pollutant in POLLUTANTS]
+
+
+def write_traffic_workbook(frame, path):
+    """Книга в формате выгрузки: лист метрик и лист адресов с координатами"""
+    workbook = Workbook(write_only=True)
+    metrics = workbook.create_sheet("Метрики")
+    columns = ["Адрес", "Направление", "Номер полосы", "Дата", "Время", "Скорость", "Поток"]
+    metrics.append([TRAFFIC_SHEET_COLUMNS.get(column, column) for column in columns])
+    for row in frame[columns].itertuples(index=False):
+        metrics.append(list(row))
+
+    addresses = workbook.create_sheet("Адреса")
+    addresses.append(["Прочее", "Адресная привязка", "Долгота", "Широта"])
+    for row in frame.drop_duplicates("Адрес")[["Адрес", "Долгота", "Широта"]].itertuples(index=False):
+        addresses.append([1, *row])
+    workbook.save(path)
+
+
+def write_air_workbook(frame, path):
+    workbook = Workbook(write_only=True)
+    for sheet in air_sheets(frame):
+        worksheet = workbook.create_sheet(sheet.columns[-1].split("(")[0])
+        worksheet.append(list(sheet.columns))
+        for row in sheet.itertuples(index=False):
+            worksheet.append(list(row))
+    workbook.save(path)
+
+
+def measure(func, repeat=1):
+    """Время выполнения func: минимум, медиана и все замеры, с; возвращает также последний результат"""
+    runs = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        runs.append(round(time.perf_counter() - start, 4))
+    return {"min": min(runs), "median": round(statistics.median(runs), 4), "runs": runs}, result
+
+
+def bench_excel(traffic, air, workdir, repeat):
+    """Разбор книг Excel тем же кодом, что и при загрузке"""
+    import data_transfer
+    import data_transfer_air
+
+    if len(traffic) > EXCEL_MAX_ROWS:
+        return {"skipped": f"{len(traffic)} строк не помещаются на лист Excel"}, {}
+
+    traffic_path = os.path.join(workdir, "traffic.xlsx")
+    air_path = os.path.join(workdir, "air.xlsx")
+    write_traffic_workbook(traffic, traffic_path)
+    write_air_workbook(air, air_path)
+
+    timings = {}
+    timings["excel_parse_traffic"], parsed = measure(lambda: data_transfer.read_traffic_file(traffic_path), repeat)
+    timings["excel_parse_air"], _ = measure(lambda: data_transfer_air.read_air_sheets(air_path), repeat)
+    sizes = {
+        "traffic_xlsx": os.path.getsize(traffic_path),
+        "air_xlsx": os.path.getsize(air_path),
+        "traffic_rows_parsed": len(parsed),
+    }
+    return timings, sizes
+
+
+def is_production_dsn(dsn):
+    """Строка подключения указывает на рабочую БД из db_config"""
+    from psycopg2.extensions import parse_dsn
+    from db_config import DB_CONFIG
+
+    params = parse_dsn(dsn)
+    production = {key: str(value) for key, value in DB_CONFIG.items()}
+    database = params.get("dbname")
+    if database is None or database != production.get("dbname", production.get("database")):
+        return False
+    # Без хоста и порта psycopg2 подключается к тому же серверу по умолчанию
+    return all(params.get(key, production.get(key)) == production.get(key) for key in ("host", "port"))
+
+
+def _postgres_connection(dsn):
+    """Соединение с новой схемой для замеров в отдельной БД и имя схемы; None, если PostgreSQL недоступен"""
+    import psycopg2
+
+    # Своя схема на каждый запуск: чужие схемы, в том числе оставшиеся от прерванных замеров, не удаляются
+    schema = f"{BENCH_SCHEMA}_{uuid.uuid4().hex[:8]}"
+    try:
+        conn = psycopg2.connect(dsn, options=f"-c search_path={schema}")
+    except Exception as e:
+        logger.warning(f"PostgreSQL недоступен, загрузка замеряется на SQLite: {e}")
+        return None, None
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA {schema}")
+    conn.commit()
+    return conn, schema
+
+
+def bench_postgres(conn, traffic, merged_air):
+    """Загрузка тем же путем, что и при обработке файлов: пачками, с агрегатами, в отдельной схеме"""
+    import data_transfer
+    import data_transfer_air
+    from rollups import ensure_rollup_tables
+
+    with conn.cursor() as cursor:
+        data_transfer.create_transport_table(cursor, "transport_metrics")
+        ensure_rollup_tables(cursor, "transport_metrics")
+        data_transfer_air.create_air_table(cursor, "air_pollution")
+        conn.commit()
+
+        def load_traffic():
+            for start in range(0, len(traffic), data_transfer.CHUNK_SIZE):
+                data_transfer.load_chunk(cursor, traffic.iloc[start:start + data_transfer.CHUNK_SIZE], "transport_metrics")
+                conn.commit()
+
+        def load_air():
+            data_transfer_air.load_chunk(cursor, merged_air, "air_pollution")
+            conn.commit()
+
+        timings = {}
+        timings["db_load_traffic"], _ = measure(load_traffic)
+        timings["db_load_air"], _ = measure(load_air)
+        # Повторная загрузка тех же строк: путь обновления по естественному ключу
+        timings["db_reload_traffic"], _ = measure(load_traffic)
+    return timings
+
+
+def bench_sqlite(traffic, merged_air):
+    """Замена PostgreSQL, когда его нет: вставка тех же таблиц в SQLite в памяти"""
+    import data_transfer
+
+    conn = sqlite3.connect(":memory:")
+    try:
+        timings = {}
+        timings["db_load_traffic"], _ = measure(lambda: traffic.to_sql(
+            "transport_metrics", conn, if_exists="append", index=False, chunksize=data_transfer.CHUNK_SIZE))
+        timings["db_load_air"], _ = measure(lambda: merged_air.to_sql(
+            "air_pollution", conn, if_exists="append", index=False))
+        return timings
+    finally:
+        conn.close()
+
+
+def bench_archive_formats(traffic, workdir, repeat):
+    """Архив транспортных данных в CSV (ARCHIVE_FORMAT=csv) и в Parquet: запись, чтение всего архива и одних суток"""
+    import archive
+    from bulk_load import TRANSPORT_COLUMNS
+    from data_store import TRANSPORT_ARCHIVE_COLUMNS
+
+    csv_file = os.path.join(workdir, "transport_metrics.csv")
+    parquet_dir = os.path.join(workdir, "archive_formats")
+    day = START_DATE.date()
+
+    def read_csv():
+        # Дата в выгрузке - '17.03.2025': без разбора по ней нельзя отобрать период
+        df = pd.read_csv(csv_file, usecols=TRANSPORT_ARCHIVE_COLUMNS)
+        df["Дата"] = pd.to_datetime(df["Дата"], format="%d.%m.%Y").dt.date
+        return df
+
+    timings = {}
+    timings["archive_csv_write"], _ = measure(lambda: traffic.to_csv(csv_file, index=False, encoding="utf-8"), repeat)
+    timings["archive_csv_read"], _ = measure(read_csv, repeat)
+    # CSV читается целиком и в любом случае, Parquet - только секция нужной даты
+    timings["archive_csv_read_day"], _ = measure(lambda: (lambda df: df[df["Дата"] == day])(read_csv()), repeat)
+
+    previous_dir = archive.ARCHIVE_DIR
+    archive.ARCHIVE_DIR = parquet_dir
+    try:
+        timings["archive_parquet_write"], _ = measure(
+            lambda: archive.write_parquet(traffic, archive.TRAFFIC_DATASET, TRANSPORT_COLUMNS, "bench"), repeat)
+        timings["archive_parquet_read"], _ = measure(
+            lambda: archive.read_archive(archive.TRAFFIC_DATASET, TRANSPORT_ARCHIVE_COLUMNS), repeat)
+        timings["archive_parquet_read_day"], _ = measure(
+            lambda: archive.read_archive(archive.TRAFFIC_DATASET, TRANSPORT_ARCHIVE_COLUMNS, day, day), repeat)
+    finally:
+        archive.ARCHIVE_DIR = previous_dir
+
+    sizes = {
+        "archive_csv_bytes": os.path.getsize(csv_file),
+        "archive_parquet_bytes": sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(parquet_dir) for name in names
+        ),
+    }
+    return timings, sizes
+
+
+# Вызовы callback дашборда: имя -> функция от (адрес, пост, начало, конец, версия)
+CALLBACKS = {
+    "update_address_dropdown": lambda d, address, post, start, end, version: d.update_address_dropdown(start, end, version),
+    "update_comparison_graph": lambda d, address, post, start, end, version: d.update_comparison_graph(address, start, end, version),
+    "update_los_table": lambda d, address, post, start, end, version: d.los_table_page(
+        address, start, end, 0, 15, [{"column_id": "LOS_z", "direction": "desc"}], "{LOS_kv} != A", version),
+    "update_top_flow_graph": lambda d, address, post, start, end, version: d.update_top_flow_graph(start, end, version),
+    "update_low_speed_graph": lambda d, address, post, start, end, version: d.update_low_speed_graph(start, end, version),
+    "update_map": lambda d, address, post, start, end, version: d.update_map(start, end, version),
+    "update_pollution_series": lambda d, address, post, start, end, version: d.update_pollution_series(
+        post, version),
+    "update_correlation_graph": lambda d, address, post, start, end, version: d.update_correlation_graph(
+        1000, "no2", start, end, version),
+}
+
+
+def bench_callbacks(traffic, air, workdir, repeat):
+    """Callback дашборда, вызванные напрямую на данных из архива Parquet (режим archive)"""
+    import archive
+    import correlation
+    from bulk_load import TRANSPORT_COLUMNS, AIR_COLUMNS
+    from plotly.utils import PlotlyJSONEncoder
+
+    # Архив каждого масштаба - в своем каталоге; модуль archive читает ARCHIVE_DIR при каждом обращении
+    archive.ARCHIVE_DIR = os.path.join(workdir, "archive")
+    os.environ["ARCHIVE_DIR"] = archive.ARCHIVE_DIR
+
+    def write_archive():
+        archive.write_parquet(traffic, archive.TRAFFIC_DATASET, TRANSPORT_COLUMNS, "bench")
+        archive.write_parquet(air, archive.AIR_DATASET, AIR_COLUMNS, "bench")
+
+    timings = {}
+    timings["archive_write"], _ = measure(write_archive)
+
+    # Синтетические посты ставятся у первых датчиков, чтобы у каждого были соседи для корреляций
+    stations_file = os.path.join(workdir, "air_stations.csv")
+    sensors = traffic.drop_duplicates("Адрес")
+    pd.DataFrame({
+        "Адрес": air["Адрес"].unique(),
+        "Широта": sensors["Широта"].iloc[:POSTS].to_numpy(),
+        "Долгота": sensors["Долгота"].iloc[:POSTS].to_numpy(),
+    }).to_csv(stations_file, index=False)
+    correlation.AIR_STATIONS_FILE = stations_file
+
+    # Дашборд импортируется после подготовки архива: при импорте он читает диапазон дат
+    import dashboard
+    store = dashboard.store
+    # Первая загрузка дожидается фоновой, замеряется полное перечитывание архива
+    store.refresh()
+    timings["store_load"], _ = measure(store.refresh, repeat)
+
+    start, end = (date.isoformat() for date in store.date_range())
+    address = traffic["Адрес"].iloc[0]
+    post = air["Адрес"].iloc[0]
+
+    # Выборка адреса за период в памяти: маска по всей таблице, как до AddressIndex, и срез блока адреса в индексе
+    from data_store import _in_range
+    addresses = traffic["Адрес"].drop_duplicates().iloc[:LOOKUP_ADDRESSES].tolist()
+
+    def lookup_mask():
+        for name in addresses:
+            df = _in_range(store._transport, start, end)
+            df[df["Адрес"] == name]
+
+    def lookup_index():
+        for name in addresses:
+            store.transport_range(start, end, name)
+
+    timings["address_lookup_mask"], _ = measure(lookup_mask, repeat)
+    timings["address_lookup_index"], _ = measure(lookup_index, repeat)
+
+    sizes = {}
+    for name, call in CALLBACKS.items():
+        def run():
+            # Каждый замер - с пустыми кэшами, как первый запрос за период
+            dashboard.figure_cache.clear()
+            for cached in (dashboard.address_summary, dashboard.map_slice,
+                           dashboard.correlation_slice, dashboard.los_frame, dashboard.sorted_los_frame):
+                cached.cache_clear()
+            return call(dashboard, address, post, start, end, store.version)
+
+        timings[name], result = measure(run, repeat)
+        serialize, payload = measure(lambda: json.dumps(result, cls=PlotlyJSONEncoder), repeat)
+        timings[f"{name}_serialize"] = serialize
+        sizes[f"{name}_bytes"] = len(payload.encode("utf-8"))
+    return timings, sizes
+
+
+def run_scale(scale, seed, repeat, backend, excel, workdir, dsn=None):
+    """Все замеры для одного масштаба"""
+    import data_transfer_air
+
+    logger.info(f"Масштаб {scale}: генерация данных")
+    traffic = make_traffic_frame(scale, seed)
+    air = make_air_frame(scale, seed)
+    report = {"rows": {"traffic": len(traffic), "air": len(air)}, "timings": {}, "sizes": {}}
+
+    if excel:
+        timings, sizes = bench_excel(traffic, air, workdir, repeat)
+        report["timings"].update(timings if "skipped" not in timings else {})
+        report["sizes"].update(sizes)
+        if "skipped" in timings:
+            report["excel_skipped"] = timings["skipped"]
+
+    report["timings"]["merge_air"], merged_air = measure(lambda: data_transfer_air.merge_air_sheets(air_sheets(air)), repeat)
+
+    if backend == "postgres":
+        conn, schema = _postgres_connection(dsn)
+        if conn is None:
+            backend = "sqlite"
+        else:
+            try:
+                report["timings"].update(bench_postgres(conn, traffic, merged_air))
+            finally:
+                # Удаляется только схема, созданная этим запуском
+                conn.rollback()
+                with conn.cursor() as cursor:
+                    cursor.execute(f"DROP SCHEMA {schema} CASCADE")
+                conn.commit()
+                conn.close()
+    if backend == "sqlite":
+        report["timings"].update(bench_sqlite(traffic, merged_air))
+    report["db_backend"] = backend
+
+    timings, sizes = bench_archive_formats(traffic, workdir, repeat)
+    report["timings"].update(timings)
+    report["sizes"].update(sizes)
+
+    timings, sizes = bench_callbacks(traffic, air, workdir, repeat)
+    report["timings"].update(timings)
+    report["sizes"].update(sizes)
+    return report
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(scales, seed=0, repeat=3, backend="sqlite", excel=True, dsn=None):
+    """Запускает замеры для всех масштабов и возвращает отчет.
+
+    Для backend="postgres" нужна строка подключения dsn к отдельной БД, не к рабочей.
+    """
+    if backend == "postgres" and (not dsn or is_production_dsn(dsn)):
+        raise ValueError("Для замеров PostgreSQL нужна отдельная БД (--dsn), а не рабочая из db_config")
+    report = {
+        "commit": _git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "seed": seed,
+        "repeat": repeat,
+        "scales": {},
+    }
+
+    root = tempfile.mkdtemp(prefix="benchmark-")
+    # Данные дашборда читаются из архива во временном каталоге, БД для этого не нужна
+    os.environ["DASHBOARD_DATA_SOURCE"] = "archive"
+    try:
+        for scale in scales:
+            workdir = os.path.join(root, f"x{scale}")
+            os.makedirs(workdir)
+            report["scales"][str(scale)] = run_scale(scale, seed, repeat, backend, excel, workdir, dsn)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return report
+
+
+# Разница меньше этой считается шумом, с
+COMPARE_MIN_SECONDS = 0.005
+
+
+def compare(report, baseline, threshold=0.1):
+    """Сравнивает медианы замеров с отчетом другого коммита; возвращает строки с замедлением больше threshold"""
+    slower = []
+    print(f"Сравнение {baseline.get('commit')} -> {report.get('commit')}")
+    for scale, current in report["scales"].items():
+        previous = baseline.get("scales", {}).get(scale)
+        if previous is None:
+            continue
+        for name, timing in current["timings"].items():
+            before = previous["timings"].get(name)
+            if not before or not before["median"]:
+                continue
+            # Загрузку в разные СУБД не сравниваем
+            if name.startswith("db_") and current.get("db_backend") != previous.get("db_backend"):
+                continue
+            ratio = timing["median"] / before["median"]
+            noticeable = abs(timing["median"] - before["median"]) >= COMPARE_MIN_SECONDS
+            mark = ""
+            if noticeable and ratio > 1 + threshold:
+                mark = "  медленнее"
+                slower.append((scale, name, ratio))
+            elif noticeable and ratio < 1 - threshold:
+                mark = "  быстрее"
+            print(f"x{scale:>4} {name:<36} {before['median']:>9.4f} -> {timing['median']:>9.4f} с ({ratio:5.2f}){mark}")
+    return slower
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stdout,
+        force=True
+    )
+    parser = argparse.ArgumentParser(description="Замеры разбора, загрузки и callback дашборда на синтетических данных")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES), help="число суток данных")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="повторов каждого замера (кроме загрузки в БД)")
+    parser.add_argument("--db", choices=["postgres", "sqlite", "none"],
+                        help="куда загружать: PostgreSQL (нужен --dsn), SQLite в памяти или никуда; "
+                             "по умолчанию postgres, если задан --dsn, иначе sqlite")
+    parser.add_argument("--dsn", help="строка подключения к отдельной БД для замеров, например "
+                                      "'dbname=bench host=localhost'; рабочая БД из db_config не принимается")
+    parser.add_argument("--no-excel", action="store_true", help="не замерять разбор книг Excel")
+    parser.add_argument("--output", default="benchmark-report.json")
+    parser.add_argument("--compare", help="отчет другого коммита для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.1, help="допустимое замедление при сравнении, доля")
+    args = parser.parse_args()
+    backend = args.db or ("postgres" if args.dsn else "sqlite")
+    if backend == "postgres" and not args.dsn:
+        parser.error("--db postgres требует --dsn: замеры создают и удаляют таблицы, рабочую БД они не трогают")
+    if backend == "postgres" and is_production_dsn(args.dsn):
+        parser.error("--dsn указывает на рабочую БД из db_config: для замеров нужна отдельная БД")
+
+    report = run(args.scales, args.seed, args.repeat, backend, not args.no_excel, args.dsn)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Отчет сохранен в {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            slower = compare(report, json.load(f), args.threshold)
+        sys.exit(1 if slower else 0)
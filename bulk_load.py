@@ -0,0 +1,214 @@
+import io
+import time
+import logging
+import pandas as pd
+from psycopg2 import sql
+from psycopg2.extras import execute_batch
+from change_log import record_changes
+
+
+logger = logging.getLogger(__name__)
+
+
+# Соответствие колонок таблицы колонкам DataFrame: (колонка в БД, колонка в DataFrame, тип)
+TRANSPORT_COLUMNS = [
+    ("Адрес", "Адрес", "text"),
+    ("Время", "Время", "time"),
+    ("Направление", "Направление", "int"),
+    ("Номер_полосы", "Номер полосы", "int"),
+    ("Скорость", "Скорость", "float"),
+    ("Поток", "Поток", "int"),
+    ("Широта", "Широта", "float"),
+    ("Долгота", "Долгота", "float"),
+    ("Дата", "Дата", "date"),
+]
+
+AIR_COLUMNS = [
+    ("Адрес", "Адрес", "text"),
+    ("Время", "Время", "time"),
+    ("CO", "CO(мг/м3)", "float"),
+    ("NO", "NO(мг/м3)", "float"),
+    ("NO2", "NO2(мг/м3)", "float"),
+    ("SO2", "SO2(мг/м3)", "float"),
+    ("Дата", "Дата", "date"),
+]
+
+# Естественные ключи: одна запись на адрес, дату и время (для транспорта - еще на направление и полосу)
+TRANSPORT_KEY = ["Адрес", "Дата", "Время", "Направление", "Номер_полосы"]
+AIR_KEY = ["Адрес", "Дата", "Время"]
+
+
+def _prepare_column(series, kind):
+    """Приводит целую колонку к виду, который PostgreSQL примет в COPY"""
+    if kind == "date":
+        # В выгрузках дата приходит как '17.03.2025', поэтому явно указываем dayfirst
+        dates = series if pd.api.types.is_datetime64_any_dtype(series) else pd.to_datetime(series, dayfirst=True, errors="coerce")
+        return dates.dt.strftime("%Y-%m-%d")
+    if kind == "time":
+        return series.astype("string")
+    if kind == "int":
+        return pd.to_numeric(series, errors="coerce").round(0).astype("Int64")
+    if kind == "float":
+        return pd.to_numeric(series, errors="coerce")
+    return series
+
+
+def prepare_frame(df, columns):
+    """Собирает DataFrame с колонками в порядке таблицы"""
+    return pd.DataFrame({
+        db_column: _prepare_column(df[df_column], kind)
+        for db_column, df_column, kind in columns
+    })
+
+
+def _column_list(columns):
+    # Имена колонок не экранируем: таблицы созданы без кавычек (CO -> co)
+    return sql.SQL(", ").join(sql.SQL(db_column) for db_column, _, _ in columns)
+
+
+def _key_list(key):
+    return sql.SQL(", ").join(map(sql.SQL, key))
+
+
+def _log_speed(method, rows, table_name, elapsed):
+    speed = rows / elapsed if elapsed > 0 else float("inf")
+    logger.info(f"{method}: {rows} записей в {table_name} за {elapsed:.2f} с ({speed:.0f} строк/с)")
+
+
+def _copy_rows(cursor, df, table_name, columns):
+    # CSV формируется целиком по колонкам, без построчного обхода
+    buffer = io.StringIO()
+    prepare_frame(df, columns).to_csv(buffer, index=False, header=False, na_rep="")
+    buffer.seek(0)
+
+    copy_query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+        sql.Identifier(table_name),
+        _column_list(columns)
+    )
+    cursor.copy_expert(copy_query, buffer)
+
+
+def copy_dataframe(cursor, df, table_name, columns):
+    """Загружает DataFrame в таблицу через COPY ... FROM STDIN"""
+    start = time.perf_counter()
+    _copy_rows(cursor, df, table_name, columns)
+    _log_speed("COPY", len(df), table_name, time.perf_counter() - start)
+    return len(df)
+
+
+def upsert_dataframe(cursor, df, table_name, columns, key):
+    """Загружает DataFrame через COPY во временную таблицу и переносит строки с INSERT ... ON CONFLICT.
+
+    Обновленная строка сохраняет прежний id, поэтому даты вставленных и измененных строк
+    записываются в журнал изменений: по нему дашборд перечитывает эти дни.
+    """
+    start = time.perf_counter()
+    stage = f"{table_name}_stage"
+    values = [sql.SQL(db_column) for db_column, _, _ in columns if db_column not in key]
+
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(stage)))
+    cursor.execute(sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA").format(
+        sql.Identifier(stage), _column_list(columns), sql.Identifier(table_name)))
+    _copy_rows(cursor, df, stage, columns)
+
+    # Сколько ключей пачки уже есть в таблице: остальные будут вставлены
+    cursor.execute(sql.SQL("SELECT count(*), count(t.id) FROM (SELECT DISTINCT {key} FROM {stage}) s LEFT JOIN {table} t USING ({key})").format(
+        key=_key_list(key), stage=sql.Identifier(stage), table=sql.Identifier(table_name)))
+    distinct, existing = cursor.fetchone()
+
+    # Повторы внутри пачки схлопываются DISTINCT ON: одна строка не может обновиться дважды за запрос.
+    # Строка с теми же значениями не перезаписывается и в RETURNING не попадает
+    cursor.execute(sql.SQL("""
+    WITH written AS (
+        INSERT INTO {table} AS t ({columns})
+        SELECT DISTINCT ON ({key}) {columns} FROM {stage} ORDER BY {key}
+        ON CONFLICT ({key}) DO UPDATE SET ({values}) = ROW({excluded})
+        WHERE ({current}) IS DISTINCT FROM ({excluded})
+        RETURNING t.Дата
+    )
+    SELECT Дата, count(*) FROM written GROUP BY Дата
+    """).format(
+        table=sql.Identifier(table_name),
+        columns=_column_list(columns),
+        key=_key_list(key),
+        stage=sql.Identifier(stage),
+        values=sql.SQL(", ").join(values),
+        excluded=sql.SQL(", ").join(sql.SQL("EXCLUDED.") + value for value in values),
+        current=sql.SQL(", ").join(sql.SQL("t.") + value for value in values)
+    ))
+    written = cursor.fetchall()
+    changed = sum(count for _, count in written)
+    inserted = distinct - existing
+    # Повторная загрузка того же файла ничего не меняет и не заставляет дашборд перечитывать данные
+    record_changes(cursor, table_name, pd.Series([date for date, _ in written], dtype="object"))
+
+    _log_speed("UPSERT", len(df), table_name, time.perf_counter() - start)
+    logger.info(
+        f"{table_name}: добавлено {inserted}, обновлено {changed - inserted}, "
+        f"без изменений {len(df) - changed} строк"
+    )
+    return changed
+
+
+def ensure_unique_key(cursor, table_name, key):
+    """Создает уникальный индекс по естественному ключу, предварительно удалив ранее загруженные повторы"""
+    index_name = f"{table_name}_natural_key"
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (index_name,))
+    if cursor.fetchone()[0]:
+        return 0
+    # Две первые загрузки иначе обе не найдут индекс и обе начнут его создавать: вторая упадет.
+    # Блокировка держится до конца транзакции вызывающего, вторая проверка выполняется уже под ней
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"unique_key:{table_name}",))
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (index_name,))
+    if cursor.fetchone()[0]:
+        return 0
+
+    # Из повторов оставляем строку, загруженную первой
+    cursor.execute(sql.SQL("DELETE FROM {table} a USING {table} b WHERE a.id > b.id AND {condition}").format(
+        table=sql.Identifier(table_name),
+        condition=sql.SQL(" AND ").join(sql.SQL("a.{0} = b.{0}").format(sql.SQL(column)) for column in key)
+    ))
+    removed = cursor.rowcount
+    if removed:
+        logger.warning(f"Из таблицы {table_name} удалено {removed} повторно загруженных строк")
+
+    cursor.execute(sql.SQL("CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} ({})").format(
+        sql.Identifier(index_name), sql.Identifier(table_name), _key_list(key)))
+    return removed
+
+
+def insert_dataframe_batch(cursor, df, table_name, columns):
+    """Прежний способ загрузки через execute_batch, оставлен для сравнения"""
+    start = time.perf_counter()
+
+    records = []
+    for _, row in df.iterrows():
+        records.append(tuple(row[df_column] for _, df_column, _ in columns))
+
+    insert_query = sql.SQL("INSERT INTO {} ({}) VALUES ({})").format(
+        sql.Identifier(table_name),
+        _column_list(columns),
+        sql.SQL(", ").join(sql.Placeholder() * len(columns))
+    )
+    execute_batch(cursor, insert_query, records)
+
+    _log_speed("execute_batch", len(df), table_name, time.perf_counter() - start)
+    return len(df)
+
+
+def bulk_load(cursor, df, table_name, columns, method="copy", key=None):
+    """Загружает DataFrame выбранным способом: 'copy' (по умолчанию), 'upsert' по ключу key или 'batch'.
+
+    Даты записанных строк попадают в журнал изменений (change_log.py) в той же транзакции.
+    """
+    if method == "upsert":
+        return upsert_dataframe(cursor, df, table_name, columns, key)
+    if method == "copy":
+        loaded = copy_dataframe(cursor, df, table_name, columns)
+    elif method == "batch":
+        loaded = insert_dataframe_batch(cursor, df, table_name, columns)
+    else:
+        raise ValueError(f"Неизвестный способ загрузки: {method}")
+    date_column = next(df_column for _, df_column, kind in columns if kind == "date")
+    record_changes(cursor, table_name, df[date_column])
+    return loaded
@@ -0,0 +1,45 @@
+import logging
+import pandas as pd
+from psycopg2.extras import execute_values
+
+
+logger = logging.getLogger(__name__)
+
+CHANGES_TABLE = "data_changes"
+
+# Даты, строки за которые добавила или изменила загрузка, с номером ее транзакции.
+# id строк для этого не годится: SERIAL выдается при вставке, а не при фиксации, и параллельная загрузка
+# с меньшими id может зафиксироваться позже; к тому же upsert сохраняет id измененной строки
+CHANGES_DDL = f"""
+CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+    id BIGSERIAL PRIMARY KEY,
+    Таблица TEXT NOT NULL,
+    Дата DATE NOT NULL,
+    Транзакция BIGINT NOT NULL DEFAULT txid_current()
+)
+"""
+
+
+def ensure_change_log(cursor):
+    """Создает журнал изменений, если его нет"""
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (f"{CHANGES_TABLE}_xact_idx",))
+    if cursor.fetchone()[0]:
+        return
+    # Параллельные CREATE TABLE IF NOT EXISTS могут столкнуться в системном каталоге
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('data_changes:ddl'))")
+    cursor.execute(CHANGES_DDL)
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {CHANGES_TABLE}_xact_idx ON {CHANGES_TABLE} (Транзакция)"
+    )
+
+
+def record_changes(cursor, table_name, dates):
+    """Записывает даты загруженной пачки в той же транзакции, что и сами строки"""
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        # В выгрузках дата приходит как '17.03.2025'
+        dates = pd.to_datetime(dates, dayfirst=True, errors="coerce")
+    days = sorted(set(dates.dropna().dt.date))
+    if days:
+        execute_values(cursor, f"INSERT INTO {CHANGES_TABLE} (Таблица, Дата) VALUES %s",
+                       [(table_name, day) for day in days])
+    return len(days)
@@ -0,0 +1,229 @@
+import os
+import re
+import time
+import logging
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+# Датчики в этом радиусе от поста контроля считаются влияющими на его показания, м
+CORRELATION_RADIUS_M = float(os.environ.get("CORRELATION_RADIUS_M", 1000))
+
+# Наибольший сдвиг, ч: показания поста сравниваются с потоком за 0..N часов до них
+CORRELATION_MAX_LAG = int(os.environ.get("CORRELATION_MAX_LAG", 6))
+
+# Меньше общих часов - коэффициент не считается
+CORRELATION_MIN_HOURS = int(os.environ.get("CORRELATION_MIN_HOURS", 8))
+
+# Координаты постов вручную: CSV с колонками Адрес, Широта, Долгота.
+# Посты, которых нет в файле, получают координаты датчиков на том же перекрестке
+AIR_STATIONS_FILE = os.environ.get("AIR_STATIONS_FILE", "air_stations.csv")
+
+CORRELATION_POLLUTANTS = ("no2", "co")
+
+EARTH_RADIUS_M = 6371000.0
+
+# Типы улиц не входят в название: 'Болдина ул.' и 'ул. Болдина' - одна улица
+_STREET_TYPES = re.compile(
+    r"(?<!\w)(ул|улица|просп|проспект|пр-т|пер|переулок|ш|шоссе|пл|площадь|б-р|бульвар|наб|проезд|пр-д)\.?(?!\w)"
+)
+
+
+def _street_name(text):
+    name = _STREET_TYPES.sub(" ", text.lower().replace("ё", "е"))
+    return " ".join(re.sub(r"[^\w\s-]", " ", name).split())
+
+
+def intersection_key(address):
+    """Город и набор улиц перекрестка: '(2023) г. Тула, ул. Болдина – ул. Макаренко (к ...)' -> ('г тула', {'болдина', 'макаренко'})"""
+    # Год установки в начале и направление движения в скобках в конце к месту не относятся
+    text = re.sub(r"^\(\d+\)\s*", "", str(address))
+    text = re.sub(r"\s*\([^)]*\)\s*$", "", text)
+    city, _, streets = text.partition(",")
+    names = (_street_name(name) for name in re.split(r"\s+[–—-]\s+", streets))
+    return _street_name(city), frozenset(name for name in names if name)
+
+
+def _project(lat, lon, origin_lat):
+    """Координаты в метрах на плоскости (равнопромежуточная проекция, для масштабов города достаточно)"""
+    lat = np.radians(np.asarray(lat, dtype="float64"))
+    lon = np.radians(np.asarray(lon, dtype="float64"))
+    return EARTH_RADIUS_M * lon * np.cos(np.radians(origin_lat)), EARTH_RADIUS_M * lat
+
+
+class GridIndex:
+    """Пространственный индекс точек по ячейкам квадратной сетки: поиск в радиусе просматривает 3x3 ячейки"""
+
+    # Сдвиг номеров ячеек, чтобы ключ ячейки был неотрицательным
+    _OFFSET = 2**20
+
+    def __init__(self, lat, lon, cell_m):
+        self.cell_m = cell_m
+        self.origin_lat = float(np.nanmean(lat)) if len(lat) else 0.0
+        self.x, self.y = _project(lat, lon, self.origin_lat)
+        keys = self._keys(np.floor(self.x / cell_m), np.floor(self.y / cell_m))
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+
+    def _keys(self, cx, cy):
+        return (cx.astype("int64") + self._OFFSET) * 2**21 + (cy.astype("int64") + self._OFFSET)
+
+    def query(self, lat, lon, radius_m):
+        """Номера точек не дальше radius_m от (lat, lon) и расстояния до них, м"""
+        if radius_m > self.cell_m:
+            raise ValueError(f"Радиус {radius_m} м больше ячейки индекса {self.cell_m} м")
+        px, py = _project(lat, lon, self.origin_lat)
+        cx, cy = np.floor(px / self.cell_m), np.floor(py / self.cell_m)
+        neighbours = self._keys(np.array([cx + dx for dx in (-1, 0, 1) for _ in range(3)]),
+                                np.array([cy + dy for _ in range(3) for dy in (-1, 0, 1)]))
+        starts = np.searchsorted(self.keys, neighbours, side="left")
+        stops = np.searchsorted(self.keys, neighbours, side="right")
+        candidates = np.concatenate([self.order[a:b] for a, b in zip(starts, stops)])
+        distances = np.hypot(self.x[candidates] - px, self.y[candidates] - py)
+        near = distances <= radius_m
+        return candidates[near], distances[near]
+
+
+def sensor_locations(hourly_flow):
+    """Уникальные датчики с координатами"""
+    sensors = hourly_flow.dropna(subset=["lat", "lon"]).drop_duplicates("Адрес")[["Адрес", "lat", "lon"]]
+    sensors = sensors.assign(Адрес=sensors["Адрес"].astype(str))
+    return sensors.reset_index(drop=True)
+
+
+def _read_station_file(path):
+    if not path or not os.path.exists(path):
+        return pd.DataFrame(columns=["Адрес", "lat", "lon"])
+    stations = pd.read_csv(path).rename(columns={"Широта": "lat", "Долгота": "lon"})
+    return stations[["Адрес", "lat", "lon"]]
+
+
+def station_locations(station_addresses, sensors, stations_file=None):
+    """Координаты постов: из файла или как центр датчиков того же перекрестка; без координат - NaN"""
+    stations_file = stations_file or AIR_STATIONS_FILE
+    known = _read_station_file(stations_file).set_index("Адрес")
+    sensor_keys = sensors.assign(key=sensors["Адрес"].map(intersection_key))
+
+    rows = []
+    for address in station_addresses:
+        if address in known.index:
+            lat, lon = known.loc[address, ["lat", "lon"]]
+            rows.append((address, lat, lon, "файл"))
+            continue
+        same = sensor_keys[sensor_keys["key"] == intersection_key(address)]
+        if len(same):
+            rows.append((address, same["lat"].median(), same["lon"].median(), f"перекресток ({len(same)} датч.)"))
+        else:
+            rows.append((address, np.nan, np.nan, None))
+    stations = pd.DataFrame(rows, columns=["Адрес", "lat", "lon", "source"])
+
+    missing = stations.loc[stations["source"].isna(), "Адрес"].tolist()
+    if missing:
+        logger.warning(f"Нет координат постов {missing}: добавьте их в {stations_file}")
+    return stations
+
+
+def assign_sensors(stations, sensors, radius_m=CORRELATION_RADIUS_M):
+    """Пары пост - датчик не дальше radius_m с расстоянием, м"""
+    index = GridIndex(sensors["lat"].to_numpy(), sensors["lon"].to_numpy(), cell_m=radius_m)
+    pairs = []
+    for station in stations.dropna(subset=["lat", "lon"]).itertuples(index=False):
+        found, distances = index.query(station.lat, station.lon, radius_m)
+        pairs.extend((station.Адрес, sensors["Адрес"].iat[i], d) for i, d in zip(found, distances))
+    return pd.DataFrame(pairs, columns=["station", "sensor", "distance"])
+
+
+def _hour_axis(start_date, end_date):
+    """Все часы периода подряд: пропуски в данных становятся NaN, а не сдвигают ряды"""
+    return pd.date_range(pd.to_datetime(start_date).normalize(), pd.to_datetime(end_date).normalize()
+                         + pd.Timedelta(hours=23), freq="h")
+
+
+def hourly_matrix(frame, value, hours, columns, aggfunc="sum"):
+    """Матрица час x адрес: строки - часы периода, колонки - адреса в порядке columns"""
+    stamps = frame["date"] + pd.to_timedelta(frame["hour"], unit="h")
+    table = frame.assign(stamp=stamps, Адрес=frame["Адрес"].astype(str)).pivot_table(
+        index="stamp", columns="Адрес", values=value, aggfunc=aggfunc)
+    return table.reindex(index=hours, columns=columns).to_numpy(dtype="float64")
+
+
+def station_flow(flow, assignments, sensors, stations):
+    """Суммарный поток датчиков каждого поста по часам (NaN, если нет данных ни одного датчика)"""
+    sensor_pos = pd.Series(np.arange(len(sensors)), index=sensors)
+    station_pos = pd.Series(np.arange(len(stations)), index=stations)
+    membership = np.zeros((len(sensors), len(stations)))
+    membership[sensor_pos[assignments["sensor"]].to_numpy(), station_pos[assignments["station"]].to_numpy()] = 1
+
+    observed = ~np.isnan(flow)
+    total = np.where(observed, flow, 0) @ membership
+    reporting = observed.astype("float64") @ membership
+    return np.where(reporting > 0, total, np.nan)
+
+
+def lagged_correlation(x, y, max_lag=CORRELATION_MAX_LAG, min_hours=CORRELATION_MIN_HOURS):
+    """Корреляция Пирсона x[t - lag] и y[t] для каждой колонки и лага 0..max_lag.
+
+    x, y - матрицы час x пост; возвращает коэффициенты и число общих часов, обе размером (лаги, посты).
+    """
+    hours, columns = x.shape
+    r = np.full((max_lag + 1, columns), np.nan)
+    n = np.zeros((max_lag + 1, columns), dtype="int64")
+    for lag in range(min(max_lag, hours - 1) + 1):
+        a, b = x[:hours - lag], y[lag:]
+        valid = ~np.isnan(a) & ~np.isnan(b)
+        count = valid.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            da = np.where(valid, a - np.where(valid, a, 0).sum(axis=0) / count, 0)
+            db = np.where(valid, b - np.where(valid, b, 0).sum(axis=0) / count, 0)
+            coefficient = (da * db).sum(axis=0) / np.sqrt((da ** 2).sum(axis=0) * (db ** 2).sum(axis=0))
+        r[lag] = np.where(count >= min_hours, coefficient, np.nan)
+        n[lag] = count
+    return r, n
+
+
+def station_correlations(hourly_flow, pollution, start_date, end_date, radius_m=CORRELATION_RADIUS_M,
+                         max_lag=CORRELATION_MAX_LAG, pollutants=CORRELATION_POLLUTANTS):
+    """Посты с координатами и датчиками в радиусе и корреляции их показаний с потоком этих датчиков по лагам"""
+    start = time.perf_counter()
+    sensors = sensor_locations(hourly_flow)
+    stations = station_locations(sorted(pollution["Адрес"].astype(str).unique()), sensors)
+    assignments = assign_sensors(stations, sensors, radius_m) if len(sensors) else \
+        pd.DataFrame(columns=["station", "sensor", "distance"])
+    stations = stations.merge(
+        assignments.groupby("station").agg(sensors=("sensor", "size"), nearest=("distance", "min")),
+        left_on="Адрес", right_index=True, how="left"
+    ).fillna({"sensors": 0})
+
+    linked = stations.loc[stations["sensors"] > 0, "Адрес"].tolist()
+    if not linked:
+        return stations, pd.DataFrame(columns=["station", "pollutant", "lag", "r", "hours"])
+
+    hours = _hour_axis(start_date, end_date)
+    used = assignments["sensor"].unique()
+    flow = station_flow(
+        hourly_matrix(hourly_flow[hourly_flow["Адрес"].astype(str).isin(used)], "flow_sum", hours, used),
+        assignments, used, linked
+    )
+
+    readings = pollution.assign(hour=pollution["minutes"] // 60)
+    readings = readings[readings["minutes"] >= 0]
+    results = []
+    for pollutant in pollutants:
+        values = hourly_matrix(readings, pollutant, hours, linked, aggfunc="mean")
+        r, n = lagged_correlation(flow, values, max_lag)
+        lags, columns = np.indices(r.shape)
+        results.append(pd.DataFrame({
+            "station": np.asarray(linked)[columns.ravel()],
+            "pollutant": pollutant,
+            "lag": lags.ravel(),
+            "r": r.ravel(),
+            "hours": n.ravel(),
+        }))
+    correlations = pd.concat(results, ignore_index=True)
+    logger.info(
+        f"Корреляции: {len(linked)} постов, {len(used)} датчиков в радиусе {radius_m:.0f} м, "
+        f"{len(hours)} ч, за {time.perf_counter() - start:.3f} с"
+    )
+    return stations, correlations
@@ -1,615 +1,893 @@
-import pandas as pd
-import plotly.graph_objects as go
-from dash import Dash, dcc, html, Input, Output, State, dash_table  
-import psycopg2
-import logging
-import base64
-import os
-from db_config import DB_CONFIG
-from data_transfer import process_excel_to_postgres
-from data_transfer_air import process_excel_to_postgres_air
-
-
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-def load_data_from_db():
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        transport_query = """
-        SELECT 
-            Адрес,
-            Время,
-            Скорость,
-            Поток,
-            Широта AS "lat",
-            Долгота AS "lon",
-            Дата AS "date"
-        FROM transport_metrics
-        """
-        df = pd.read_sql(transport_query, conn)
-        return df
-    except Exception as e:
-        logger.error(f"Ошибка при загрузке данных из БД: {e}")
-        raise
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
-
-def load_pollution_data():
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        pollution_query = """
-        SELECT 
-            Адрес,
-            Время,
-            co,
-            no,
-            no2,
-            so2,
-            Дата AS "date"
-        FROM air_pollution
-        """
-        df = pd.read_sql(pollution_query, conn)
-        return df
-    except Exception as e:
-        logger.error(f"Ошибка при загрузке экологических данных: {e}")
-        raise
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
-
-# Загрузка и обработка данных
-try:
-    df = load_data_from_db()
-    df["Время"] = pd.to_datetime(df["Время"], format="%H:%M:%S", errors="coerce").dt.strftime("%H:%M")
-    df["date"] = pd.to_datetime(df["date"])
-    df["Скорость"] = df["Скорость"].round(3)
-    df["Поток"] = df["Поток"].round(0).astype(int)
-    pollution_df = load_pollution_data()
-    pollution_df["Время"] = pd.to_datetime(pollution_df["Время"], format="%H:%M:%S", errors="coerce").dt.strftime("%H:%M")
-    pollution_df["date"] = pd.to_datetime(pollution_df["date"])
-
-    min_date = df["date"].min().date()
-    max_date = df["date"].max().date()
-    
-except Exception as e:
-    logger.error(f"Ошибка при обработке данных: {e}")
-    raise
-
-
-app = Dash(__name__)
-
-
-app.layout = html.Div([
-    html.H1("Анализ транспортного потока и загрязнений", style={"textAlign": "center"}),
-
-    html.Div([
-        html.Label("Выберите период:"),
-        dcc.DatePickerRange(
-            id='date-picker',
-            min_date_allowed=min_date,
-            max_date_allowed=max_date,
-            start_date=min_date,
-            end_date=max_date,
-            display_format='YYYY-MM-DD'
-        )
-    ], style={"marginBottom": "20px"}),
-
-    html.Div([
-        html.Label("Выберите адрес (транспорт):"),
-        dcc.Dropdown(id="address-dropdown", options=[], value=None, clearable=False)
-    ], style={"marginBottom": "30px"}),
-
-    html.H3("График скорости и потока транспорта"),
-    dcc.Graph(id="comparison-graph", style={"height": "450px"}),
-
-
-     html.H3("Оценка адресов"),
-    dash_table.DataTable(
-        id='los-table',
-        columns=[
-            {"name": "Адрес", "id": "Адрес"},
-            {"name": "Дата", "id": "date"},
-            {"name": "Время", "id": "Время"},
-            {"name": ["Оценка по коэфф. скорости участка"], "id": "LOS_kv"},
-            {"name": "Оценка по коэфф. загрузки участка", "id": "LOS_z"}
-        ],
-        style_table={"overflowX": "auto"},
-        style_cell={
-            "textAlign": "center",
-            "padding": "8px",
-            "fontFamily": "Arial"
-        },
-        style_header={
-            "backgroundColor": "#f2f2f2",
-            "fontWeight": "bold"
-        }, 
-        
-        page_size=15,
-        sort_action='native',
-        filter_action='native'
-    ),
-
-
-    html.H3("Географическая карта"),
-    dcc.Graph(id="map-graph", style={"height": "700px"}),
-
-    html.H3("Наиболее загруженные участки"),
-    dcc.Graph(id="top-flow-graph"),
-
-    html.H3("Участки с минимальной скоростью"),
-    dcc.Graph(id="low-speed-graph"),
-
-    html.Hr(),
-    html.H2("Анализ загрязнителей воздуха", style={"marginTop": "40px"}),
-
-    html.Div([
-        html.Label("Выберите адрес (загрязнение):"),
-        dcc.Dropdown(
-            id="pollution-address-dropdown",
-            options=[{"label": addr, "value": addr} for addr in pollution_df["Адрес"].unique()],
-            value=pollution_df["Адрес"].unique()[0],
-            clearable=False
-        )
-    ], style={"marginBottom": "20px"}),
-
-    html.Div([
-        html.Label("Выберите типы загрязнителей:"),
-        dcc.Checklist(
-            id="pollutant-selector",
-            options=[
-                {"label": "CO", "value": "co"},
-                {"label": "NO", "value": "no"},
-                {"label": "NO₂", "value": "no2"},
-                {"label": "SO₂", "value": "so2"},
-            ],
-            value=["co", "no", "no2", "so2"],
-            labelStyle={"display": "inline-block", "marginRight": "15px"}
-        )
-    ], style={"marginBottom": "30px"}),
-
-    dcc.Graph(id="pollution-graph"),
-
-    html.Hr(),
-
-
-    # Загрузка Excel-файла — перемещена в самый низ
-
-
-html.Div([
-    html.H2("Загрузка данных", style={"marginTop": "40px"}),
-
-    html.H3("Загрузка транспортных данных"),
-    dcc.Upload(
-        id='upload-traffic-data',
-        children=html.Div(['Перетащите или выберите Excel-файл с транспортными данными']),
-        style={
-            'width': '100%',
-            'height': '60px',
-            'lineHeight': '60px',
-            'borderWidth': '1px',
-            'borderStyle': 'dashed',
-            'borderRadius': '5px',
-            'textAlign': 'center',
-            'marginBottom': '20px'
-        },
-        multiple=False
-    ),
-    html.Div(id='traffic-upload-status'),
-
-    html.H3("Загрузка данных о загрязнении воздуха"),
-    dcc.Upload(
-        id='upload-pollution-data',
-        children=html.Div(['Перетащите или выберите Excel-файл с экологическими данными']),
-        style={
-            'width': '100%',
-            'height': '60px',
-            'lineHeight': '60px',
-            'borderWidth': '1px',
-            'borderStyle': 'dashed',
-            'borderRadius': '5px',
-            'textAlign': 'center',
-            'marginBottom': '20px'
-        },
-        multiple=False
-    ),
-    html.Div(id='pollution-upload-status'),
-    html.Hr()
-    ])
-], style={"width": "90%", "margin": "0 auto", "padding": "20px"})
-
-
-
-
-
-
-@app.callback(
-    Output("address-dropdown", "options"),
-    Output("address-dropdown", "value"),
-    
-    Input("date-picker", "start_date"),
-    Input("date-picker", "end_date")
-)
-def update_address_dropdown(start_date, end_date):
-    filtered_df = df[(df["date"] >= pd.to_datetime(start_date)) & 
-                     (df["date"] <= pd.to_datetime(end_date))]
-    addresses = filtered_df["Адрес"].unique()
-    options = [{"label": addr, "value": addr} for addr in addresses]
-    value = addresses[0] if len(addresses) > 0 else None
-    return options, value
-
-@app.callback(
-    Output("comparison-graph", "figure"),
-    Output("map-graph", "figure"),
-    Output("top-flow-graph", "figure"),
-    Output("low-speed-graph", "figure"),
-    Output("los-table", "data"),
-    Input("address-dropdown", "value"),
-    Input("date-picker", "start_date"),
-    Input("date-picker", "end_date")
-)
-def update_graphs(selected_address, start_date, end_date):
-    if not selected_address:
-        return go.Figure(), go.Figure()
-    
-    filtered_df = df[(df["date"] >= pd.to_datetime(start_date)) & 
-                     (df["date"] <= pd.to_datetime(end_date))]
-
-    grouped = filtered_df.groupby(["Адрес", "Время", "lat", "lon"]).agg({
-        "Скорость": "mean",
-        "Поток": "sum"
-    }).reset_index()
-
-
-    df_top10 = filtered_df.groupby("Адрес").agg({"Поток": "sum"}).reset_index()
-    df_top10 = df_top10.sort_values("Поток", ascending=False).head(10)
-   
-
-    df_speed = filtered_df[filtered_df["Скорость"] > 0]
-    low_speed_addresses = df_speed.groupby("Адрес")["Скорость"].mean().nsmallest(10).index
-    df_low_speed = filtered_df[filtered_df["Адрес"].isin(low_speed_addresses)]
-
-
-    high_speed_threshold = filtered_df["Скорость"].quantile(0.95)
-    high_flow_threshold = filtered_df["Поток"].quantile(0.95)
-    risky_points = filtered_df[(filtered_df["Скорость"] >= high_speed_threshold) & (filtered_df["Поток"] >= high_flow_threshold)]
-    risky_sample = risky_points.sample(n=min(10, len(risky_points)), random_state=42)
-
-
-
-
-    dff = grouped[grouped["Адрес"] == selected_address]
-    fig_graph = go.Figure()
-    fig_graph.add_trace(go.Bar(x=dff["Время"], y=dff["Поток"], name="Поток", marker_color="orange"))
-    fig_graph.add_trace(go.Scatter(x=dff["Время"], y=dff["Скорость"], name="Скорость", yaxis="y2", line=dict(color="#4682B4", width=3)))
-
-    fig_graph.update_layout(
-        title=f"Скорость и поток на адресе: {selected_address}",
-        xaxis_title="Время",
-        yaxis=dict(title="Поток (авто/ч)",showgrid=True, gridcolor="#080808"),
-        yaxis2=dict(title="Скорость (км/ч)", overlaying="y", side="right"),
-        plot_bgcolor="#f9f9f9",
-        paper_bgcolor="#f4f4f4"
-    )
-
-     
-    top_flow_df = filtered_df.groupby("Адрес")["Поток"].sum().nlargest(10).reset_index()
-    fig_top_flow = go.Figure()
-    fig_top_flow.add_trace(go.Bar(
-        x=top_flow_df["Поток"],
-        y=top_flow_df["Адрес"],
-        orientation="h",
-        marker_color="#FF7F0E",
-        text=top_flow_df["Поток"],
-        textposition="auto"
-    ))
-    fig_top_flow.update_layout(
-        xaxis_title="Суммарный поток (авто)",
-        yaxis_title="Адрес",
-        yaxis=dict(autorange="reversed"),
-        plot_bgcolor="#f9f9f9",
-        paper_bgcolor="#f4f4f4"
-    )
-    
-    # 2. График ТОП-10 участков с наименьшей скоростью
-    low_speed_df = filtered_df[filtered_df["Скорость"] > 0].groupby("Адрес")["Скорость"].mean().nsmallest(10).reset_index()
-    fig_low_speed = go.Figure()
-    fig_low_speed.add_trace(go.Bar(
-        x=low_speed_df["Скорость"],
-        y=low_speed_df["Адрес"],
-        orientation="h",
-        marker_color="#1f77b4",
-        text=[f"{v:.2f}" for v in low_speed_df["Скорость"]],
-        textposition="auto"
-    ))
-    fig_low_speed.update_layout(
-        xaxis_title="Средняя скорость (км/ч)",
-        yaxis_title="Адрес",
-        yaxis=dict(autorange="reversed"),
-        plot_bgcolor="#f9f9f9",
-        paper_bgcolor="#f4f4f4"
-    )
-
-
-    # Карта
-    fig_map = go.Figure()
-    
-    # Топ-10 адресов
-    top_addresses_sum = (
-    filtered_df.groupby("Адрес", as_index=False)["Поток"].sum().sort_values("Поток", ascending=False).head(10))
-    top_addresses_coords = (filtered_df.drop_duplicates(subset="Адрес")[["Адрес", "lat", "lon"]].merge(top_addresses_sum, on="Адрес"))
-
-    
-    fig_map.add_trace(go.Scattermapbox(
-        lat=top_addresses_coords["lat"],
-        lon=top_addresses_coords["lon"],
-        mode="markers",
-        marker=dict(size=18, color="darkred", opacity=0.9),
-        text=top_addresses_coords.apply(lambda x: f"{x['Адрес']}<br>Поток: {x['Поток']}", axis=1),
-        textposition="top right",
-        name="Наиболее загруженные участки"
-    ))
-    
-    # Адреса с низкой скоростью
-    fig_map.add_trace(go.Scattermapbox(
-        lat=df_low_speed["lat"],
-        lon=df_low_speed["lon"],
-        mode="markers",
-        marker=dict(size=18, color="navy", opacity=0.8),
-        text=df_low_speed.apply(lambda x: f"{x['Адрес']}<br>Скорость: {x['Скорость']} км/ч", axis=1),
-        textposition="top right",
-        name="Адресы с низкой средней скоростью"
-    ))
-    
-    # Рискованные точки
-    fig_map.add_trace(go.Scattermapbox(
-        lat=risky_sample["lat"],
-        lon=risky_sample["lon"],
-        mode="markers",
-        marker=dict(size=18, color="black", opacity=0.8),
-        text=risky_sample.apply(lambda x: f"Аварийный риск<br>{x['Адрес']}<br>Скорость: {x['Скорость']:.1f} км/ч<br>Поток: {x['Поток']}", axis=1),
-        hoverinfo="text",
-        name="Потенциально аварийные участки"
-    ))
-    
-    # Все адреса
-    fig_map.add_trace(go.Scattermapbox(
-        lat=filtered_df['lat'],
-        lon=filtered_df['lon'],
-        mode='markers',
-        marker=dict(
-            size=15,
-            color=filtered_df['Скорость'],
-            cmin=30,
-            cmax=80,
-            showscale=True,
-            opacity=0.8
-        ),
-        text=filtered_df.apply(lambda x: f"{x['Адрес']}<br>Скорость: {x['Скорость']} км/ч<br>Поток: {x['Поток']} авто", axis=1),
-        hoverinfo='text',
-        name='Адреса'
-    ))
-    
-   
-    
-    fig_map.update_layout(
-        mapbox_style="open-street-map",
-        mapbox=dict(
-            center=dict(lat=filtered_df['lat'].mean(), lon=filtered_df['lon'].mean()),
-            zoom=11
-        ),
-        margin={"r":0,"t":0,"l":0,"b":0},
-        legend=dict(x=0, y=1),
-        plot_bgcolor="#f9f9f9",
-        paper_bgcolor="#f4f4f4"
-    )
-    
-
-    Q_capacity = 1800  # нормативная пропускная способность на одну полосу, авт./ч
-    V_free = 20        # скорость свободного потока, км/ч
-
-    # Расчёт коэффициента загрузки z и коэффициента скорости kv
-    filtered_df["z"] = filtered_df["Поток"] / Q_capacity
-    filtered_df["kv"] = filtered_df["Скорость"] / V_free
-
-    # Функция для определения LOS по kv
-    def get_los_kv(kv):
-        if kv >= 0.9:
-            return "A"
-        elif kv >= 0.8:
-            return "B"
-        elif kv >= 0.7:
-            return "C"
-        elif kv >= 0.6:
-            return "D"
-        elif kv >= 0.5:
-            return "E"
-        else:
-            return "F"
-
-    # Функция для определения LOS по z
-    def get_los_z(z):
-        if z <= 0.2:
-            return "A"
-        elif z <= 0.45:
-            return "B"
-        elif z <= 0.65:
-            return "C"
-        elif z <= 0.9:
-            return "D"
-        elif z <= 1:
-            return "E"
-        else:
-            return "F"
-
-    # Применение функций к датафрейму
-    filtered_df["LOS_kv"] = filtered_df["kv"].apply(get_los_kv)
-    filtered_df["LOS_z"] = filtered_df["z"].apply(get_los_z)
-
-
-    # Цветовая карта по уровням обслуживания
-    los_colors = {
-        "A": "green",
-        "B": "lime",
-        "C": "yellow",
-        "D": "orange",
-        "E": "orangered",
-        "F": "red"
-}
-
-    # Добавим столбец с цветами
-    filtered_df["los_color_z"] = filtered_df["LOS_z"].map(los_colors)
-    filtered_df["los_color_kv"] = filtered_df["LOS_kv"].map(los_colors)
-# Добавим Scattermapbox с цветами по LOS_z
-    fig_map.add_trace(go.Scattermapbox(
-        lat=filtered_df['lat'],
-        lon=filtered_df['lon'],
-        mode='markers',
-        marker=dict(
-            size=15,
-            color=filtered_df['los_color_z'],
-            opacity=0.85
-        ),
-        text=filtered_df.apply(lambda x: f"""
-            {x['Адрес']}<br>
-            Скорость: {x['Скорость']:.1f} км/ч<br>
-            Поток: {x['Поток']} авто/ч<br>
-            Уровень обслуживания: {x['LOS_z']}
-        """, axis=1),
-        hoverinfo='text',
-        name='Оценка по коэффициенту загрузки участка'
-    ))
-    
-# Добавим Scattermapbox с цветами по LOS_kv
-    fig_map.add_trace(go.Scattermapbox(
-        lat=filtered_df['lat'],
-        lon=filtered_df['lon'],
-        mode='markers',
-        marker=dict(
-            size=15,
-            color=filtered_df['los_color_kv'],
-            opacity=0.85
-        ),
-        text=filtered_df.apply(lambda x: f"""
-            {x['Адрес']}<br>
-            Скорость: {x['Скорость']:.1f} км/ч<br>
-            Поток: {x['Поток']} авто/ч<br>
-            Уровень обслуживания: {x['LOS_kv']}
-        """, axis=1),
-        hoverinfo='text',
-        name='Оценка по коэффициенту скорости участка'
-    ))
-
- # 🟢 Таблица LOS
-    los_df = filtered_df[
-    (filtered_df["Адрес"] == selected_address) &
-    (filtered_df["date"] >= pd.to_datetime(start_date)) &
-    (filtered_df["date"] <= pd.to_datetime(end_date))][["Адрес", "date", "Время", "LOS_kv", "LOS_z"]].copy()
-    los_df["date"] = los_df["date"].dt.date
-
-    return fig_graph, fig_map, fig_top_flow, fig_low_speed, los_df.to_dict("records")
-
-
-@app.callback(
-    Output("pollution-graph", "figure"),
-    Input("pollution-address-dropdown", "value"),
-    Input("pollutant-selector", "value"),
-    Input("date-picker", "start_date"),
-    Input("date-picker", "end_date")
-)
-def update_pollution_graph(pollution_address, selected_pollutants, start_date, end_date):
-    filtered_pollution = pollution_df[
-        (pollution_df["Адрес"] == pollution_address) &
-        (pollution_df["date"] >= pd.to_datetime(start_date)) &
-        (pollution_df["date"] <= pd.to_datetime(end_date))
-    ]
-    fig = go.Figure()
-    if not selected_pollutants:
-        fig.update_layout(title="Выберите хотя бы один загрязнитель")
-        return fig
-
-    colors = {"co": "#8B0000", "no": "#FF8C00", "no2": "#4682B4", "so2": "#2E8B57"}
-    for pol in selected_pollutants:
-        fig.add_trace(go.Scatter(
-            x=filtered_pollution["Время"],
-            y=filtered_pollution[pol],
-            mode="lines+markers",
-            name=pol.upper(),
-            line=dict(width=2),
-            marker_color=colors[pol]
-        ))
-
-    fig.update_layout(
-        title=f"Динамика загрязнителей на адресе: {pollution_address}",
-        xaxis_title="Время",
-        yaxis_title="Концентрация",
-        plot_bgcolor="#f9f9f9",
-        paper_bgcolor="#f4f4f4"
-    )
-    return fig
-
-
-UPLOAD_FOLDER = "uploaded_files"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-@app.callback(
-    Output('traffic-upload-status', 'children'),
-    Input('upload-traffic-data', 'contents'),
-    State('upload-traffic-data', 'filename')
-)
-def handle_file_upload(contents, filename):
-    if contents is None:
-        return ""
-
-    try:
-        content_type, content_string = contents.split(',')
-        decoded = base64.b64decode(content_string)
-
-        # Сохраняем файл во временную папку
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        with open(file_path, "wb") as f:
-            f.write(decoded)
-
-        # Запускаем функцию обработки файла
-        result = process_excel_to_postgres(file_path)
-
-        if result:
-            return f"✅ Файл {filename} успешно загружен и обработан."
-        else:
-            return f"❌ Ошибка при обработке файла {filename}. Проверьте содержимое."
-
-    except Exception as e:
-        return f"⚠️ Ошибка: {str(e)}"
-    
-
-@app.callback(
-    Output('pollution-upload-status', 'children'),
-    Input('upload-pollution-data', 'contents'),
-    State('upload-pollution-data', 'filename')
-)
-def handle_pollution_upload(contents, filename):
-    if contents is None:
-        return ""
-
-    try:
-        content_type, content_string = contents.split(',')
-        decoded = base64.b64decode(content_string)
-
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        with open(file_path, "wb") as f:
-            f.write(decoded)
-
-        result = process_excel_to_postgres_air(file_path)
-
-        if result:
-            return f"✅ Файл {filename} успешно загружен и обработан (экология)."
-        else:
-            return f"❌ Ошибка при обработке экологического файла {filename}. Проверьте содержимое."
-    except Exception as e:
-        return f"⚠️ Ошибка загрузки экологического файла: {str(e)}"
-
-
-
-if __name__ == "__main__":
-    app.run(debug=True)
+import time
+_started = time.perf_counter()
+import pandas as pd
+import plotly.graph_objects as go
+from dash import Dash, dcc, html, Input, Output, State, dash_table, ctx
+import logging
+import base64
+import uuid
+import json
+import os
+import functools
+import metrics
+from dash.exceptions import PreventUpdate
+from data_store import store, format_minutes
+from figure_cache import FigureCache
+from los import add_los_columns, LOS_COLORSCALE, LOS_CODE_MAX
+from map_points import map_points
+from correlation import station_correlations, CORRELATION_RADIUS_M
+from table_query import filter_frame, sort_frame, page
+from upload_jobs import submit_upload, list_jobs, add_job_listener
+from rollups import migrate
+
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Время этапов запуска, с
+startup_timings = {"импорт": time.perf_counter() - _started}
+
+# Дашборд читает агрегаты и журнал изменений: в БД, загруженной до их появления, создаем и заполняем их
+stage_start = time.perf_counter()
+if store.source in ("db", "memory"):
+    try:
+        migrate()
+    except Exception as e:
+        logger.error(f"Не удалось подготовить таблицы агрегатов: {e}; их создаст python rollups.py или первая загрузка")
+startup_timings["миграция"] = time.perf_counter() - stage_start
+
+# Для макета нужен только диапазон дат: дешевый запрос MIN/MAX (или метаданные архива).
+# Сами данные загружаются в фоне, графики дожидаются их через data-version.
+stage_start = time.perf_counter()
+try:
+    min_date, max_date = store.date_range()
+except Exception as e:
+    # Без БД сервер все равно запускается, период и данные подтянутся, когда она станет доступна
+    logger.error(f"Не удалось получить диапазон дат: {e}")
+    min_date = max_date = None
+store.start_background_load()
+startup_timings["диапазон дат"] = time.perf_counter() - stage_start
+
+# Готовые графики для повторяющихся запросов
+figure_cache = FigureCache(version=lambda: store.version)
+
+
+def on_ingestion_finished(job):
+    # После успешной загрузки файла дочитываем новые данные и сбрасываем устаревшие графики
+    store.refresh()
+    figure_cache.clear()
+
+
+add_job_listener(on_ingestion_finished)
+
+
+app = Dash(__name__)
+# Для запуска несколькими воркерами: DASHBOARD_DATA_SOURCE=shared gunicorn -w 4 dashboard:server
+server = app.server
+stage_start = time.perf_counter()
+
+
+app.layout = html.Div([
+    html.H1("Анализ транспортного потока и загрязнений", style={"textAlign": "center"}),
+    # None, пока данные не готовы; заполняется update_data_version при открытии страницы
+    dcc.Store(id="data-version", data=None),
+
+    html.Div([
+        html.Label("Выберите период:"),
+        dcc.DatePickerRange(
+            id='date-picker',
+            min_date_allowed=min_date,
+            max_date_allowed=max_date,
+            start_date=min_date,
+            end_date=max_date,
+            display_format='YYYY-MM-DD'
+        )
+    ], style={"marginBottom": "20px"}),
+
+    html.Div([
+        html.Label("Выберите адрес (транспорт):"),
+        dcc.Dropdown(id="address-dropdown", options=[], value=None, clearable=False)
+    ], style={"marginBottom": "30px"}),
+
+    html.H3("График скорости и потока транспорта"),
+    dcc.Graph(id="comparison-graph", style={"height": "450px"}),
+
+
+     html.H3("Оценка адресов"),
+    dash_table.DataTable(
+        id='los-table',
+        columns=[
+            {"name": "Адрес", "id": "Адрес"},
+            {"name": "Дата", "id": "date"},
+            {"name": "Время", "id": "Время"},
+            {"name": ["Оценка по коэфф. скорости участка"], "id": "LOS_kv"},
+            {"name": "Оценка по коэфф. загрузки участка", "id": "LOS_z"}
+        ],
+        style_table={"overflowX": "auto"},
+        style_cell={
+            "textAlign": "center",
+            "padding": "8px",
+            "fontFamily": "Arial"
+        },
+        style_header={
+            "backgroundColor": "#f2f2f2",
+            "fontWeight": "bold"
+        }, 
+        
+        # Страницы, сортировка и фильтр на сервере: в браузер уходит только видимая страница
+        page_current=0,
+        page_size=15,
+        page_action='custom',
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[],
+        filter_action='custom',
+        filter_query=''
+    ),
+
+
+    html.H3("Географическая карта"),
+    dcc.Graph(id="map-graph", style={"height": "700px"}),
+
+    html.H3("Наиболее загруженные участки"),
+    dcc.Graph(id="top-flow-graph"),
+
+    html.H3("Участки с минимальной скоростью"),
+    dcc.Graph(id="low-speed-graph"),
+
+    html.Hr(),
+    html.H2("Анализ загрязнителей воздуха", style={"marginTop": "40px"}),
+
+    html.Div([
+        html.Label("Выберите адрес (загрязнение):"),
+        dcc.Dropdown(
+            id="pollution-address-dropdown",
+            options=[],
+            value=None,
+            clearable=False
+        )
+    ], style={"marginBottom": "20px"}),
+
+    html.Div([
+        html.Label("Выберите типы загрязнителей:"),
+        dcc.Checklist(
+            id="pollutant-selector",
+            options=[
+                {"label": "CO", "value": "co"},
+                {"label": "NO", "value": "no"},
+                {"label": "NO₂", "value": "no2"},
+                {"label": "SO₂", "value": "so2"},
+            ],
+            value=["co", "no", "no2", "so2"],
+            labelStyle={"display": "inline-block", "marginRight": "15px"}
+        )
+    ], style={"marginBottom": "30px"}),
+
+    dcc.Store(id="pollution-series"),
+    dcc.Graph(id="pollution-graph"),
+
+    html.H3("Связь транспортного потока и загрязнения"),
+    html.Div([
+        html.Label("Датчики в радиусе от поста, м:"),
+        dcc.Slider(
+            id="correlation-radius",
+            min=250,
+            max=3000,
+            step=250,
+            value=CORRELATION_RADIUS_M,
+            marks={radius: str(radius) for radius in (250, 500, 1000, 1500, 2000, 3000)}
+        ),
+        dcc.RadioItems(
+            id="correlation-pollutant",
+            options=[{"label": "NO₂", "value": "no2"}, {"label": "CO", "value": "co"}],
+            value="no2",
+            labelStyle={"display": "inline-block", "marginRight": "15px"}
+        )
+    ], style={"marginBottom": "20px"}),
+    dcc.Graph(id="correlation-graph"),
+    html.Div(id="correlation-stations"),
+
+    html.Hr(),
+
+
+    # Загрузка Excel-файла — перемещена в самый низ
+
+
+html.Div([
+    html.H2("Загрузка данных", style={"marginTop": "40px"}),
+
+    html.H3("Загрузка транспортных данных"),
+    dcc.Upload(
+        id='upload-traffic-data',
+        children=html.Div(['Перетащите или выберите Excel-файл с транспортными данными']),
+        style={
+            'width': '100%',
+            'height': '60px',
+            'lineHeight': '60px',
+            'borderWidth': '1px',
+            'borderStyle': 'dashed',
+            'borderRadius': '5px',
+            'textAlign': 'center',
+            'marginBottom': '20px'
+        },
+        multiple=False
+    ),
+    html.Div(id='traffic-upload-status'),
+
+    html.H3("Загрузка данных о загрязнении воздуха"),
+    dcc.Upload(
+        id='upload-pollution-data',
+        children=html.Div(['Перетащите или выберите Excel-файл с экологическими данными']),
+        style={
+            'width': '100%',
+            'height': '60px',
+            'lineHeight': '60px',
+            'borderWidth': '1px',
+            'borderStyle': 'dashed',
+            'borderRadius': '5px',
+            'textAlign': 'center',
+            'marginBottom': '20px'
+        },
+        multiple=False
+    ),
+    html.Div(id='pollution-upload-status'),
+
+    html.H3("Очередь загрузки"),
+    html.Div(id='upload-jobs-status'),
+    dcc.Interval(id='upload-jobs-interval', interval=2000),
+    html.Hr()
+    ])
+], style={"width": "90%", "margin": "0 auto", "padding": "20px"})
+startup_timings["макет"] = time.perf_counter() - stage_start
+
+
+def wait_for_data(func):
+    """Не запускает callback, пока данные не загружены (последний аргумент - data-version)"""
+    @functools.wraps(func)
+    def wrapper(*args):
+        if args[-1] is None:
+            raise PreventUpdate
+        # В режиме shared о новой версии браузеру мог сообщить другой воркер: подключаем снимок до ответа,
+        # иначе этот воркер отдаст прежние данные под новой версией
+        if store.source == "shared" and args[-1] != store.version:
+            store.refresh()
+        return func(*args)
+    return wrapper
+
+
+
+
+
+
+@app.callback(
+    Output("address-dropdown", "options"),
+    Output("address-dropdown", "value"),
+    
+    Input("date-picker", "start_date"),
+    Input("date-picker", "end_date"),
+    Input("data-version", "data")
+)
+@wait_for_data
+def update_address_dropdown(start_date, end_date, data_version):
+    addresses = store.addresses(start_date, end_date)
+    options = [{"label": addr, "value": addr} for addr in addresses]
+    value = addresses[0] if len(addresses) > 0 else None
+    return options, value
+
+# Подсказка для точек LOS: данные передаются в customdata, строки собирает браузер
+LOS_HOVER = (
+    "%{customdata[0]}<br>"
+    "Средняя скорость: %{customdata[1]:.1f} км/ч<br>"
+    "Средний поток: %{customdata[2]} авто/ч<br>"
+    "Записей: %{customdata[3]}<br>"
+    "Уровень обслуживания: %{customdata[4]}<extra></extra>"
+)
+
+
+# Промежуточные результаты за период общие для всех callback; версия данных входит в ключ.
+# Возвращаемые таблицы используются несколькими callback и не должны изменяться.
+@functools.lru_cache(maxsize=4)
+def address_summary(start_date, end_date, version):
+    """Суммарный поток и средняя скорость по адресам за период"""
+    return store.address_summary(start_date, end_date)
+
+
+@functools.lru_cache(maxsize=4)
+def map_slice(start_date, end_date, version):
+    """Точки карты за период: по одной на датчик (или на ячейку сетки)"""
+    return map_points(address_summary(start_date, end_date, version))
+
+
+@functools.lru_cache(maxsize=4)
+def correlation_slice(start_date, end_date, radius, version):
+    """Посты с привязанными датчиками и корреляции их показаний с потоком по лагам за период"""
+    return station_correlations(
+        store.hourly_flow(start_date, end_date),
+        store.pollution_period(start_date, end_date),
+        start_date, end_date, radius_m=radius
+    )
+
+
+@app.callback(
+    Output("comparison-graph", "figure"),
+    Input("address-dropdown", "value"),
+    Input("date-picker", "start_date"),
+    Input("date-picker", "end_date"),
+    Input("data-version", "data")
+)
+@wait_for_data
+@metrics.instrument
+@figure_cache.memoize
+def update_comparison_graph(selected_address, start_date, end_date, data_version):
+    if not selected_address:
+        return go.Figure()
+
+    stages = metrics.StageTimer()
+    dff = store.address_hourly(selected_address, start_date, end_date)
+    stages.lap("groupby")
+    fig_graph = go.Figure()
+    fig_graph.add_trace(go.Bar(x=dff["Время"], y=dff["Поток"], name="Поток", marker_color="orange"))
+    fig_graph.add_trace(go.Scatter(x=dff["Время"], y=dff["Скорость"], name="Скорость", yaxis="y2", line=dict(color="#4682B4", width=3)))
+
+    fig_graph.update_layout(
+        title=f"Скорость и поток на адресе: {selected_address}",
+        xaxis_title="Время",
+        yaxis=dict(title="Поток (авто/ч)",showgrid=True, gridcolor="#080808"),
+        yaxis2=dict(title="Скорость (км/ч)", overlaying="y", side="right"),
+        plot_bgcolor="#f9f9f9",
+        paper_bgcolor="#f4f4f4"
+    )
+    stages.lap("figure")
+    return fig_graph
+
+
+# Колонки таблицы LOS; время сортируется по минутам от полуночи
+LOS_TABLE_COLUMNS = ["Адрес", "date", "Время", "LOS_kv", "LOS_z"]
+LOS_SORT_KEYS = {"Время": "minutes"}
+
+POLLUTANTS = ("co", "no", "no2", "so2")
+POLLUTANT_COLORS = {"co": "#8B0000", "no": "#FF8C00", "no2": "#4682B4", "so2": "#2E8B57"}
+
+
+@functools.lru_cache(maxsize=8)
+def los_frame(address, start_date, end_date, version):
+    """Оценки LOS адреса за период, по дате и времени"""
+    # Для таблицы достаточно строк одного адреса
+    los_df = add_los_columns(store.transport_range(start_date, end_date, address).copy())
+    los_df = los_df[["Адрес", "date", "minutes", "LOS_kv", "LOS_z"]].sort_values(["date", "minutes"], kind="stable")
+    # Дата строкой ГГГГ-ММ-ДД: так ее показывает таблица, и так по ней работают фильтры
+    return los_df.assign(
+        Адрес=los_df["Адрес"].astype(str),
+        date=los_df["date"].dt.strftime("%Y-%m-%d"),
+        Время=format_minutes(los_df["minutes"]).to_numpy()
+    ).reset_index(drop=True)
+
+
+@functools.lru_cache(maxsize=8)
+def sorted_los_frame(address, start_date, end_date, sort_by, version):
+    """Таблица LOS, отсортированная по sort_by (кортеж пар колонка - направление)"""
+    sort_by = [{"column_id": column, "direction": direction} for column, direction in sort_by]
+    return sort_frame(los_frame(address, start_date, end_date, version), sort_by, LOS_SORT_KEYS)
+
+
+# Другой адрес, период или фильтр - снова с первой страницы
+LOS_PAGE_RESET = {"address-dropdown.value", "date-picker.start_date", "date-picker.end_date", "los-table.filter_query"}
+
+
+@app.callback(
+    Output("los-table", "data"),
+    Output("los-table", "page_count"),
+    Output("los-table", "page_current"),
+    Input("address-dropdown", "value"),
+    Input("date-picker", "start_date"),
+    Input("date-picker", "end_date"),
+    Input("los-table", "page_current"),
+    Input("los-table", "page_size"),
+    Input("los-table", "sort_by"),
+    Input("los-table", "filter_query"),
+    Input("data-version", "data")
+)
+@wait_for_data
+@metrics.instrument
+def update_los_table(selected_address, start_date, end_date, page_current, page_size, sort_by, filter_query,
+                     data_version):
+    # Сброс страницы в том же callback: иначе таблица сначала строится по устаревшему номеру страницы
+    if LOS_PAGE_RESET & set(ctx.triggered_prop_ids):
+        page_current = 0
+    return los_table_page(selected_address, start_date, end_date, page_current or 0, page_size, sort_by,
+                          filter_query, data_version)
+
+
+@figure_cache.memoize
+def los_table_page(selected_address, start_date, end_date, page_current, page_size, sort_by, filter_query,
+                   data_version):
+    """Строки страницы таблицы LOS, число страниц и номер показанной страницы"""
+    if not selected_address:
+        return [], 1, 0
+
+    stages = metrics.StageTimer()
+    sort_key = tuple((item["column_id"], item["direction"]) for item in sort_by or [])
+    los_df = sorted_los_frame(selected_address, start_date, end_date, sort_key, store.version)
+    stages.lap("sort")
+    los_df = filter_frame(los_df, filter_query)
+    stages.lap("filter")
+    rows, page_count, page_current = page(los_df, page_current, page_size, LOS_TABLE_COLUMNS)
+    stages.lap("records")
+    return rows, page_count, page_current
+
+
+@app.callback(
+    Output("top-flow-graph", "figure"),
+    Input("date-picker", "start_date"),
+    Input("date-picker", "end_date"),
+    Input("data-version", "data")
+)
+@wait_for_data
+@metrics.instrument
+@figure_cache.memoize
+def update_top_flow_graph(start_date, end_date, data_version):
+    stages = metrics.StageTimer()
+    top_flow_df = address_summary(start_date, end_date, store.version).nlargest(10, "Поток")
+    stages.lap("groupby")
+    fig_top_flow = go.Figure()
+    fig_top_flow.add_trace(go.Bar(
+        x=top_flow_df["Поток"],
+        y=top_flow_df["Адрес"],
+        orientation="h",
+        marker_color="#FF7F0E",
+        text=top_flow_df["Поток"],
+        textposition="auto"
+    ))
+    fig_top_flow.update_layout(
+        xaxis_title="Суммарный поток (авто)",
+        yaxis_title="Адрес",
+        yaxis=dict(autorange="reversed"),
+        plot_bgcolor="#f9f9f9",
+        paper_bgcolor="#f4f4f4"
+    )
+    stages.lap("figure")
+    return fig_top_flow
+
+
+@app.callback(
+    Output("low-speed-graph", "figure"),
+    Input("date-picker", "start_date"),
+    Input("date-picker", "end_date"),
+    Input("data-version", "data")
+)
+@wait_for_data
+@metrics.instrument
+@figure_cache.memoize
+def update_low_speed_graph(start_date, end_date, data_version):
+    # 2. График ТОП-10 участков с наименьшей скоростью
+    stages = metrics.StageTimer()
+    low_speed_df = address_summary(start_date, end_date, store.version).nsmallest(10, "Скорость")
+    stages.lap("groupby")
+    fig_low_speed = go.Figure()
+    fig_low_speed.add_trace(go.Bar(
+        x=low_speed_df["Скорость"],
+        y=low_speed_df["Адрес"],
+        orientation="h",
+        marker_color="#1f77b4",
+        text=[f"{v:.2f}" for v in low_speed_df["Скорость"]],
+        textposition="auto"
+    ))
+    fig_low_speed.update_layout(
+        xaxis_title="Средняя скорость (км/ч)",
+        yaxis_title="Адрес",
+        yaxis=dict(autorange="reversed"),
+        plot_bgcolor="#f9f9f9",
+        paper_bgcolor="#f4f4f4"
+    )
+    stages.lap("figure")
+    return fig_low_speed
+
+
+@app.callback(
+    Output("map-graph", "figure"),
+    Input("date-picker", "start_date"),
+    Input("date-picker", "end_date"),
+    Input("data-version", "data")
+)
+@wait_for_data
+@metrics.instrument
+@figure_cache.memoize
+def update_map(start_date, end_date, data_version):
+    stages = metrics.StageTimer()
+    # Сырые записи за период не выгружаются: пороги и выборку рискованных точек считает хранилище (в режиме db - PostgreSQL)
+    risky_sample = store.risky_points(start_date, end_date)
+    stages.lap("filter")
+
+    # Суммы и средние по адресам берем из небольших таблиц агрегатов,
+    # на карту выводим по одной точке на датчик, а не по точке на каждую запись
+    summary = address_summary(start_date, end_date, store.version)
+    points = map_slice(start_date, end_date, store.version)
+    df_low_speed = summary.nsmallest(10, "Скорость")
+    stages.lap("groupby")
+
+    # Карта
+    fig_map = go.Figure()
+    
+    # Топ-10 адресов
+    top_addresses_coords = summary.nlargest(10, "Поток")
+
+    
+    fig_map.add_trace(go.Scattermapbox(
+        lat=top_addresses_coords["lat"],
+        lon=top_addresses_coords["lon"],
+        mode="markers",
+        marker=dict(size=18, color="darkred", opacity=0.9),
+        customdata=top_addresses_coords[["Адрес", "Поток"]],
+        hovertemplate="%{customdata[0]}<br>Поток: %{customdata[1]}<extra></extra>",
+        textposition="top right",
+        name="Наиболее загруженные участки"
+    ))
+    
+    # Адреса с низкой скоростью
+    fig_map.add_trace(go.Scattermapbox(
+        lat=df_low_speed["lat"],
+        lon=df_low_speed["lon"],
+        mode="markers",
+        marker=dict(size=18, color="navy", opacity=0.8),
+        customdata=df_low_speed[["Адрес", "Скорость"]],
+        hovertemplate="%{customdata[0]}<br>Средняя скорость: %{customdata[1]:.1f} км/ч<extra></extra>",
+        textposition="top right",
+        name="Адресы с низкой средней скоростью"
+    ))
+    
+    # Рискованные точки
+    fig_map.add_trace(go.Scattermapbox(
+        lat=risky_sample["lat"],
+        lon=risky_sample["lon"],
+        mode="markers",
+        marker=dict(size=18, color="black", opacity=0.8),
+        customdata=risky_sample[["Адрес", "Скорость", "Поток"]],
+        hovertemplate="Аварийный риск<br>%{customdata[0]}<br>Скорость: %{customdata[1]:.1f} км/ч<br>Поток: %{customdata[2]}<extra></extra>",
+        name="Потенциально аварийные участки"
+    ))
+    
+    # Все адреса
+    fig_map.add_trace(go.Scattermapbox(
+        lat=points['lat'],
+        lon=points['lon'],
+        mode='markers',
+        marker=dict(
+            size=15,
+            color=points['Скорость'],
+            cmin=30,
+            cmax=80,
+            showscale=True,
+            opacity=0.8
+        ),
+        customdata=points[["Адрес", "Скорость", "Поток", "count"]],
+        hovertemplate="%{customdata[0]}<br>Средняя скорость: %{customdata[1]:.1f} км/ч<br>Средний поток: %{customdata[2]} авто<br>Записей: %{customdata[3]}<extra></extra>",
+        name='Адреса'
+    ))
+    
+   
+    
+    fig_map.update_layout(
+        mapbox_style="open-street-map",
+        mapbox=dict(
+            center=dict(lat=points['lat'].mean(), lon=points['lon'].mean()),
+            zoom=11
+        ),
+        margin={"r":0,"t":0,"l":0,"b":0},
+        legend=dict(x=0, y=1),
+        plot_bgcolor="#f9f9f9",
+        paper_bgcolor="#f4f4f4"
+    )
+    
+
+# Добавим Scattermapbox с цветами по LOS_z
+    fig_map.add_trace(go.Scattermapbox(
+        lat=points['lat'],
+        lon=points['lon'],
+        mode='markers',
+        marker=dict(
+            size=15,
+            color=points['los_code_z'],
+            colorscale=LOS_COLORSCALE,
+            cmin=0,
+            cmax=LOS_CODE_MAX,
+            opacity=0.85
+        ),
+        customdata=points[["Адрес", "Скорость", "Поток", "count", "LOS_z"]],
+        hovertemplate=LOS_HOVER,
+        name='Оценка по коэффициенту загрузки участка'
+    ))
+    
+# Добавим Scattermapbox с цветами по LOS_kv
+    fig_map.add_trace(go.Scattermapbox(
+        lat=points['lat'],
+        lon=points['lon'],
+        mode='markers',
+        marker=dict(
+            size=15,
+            color=points['los_code_kv'],
+            colorscale=LOS_COLORSCALE,
+            cmin=0,
+            cmax=LOS_CODE_MAX,
+            opacity=0.85
+        ),
+        customdata=points[["Адрес", "Скорость", "Поток", "count", "LOS_kv"]],
+        hovertemplate=LOS_HOVER,
+        name='Оценка по коэффициенту скорости участка'
+    ))
+    stages.lap("figure")
+
+    return fig_map
+
+
+@app.callback(
+    Output("pollution-series", "data"),
+    Input("pollution-address-dropdown", "value"),
+    Input("data-version", "data")
+)
+@wait_for_data
+@metrics.instrument
+@figure_cache.memoize
+def update_pollution_series(pollution_address, data_version):
+    """Все показания поста одним набором колонок: загрязнители и период переключаются в браузере"""
+    stages = metrics.StageTimer()
+    series = store.pollution_range(pollution_address)
+    series = series[series["minutes"] >= 0]
+    stages.lap("filter")
+    stamps = series["date"] + pd.to_timedelta(series["minutes"], unit="m")
+    data = {"address": pollution_address, "time": stamps.dt.strftime("%Y-%m-%dT%H:%M").tolist()}
+    for pol in POLLUTANTS:
+        values = series[pol].astype("float64").round(4)
+        data[pol] = values.astype(object).where(values.notna(), None).tolist()
+    stages.lap("records")
+    return data
+
+
+# График загрязнителей строится в браузере из pollution-series: выбор загрязнителей и дат не обращается к серверу
+app.clientside_callback(
+    """
+    function(series, pollutants, startDate, endDate) {
+        if (!series) {
+            return window.dash_clientside.no_update;
+        }
+        if (!pollutants || pollutants.length === 0) {
+            return {data: [], layout: {title: {text: "Выберите хотя бы один загрязнитель"}}};
+        }
+        var start = (startDate || "").slice(0, 10);
+        var end = (endDate || "9999-12-31").slice(0, 10);
+        var rows = [];
+        for (var i = 0; i < series.time.length; i++) {
+            var day = series.time[i].slice(0, 10);
+            if (day >= start && day <= end) {
+                rows.push(i);
+            }
+        }
+        var x = rows.map(function(i) { return series.time[i]; });
+        var colors = %s;
+        var traces = pollutants.map(function(pol) {
+            return {
+                type: "scatter",
+                mode: "lines+markers",
+                name: pol.toUpperCase(),
+                x: x,
+                y: rows.map(function(i) { return series[pol][i]; }),
+                line: {width: 2},
+                marker: {color: colors[pol]}
+            };
+        });
+        return {
+            data: traces,
+            layout: {
+                title: {text: "Динамика загрязнителей на адресе: " + series.address},
+                xaxis: {title: {text: "Время"}},
+                yaxis: {title: {text: "Концентрация"}},
+                plot_bgcolor: "#f9f9f9",
+                paper_bgcolor: "#f4f4f4"
+            }
+        };
+    }
+    """ % json.dumps(POLLUTANT_COLORS),
+    Output("pollution-graph", "figure"),
+    Input("pollution-series", "data"),
+    Input("pollutant-selector", "value"),
+    Input("date-picker", "start_date"),
+    Input("date-picker", "end_date")
+)
+
+
+@app.callback(
+    Output("correlation-graph", "figure"),
+    Output("correlation-stations", "children"),
+    Input("correlation-radius", "value"),
+    Input("correlation-pollutant", "value"),
+    Input("date-picker", "start_date"),
+    Input("date-picker", "end_date"),
+    Input("data-version", "data")
+)
+@wait_for_data
+@metrics.instrument
+def update_correlation_graph(radius, pollutant, start_date, end_date, data_version):
+    stages = metrics.StageTimer()
+    stations, correlations = correlation_slice(start_date, end_date, radius, store.version)
+    stages.lap("correlation")
+
+    # Строки - посты, столбцы - сдвиг: поток за lag часов до измерения
+    table = correlations[correlations["pollutant"] == pollutant]
+    r = table.pivot(index="station", columns="lag", values="r")
+    hours = table.pivot(index="station", columns="lag", values="hours")
+    fig = go.Figure(go.Heatmap(
+        z=r.to_numpy(),
+        x=[f"{lag} ч" for lag in r.columns],
+        y=r.index,
+        customdata=hours.to_numpy(),
+        zmin=-1,
+        zmax=1,
+        colorscale="RdBu",
+        reversescale=True,
+        hovertemplate="%{y}<br>Поток за %{x} до измерения<br>r = %{z:.2f} (часов: %{customdata})<extra></extra>"
+    ))
+    fig.update_layout(
+        title=f"Корреляция потока датчиков в радиусе {radius} м и {pollutant.upper()}",
+        xaxis_title="Сдвиг",
+        plot_bgcolor="#f9f9f9",
+        paper_bgcolor="#f4f4f4",
+        height=max(300, 60 * len(r) + 150)
+    )
+    stages.lap("figure")
+
+    rows = [{
+        "Пост": station.Адрес,
+        "Координаты": station.source or "нет (добавьте в air_stations.csv)",
+        "Датчиков в радиусе": int(station.sensors),
+        "Ближайший, м": "" if pd.isna(station.nearest) else round(station.nearest),
+    } for station in stations.itertuples(index=False)]
+    stations_table = dash_table.DataTable(
+        data=rows,
+        columns=[{"name": name, "id": name} for name in ("Пост", "Координаты", "Датчиков в радиусе", "Ближайший, м")],
+        style_cell={"textAlign": "center", "padding": "4px", "fontFamily": "Arial"},
+        style_header={"backgroundColor": "#f2f2f2", "fontWeight": "bold"}
+    )
+    return fig, stations_table
+
+
+UPLOAD_FOLDER = "uploaded_files"
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+
+def save_upload(contents, filename):
+    """Сохраняет загруженный файл под уникальным именем и возвращает путь к нему"""
+    content_type, content_string = contents.split(',')
+    # Одноименный файл, загруженный повторно, не должен перезаписать тот, который еще читает предыдущая задача.
+    # Из имени клиента берем только последнюю часть пути
+    name = os.path.basename(filename.replace("\\", "/"))
+    file_path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex[:8]}-{name}")
+    with open(file_path, "wb") as f:
+        f.write(base64.b64decode(content_string))
+    return file_path
+
+
+@app.callback(
+    Output('traffic-upload-status', 'children'),
+    Input('upload-traffic-data', 'contents'),
+    State('upload-traffic-data', 'filename')
+)
+def handle_file_upload(contents, filename):
+    if contents is None:
+        return ""
+
+    try:
+        # Сохраняем файл во временную папку
+        file_path = save_upload(contents, filename)
+
+        # Обработка идет в фоновом процессе, callback не ждет ее окончания
+        job_id = submit_upload("traffic", file_path, filename)
+        return f"⏳ Файл {filename} поставлен в очередь (задача {job_id})."
+
+    except Exception as e:
+        return f"⚠️ Ошибка: {str(e)}"
+    
+
+@app.callback(
+    Output('pollution-upload-status', 'children'),
+    Input('upload-pollution-data', 'contents'),
+    State('upload-pollution-data', 'filename')
+)
+def handle_pollution_upload(contents, filename):
+    if contents is None:
+        return ""
+
+    try:
+        file_path = save_upload(contents, filename)
+
+        job_id = submit_upload("pollution", file_path, filename)
+        return f"⏳ Файл {filename} поставлен в очередь (экология, задача {job_id})."
+    except Exception as e:
+        return f"⚠️ Ошибка загрузки экологического файла: {str(e)}"
+
+
+@app.callback(
+    Output('upload-jobs-status', 'children'),
+    Input('upload-jobs-interval', 'n_intervals')
+)
+def update_upload_jobs(n_intervals):
+    jobs = list_jobs()
+    if not jobs:
+        return "Нет задач загрузки."
+
+    rows = [
+        {
+            "Задача": job["id"],
+            "Файл": job["filename"],
+            "Тип": "транспорт" if job["kind"] == "traffic" else "экология",
+            "Статус": job["status"] if not job["error"] else f"{job['status']}: {job['error']}",
+            "Прочитано строк": job["rows_parsed"],
+            "Загружено строк": job["rows_loaded"],
+            "Время, с": round(job["elapsed"], 1)
+        }
+        for job in jobs
+    ]
+    return dash_table.DataTable(
+        data=rows,
+        columns=[{"name": name, "id": name} for name in rows[0]],
+        style_cell={"textAlign": "center", "padding": "4px", "fontFamily": "Arial"},
+        style_header={"backgroundColor": "#f2f2f2", "fontWeight": "bold"}
+    )
+
+@app.callback(
+    Output("data-version", "data"),
+    Output("date-picker", "min_date_allowed"),
+    Output("date-picker", "max_date_allowed"),
+    Output("pollution-address-dropdown", "options"),
+    Output("pollution-address-dropdown", "value"),
+    Output("date-picker", "start_date"),
+    Output("date-picker", "end_date"),
+    Input("upload-jobs-interval", "n_intervals"),
+    State("data-version", "data"),
+    State("pollution-address-dropdown", "value"),
+    State("date-picker", "start_date"),
+    State("date-picker", "end_date")
+)
+def update_data_version(n_intervals, data_version, pollution_address, start_date, end_date):
+    # Графики перерисовываются только когда в хранилище появились новые данные;
+    # при открытии страницы срабатывает сразу и выдает первую версию, как только данные готовы
+    if store.source == "shared" and store.ready:
+        # Воркер подхватывает снимок, опубликованный загрузчиком после новой загрузки
+        try:
+            store.refresh()
+        except Exception as e:
+            logger.warning(f"Не удалось подключить новый снимок данных: {e}")
+    if not store.ready or data_version == store.version:
+        raise PreventUpdate
+
+    try:
+        start, end = store.date_range()
+        addresses = store.pollution_addresses()
+    except Exception as e:
+        logger.warning(f"Данные пока недоступны: {e}")
+        raise PreventUpdate
+
+    options = [{"label": addr, "value": addr} for addr in addresses]
+    if pollution_address not in addresses:
+        pollution_address = addresses[0] if addresses else None
+    # Выбранный пользователем период сохраняется, пустой (сервер стартовал без БД) заполняется
+    return store.version, start, end, options, pollution_address, start_date or start, end_date or end
+
+
+metrics.register_flask(app.server)
+
+
+@app.server.route("/cache-stats")
+def cache_stats():
+    # Счетчики попаданий и промахов кэша графиков
+    return figure_cache.stats()
+
+
+startup_timings["callback"] = time.perf_counter() - stage_start - startup_timings["макет"]
+logger.info(
+    "Запуск дашборда: " + ", ".join(f"{stage} {elapsed:.2f} с" for stage, elapsed in startup_timings.items())
+    + f", всего {time.perf_counter() - _started:.2f} с"
+)
+
+
+if __name__ == "__main__":
+    app.run(debug=True)
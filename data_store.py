@@ -0,0 +1,486 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import queries
+
+
+logger = logging.getLogger(__name__)
+
+# Источник данных дашборда: "db" - запросы за выбранный период к PostgreSQL,
+# "memory" - вся история в памяти процесса, "archive" - то же, но из архива Parquet без обращения к БД,
+# "shared" - снимок в общей памяти, который публикует отдельный загрузчик (python shared_store.py), для нескольких воркеров
+DATA_SOURCE = os.environ.get("DASHBOARD_DATA_SOURCE", "db")
+
+# В режиме archive читаются только секции начиная с этой даты (ГГГГ-ММ-ДД), по умолчанию - все
+ARCHIVE_SINCE = os.environ.get("DASHBOARD_ARCHIVE_SINCE")
+
+# Пауза между попытками фоновой загрузки, если БД недоступна, с
+LOAD_RETRY_INTERVAL = float(os.environ.get("DASHBOARD_LOAD_RETRY", 30))
+
+# Колонки архива, которые нужны дашборду
+TRANSPORT_ARCHIVE_COLUMNS = ["Адрес", "Время", "Скорость", "Поток", "Широта", "Долгота", "Дата"]
+POLLUTION_ARCHIVE_COLUMNS = ["Адрес", "Время", "CO", "NO", "NO2", "SO2", "Дата"]
+
+
+def time_to_minutes(series):
+    """Переводит время суток (time или 'HH:MM:SS') в минуты от полуночи"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Разных значений времени мало: переводим категории и раскладываем по кодам (код -1 - пропуск)
+        minutes = np.append(time_to_minutes(pd.Series(series.cat.categories)).to_numpy(), -1)
+        return pd.Series(minutes[series.cat.codes.to_numpy()], index=series.index).astype("int16")
+    times = pd.to_datetime(series.astype(str), format="%H:%M:%S", errors="coerce")
+    minutes = times.dt.hour * 60 + times.dt.minute
+    return minutes.fillna(-1).astype("int16")
+
+
+def format_minutes(series):
+    """Переводит минуты от полуночи в строки 'HH:MM' для подписей"""
+    minutes = series.astype("int32")
+    labels = (minutes // 60).astype(str).str.zfill(2) + ":" + (minutes % 60).astype(str).str.zfill(2)
+    # -1 - пропущенное время, подпись для него пустая
+    return labels.mask(minutes < 0, "")
+
+
+def prepare_transport(df):
+    """Приводит транспортные данные к компактным типам"""
+    return pd.DataFrame({
+        "id": df["id"].astype("int64"),
+        "Адрес": df["Адрес"].astype("category"),
+        "minutes": time_to_minutes(df["Время"]),
+        "Скорость": pd.to_numeric(df["Скорость"]).round(3).astype("float32"),
+        "Поток": pd.to_numeric(df["Поток"]).round(0).astype("int32"),
+        "lat": pd.to_numeric(df["lat"]).astype("float32"),
+        "lon": pd.to_numeric(df["lon"]).astype("float32"),
+        "date": pd.to_datetime(df["date"]),
+    })
+
+
+def prepare_pollution(df):
+    """Приводит экологические данные к компактным типам"""
+    prepared = pd.DataFrame({
+        "id": df["id"].astype("int64"),
+        "Адрес": df["Адрес"].astype("category"),
+        "minutes": time_to_minutes(df["Время"]),
+        "date": pd.to_datetime(df["date"]),
+    })
+    for pollutant in ("co", "no", "no2", "so2"):
+        prepared[pollutant] = pd.to_numeric(df[pollutant]).astype("float32")
+    return prepared
+
+
+def prepare_rollup(df):
+    """Приводит агрегаты к компактным типам"""
+    df["Адрес"] = df["Адрес"].astype("category")
+    df["date"] = pd.to_datetime(df["date"])
+    if "hour" in df:
+        df["hour"] = df["hour"].astype("int16")
+    for column in ("flow_sum", "flow_min", "flow_max", "count"):
+        df[column] = pd.to_numeric(df[column]).astype("int64")
+    for column in ("speed_sum", "speed_min", "speed_max", "lat", "lon"):
+        df[column] = pd.to_numeric(df[column]).astype("float32" if column in ("lat", "lon") else "float64")
+    return df
+
+
+def rollups_from_transport(transport):
+    """Часовые и суточные агрегаты по уже подготовленным сырым данным (для режима archive)"""
+    rows = transport[transport["minutes"] >= 0].assign(hour=lambda df: (df["minutes"] // 60).astype("int16"))
+    aggregations = dict(
+        flow_sum=("Поток", "sum"),
+        flow_min=("Поток", "min"),
+        flow_max=("Поток", "max"),
+        speed_sum=("Скорость", "sum"),
+        speed_min=("Скорость", "min"),
+        speed_max=("Скорость", "max"),
+        count=("Поток", "size"),
+        lat=("lat", "first"),
+        lon=("lon", "first")
+    )
+    hourly = rows.groupby(["Адрес", "date", "hour"], observed=True).agg(**aggregations).reset_index()
+    daily = rows.groupby(["Адрес", "date"], observed=True).agg(**aggregations).reset_index()
+    return prepare_rollup(hourly), prepare_rollup(daily)
+
+
+def _append(current, new_rows):
+    """Дописывает новые строки, сохраняя категориальный тип адреса"""
+    if current is None or current.empty:
+        return new_rows
+    combined = pd.concat([current, new_rows], ignore_index=True)
+    # При разных наборах категорий concat возвращает object, перекодируем обратно
+    combined["Адрес"] = combined["Адрес"].astype("category")
+    return combined
+
+
+def _replace_dates(current, new_rows, dates):
+    """Убирает строки за даты dates и дописывает свежие"""
+    kept = current[~current["date"].isin(pd.to_datetime(list(dates)))]
+    return _append(kept, new_rows)
+
+
+def _log_memory(name, df):
+    total = df.memory_usage(deep=True).sum()
+    per_million = total / len(df) * 1_000_000 if len(df) else 0
+    logger.info(
+        f"{name}: {len(df)} строк, {total / 2**20:.1f} МБ "
+        f"({per_million / 2**20:.1f} МБ на миллион строк)"
+    )
+
+
+def _in_range(df, start_date, end_date):
+    return df[(df["date"] >= pd.to_datetime(start_date)) &
+              (df["date"] <= pd.to_datetime(end_date))]
+
+
+class AddressIndex:
+    """Таблица, отсортированная по адресу и времени, с границами непрерывного блока каждого адреса"""
+
+    def __init__(self, df, order=("date", "minutes"), presorted=False):
+        start = time.perf_counter()
+        self.order = order
+        # Категории адреса сортируются по коду, поэтому строки одного адреса идут подряд.
+        # Уже упорядоченную таблицу (снимок в общей памяти) не сортируем, чтобы не копировать
+        self.frame = df if presorted else df.sort_values(["Адрес", *order], kind="stable", ignore_index=True)
+        codes = self.frame["Адрес"].cat.codes.to_numpy()
+        bounds = np.flatnonzero(np.diff(codes)) + 1
+        starts = np.concatenate(([0], bounds)) if len(codes) else np.array([], dtype=int)
+        stops = np.concatenate((bounds, [len(codes)])) if len(codes) else np.array([], dtype=int)
+        categories = self.frame["Адрес"].cat.categories
+        # Строки без адреса (код -1) в индекс не попадают: categories[-1] указал бы на последний адрес
+        self.offsets = {categories[codes[s]]: (s, e) for s, e in zip(starts, stops) if codes[s] >= 0}
+        self._dates = self.frame["date"].to_numpy()
+        logger.debug(f"Индекс по {len(self.offsets)} адресам построен за {time.perf_counter() - start:.3f} с")
+
+    def replace_dates(self, new_rows, dates):
+        """Новый индекс, в котором строки за даты dates заменены new_rows"""
+        return AddressIndex(_replace_dates(self.frame, new_rows, dates), self.order)
+
+    def lookup(self, address, start_date=None, end_date=None):
+        """Строки адреса за период: срез блока адреса, границы дат - бинарным поиском"""
+        bounds = self.offsets.get(address)
+        if bounds is None:
+            return self.frame.iloc[0:0]
+        start, stop = bounds
+        if start_date is not None:
+            dates = self._dates[start:stop]
+            first = np.searchsorted(dates, pd.to_datetime(start_date).to_datetime64(), side="left")
+            last = np.searchsorted(dates, pd.to_datetime(end_date).to_datetime64(), side="right")
+            start, stop = start + first, start + last
+        return self.frame.iloc[start:stop]
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def _load_concurrently(loads):
+    """Выполняет запросы одновременно, каждый в своем соединении из пула; результат и время каждого"""
+    with ThreadPoolExecutor(max_workers=len(loads), thread_name_prefix="data-store-query") as executor:
+        futures = {name: executor.submit(_timed, *call) for name, call in loads.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def _finish_summary(summary):
+    summary["Поток"] = summary["flow_sum"].astype("int64")
+    summary["Скорость"] = summary["speed_sum"] / summary["count"]
+    return summary
+
+
+def _finish_hourly(hourly):
+    hourly = _finish_summary(hourly)
+    hourly["Время"] = format_minutes(hourly["hour"] * 60)
+    return hourly
+
+
+class DataStore:
+    """Отдает дашборду данные за период из памяти или из PostgreSQL"""
+
+    def __init__(self, source=DATA_SOURCE):
+        if source not in ("db", "memory", "archive", "shared"):
+            raise ValueError(f"Неизвестный источник данных: {source}")
+        self.source = source
+        self._lock = threading.Lock()
+        self._transport = None
+        self._pollution = None
+        self._hourly = None
+        # Индексы по адресу для режима memory: запрос одного адреса - срез, а не проход по всей таблице
+        self._transport_index = None
+        self._pollution_index = None
+        self._hourly_index = None
+        self._daily = None
+        # Горизонт журнала изменений на момент прошлой загрузки (см. change_log.py)
+        self._horizon = None
+        # Все таблицы загружены хотя бы раз (до этого в памяти может быть только часть из них)
+        self._loaded = False
+        # Увеличивается при каждом появлении новых данных
+        self.version = 0
+
+    @property
+    def ready(self):
+        """Данные доступны без ожидания загрузки"""
+        return self.source == "db" or self._loaded
+
+    def _ensure_loaded(self):
+        # Ленивая загрузка при первом обращении, если фоновая еще не закончилась
+        if not self.ready:
+            self.refresh()
+
+    def start_background_load(self, retry_interval=LOAD_RETRY_INTERVAL):
+        """Загружает данные в фоне (режимы memory и archive); при недоступной БД повторяет попытки"""
+        if self.source == "db":
+            return
+
+        def load():
+            while not self.ready:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.warning(f"Фоновая загрузка данных не удалась: {e}; повтор через {retry_interval:.0f} с")
+                    time.sleep(retry_interval)
+
+        threading.Thread(target=load, name="data-store-load", daemon=True).start()
+
+    def date_range(self):
+        """Минимальная и максимальная даты транспортных данных"""
+        if self.source == "archive" and not self.ready:
+            # До загрузки архива диапазон берется из имен секций, без чтения файлов
+            import archive
+            return archive.date_range(archive.TRAFFIC_DATASET)
+        if self.source == "shared" and not self.ready:
+            import shared_store
+            return shared_store.date_range()
+        if not self.ready or self.source == "db":
+            # Дешевый запрос MIN/MAX по суточным агрегатам
+            return queries.fetch_date_range()
+        df = self._transport
+        return df["date"].min().date(), df["date"].max().date()
+
+    def transport_range(self, start_date, end_date, address=None):
+        """Сырые транспортные данные за период"""
+        if self.source == "db":
+            return prepare_transport(queries.fetch_transport_range(start_date, end_date, address))
+        self._ensure_loaded()
+        if address is not None:
+            return self._transport_index.lookup(address, start_date, end_date)
+        return _in_range(self._transport, start_date, end_date)
+
+    def addresses(self, start_date, end_date):
+        """Адреса с транспортными данными за период"""
+        if self.source == "db":
+            return queries.fetch_addresses(start_date, end_date).tolist()
+        self._ensure_loaded()
+        return list(_in_range(self._daily, start_date, end_date)["Адрес"].unique())
+
+    def address_summary(self, start_date, end_date):
+        """Суммарный поток и средняя скорость по адресам за период из суточных агрегатов"""
+        if self.source == "db":
+            return _finish_summary(queries.fetch_address_summary(start_date, end_date))
+        self._ensure_loaded()
+        daily = _in_range(self._daily, start_date, end_date)
+        return _finish_summary(daily.groupby("Адрес", observed=True).agg(
+            flow_sum=("flow_sum", "sum"),
+            speed_sum=("speed_sum", "sum"),
+            count=("count", "sum"),
+            lat=("lat", "first"),
+            lon=("lon", "first")
+        ).reset_index())
+
+    def risky_points(self, start_date, end_date, limit=10):
+        """Выборка записей, в которых и скорость, и поток выше 95-го процентиля за период"""
+        if self.source == "db":
+            return queries.fetch_risky_points(start_date, end_date, limit)
+        self._ensure_loaded()
+        df = _in_range(self._transport, start_date, end_date)
+        risky = df[(df["Скорость"] >= df["Скорость"].quantile(0.95)) & (df["Поток"] >= df["Поток"].quantile(0.95))]
+        return risky.sample(n=min(limit, len(risky)), random_state=42)
+
+    def address_hourly(self, address, start_date, end_date):
+        """Поток и средняя скорость адреса по часам суток из часовых агрегатов"""
+        if self.source == "db":
+            return _finish_hourly(queries.fetch_address_hourly(address, start_date, end_date))
+        self._ensure_loaded()
+        hourly = self._hourly_index.lookup(address, start_date, end_date)
+        return _finish_hourly(hourly.groupby("hour").agg(
+            flow_sum=("flow_sum", "sum"),
+            speed_sum=("speed_sum", "sum"),
+            count=("count", "sum")
+        ).reset_index())
+
+    def hourly_flow(self, start_date, end_date):
+        """Поток каждого датчика по часам (дата и час) с координатами за период"""
+        if self.source == "db":
+            flow = queries.fetch_hourly_flow(start_date, end_date)
+            return pd.DataFrame({
+                "Адрес": flow["Адрес"].astype("category"),
+                "date": pd.to_datetime(flow["date"]),
+                "hour": flow["hour"].astype("int16"),
+                "flow_sum": pd.to_numeric(flow["flow_sum"]).astype("int64"),
+                "lat": pd.to_numeric(flow["lat"]).astype("float32"),
+                "lon": pd.to_numeric(flow["lon"]).astype("float32"),
+            })
+        self._ensure_loaded()
+        return _in_range(self._hourly, start_date, end_date)[["Адрес", "date", "hour", "flow_sum", "lat", "lon"]]
+
+    def pollution_addresses(self):
+        """Адреса постов контроля загрязнения"""
+        if self.source == "db":
+            return queries.fetch_pollution_addresses().tolist()
+        self._ensure_loaded()
+        return list(self._pollution["Адрес"].unique())
+
+    def pollution_range(self, address, start_date=None, end_date=None):
+        """Экологические данные адреса за период (без дат - за все время)"""
+        if self.source == "db":
+            return prepare_pollution(queries.fetch_pollution_range(address, start_date, end_date))
+        self._ensure_loaded()
+        return self._pollution_index.lookup(address, start_date, end_date)
+
+    def pollution_period(self, start_date, end_date):
+        """Экологические данные всех постов за период"""
+        if self.source == "db":
+            return prepare_pollution(queries.fetch_pollution_period(start_date, end_date))
+        self._ensure_loaded()
+        return _in_range(self._pollution, start_date, end_date)
+
+    def _load_archive(self):
+        """Режим archive: перечитывает архив Parquet (только нужные колонки и секции дат)"""
+        # pyarrow нужен только в этом режиме
+        import archive
+        with self._lock:
+            start = time.perf_counter()
+            transport = archive.read_archive(archive.TRAFFIC_DATASET, TRANSPORT_ARCHIVE_COLUMNS, ARCHIVE_SINCE)
+            pollution = archive.read_archive(archive.AIR_DATASET, POLLUTION_ARCHIVE_COLUMNS, ARCHIVE_SINCE)
+            previous = (len(self._transport), len(self._pollution)) if self._transport is not None else None
+
+            # id в архиве нет, строки нумеруются при чтении
+            transport = transport.rename(columns={"Широта": "lat", "Долгота": "lon", "Дата": "date"})
+            self._transport_index = AddressIndex(prepare_transport(transport.assign(id=np.arange(len(transport)))))
+            self._transport = self._transport_index.frame
+            pollution = pollution.rename(columns={"CO": "co", "NO": "no", "NO2": "no2", "SO2": "so2", "Дата": "date"})
+            self._pollution_index = AddressIndex(prepare_pollution(pollution.assign(id=np.arange(len(pollution)))))
+            self._pollution = self._pollution_index.frame
+
+            self._hourly, self._daily = rollups_from_transport(self._transport)
+            self._hourly_index = AddressIndex(self._hourly, order=("date", "hour"))
+            _log_memory("transport_metrics", self._transport)
+            _log_memory("air_pollution", self._pollution)
+
+            current = (len(self._transport), len(self._pollution))
+            if current != previous:
+                self.version += 1
+            self._loaded = True
+            logger.info(f"Архив загружен за {time.perf_counter() - start:.2f} с, версия {self.version}")
+            return current[0] + current[1] - sum(previous or (0, 0))
+
+    def shared_frames(self):
+        """Таблицы для снимка в общей памяти: уже упорядоченные индексами по адресу"""
+        self._ensure_loaded()
+        return {
+            "transport": self._transport,
+            "pollution": self._pollution,
+            "hourly": self._hourly_index.frame,
+            "daily": self._daily,
+        }
+
+    def _attach_shared(self):
+        """Режим shared: подключает новую версию снимка, если загрузчик ее опубликовал"""
+        import shared_store
+        manifest = shared_store.read_manifest()
+        if manifest is None:
+            raise RuntimeError(f"Снимок данных не найден в {shared_store.SHARED_DIR}: запустите python shared_store.py")
+        if self._loaded and manifest["version"] == self.version:
+            return 0
+
+        with self._lock:
+            previous = (len(self._transport) + len(self._pollution)) if self._transport is not None else 0
+            frames = shared_store.attach(manifest)
+            # Новые таблицы подменяют старые целиком: запросы, начатые до этого, дочитывают прежний снимок
+            self._transport_index = AddressIndex(frames["transport"], presorted=True)
+            self._pollution_index = AddressIndex(frames["pollution"], presorted=True)
+            self._hourly_index = AddressIndex(frames["hourly"], order=("date", "hour"), presorted=True)
+            self._daily = frames["daily"]
+            self._hourly = self._hourly_index.frame
+            self._pollution = self._pollution_index.frame
+            self._transport = self._transport_index.frame
+            self.version = manifest["version"]
+            self._loaded = True
+            return len(self._transport) + len(self._pollution) - previous
+
+    def refresh(self):
+        """Отмечает появление новых данных; в режиме memory перечитывает даты, которые изменили загрузки"""
+        if self.source == "shared":
+            return self._attach_shared()
+        if self.source == "db":
+            # Данные читаются из БД при каждом запросе, достаточно сменить версию
+            with self._lock:
+                self.version += 1
+            return 0
+        if self.source == "archive":
+            return self._load_archive()
+
+        with self._lock:
+            start = time.perf_counter()
+            # Горизонт берется до чтения данных: загрузки, зафиксированные после него, попадут
+            # и в это чтение, и в следующее, а незавершенные сейчас - только в следующее
+            horizon = queries.fetch_change_horizon()
+            if not self._loaded:
+                transport_dates = pollution_dates = None
+            else:
+                changes = queries.fetch_changes(self._horizon)
+                transport_dates = sorted(changes.loc[changes["table"] == "transport_metrics", "date"])
+                pollution_dates = sorted(changes.loc[changes["table"] == "air_pollution", "date"])
+
+            loads = {}
+            if transport_dates is None or transport_dates:
+                loads["transport_metrics"] = (queries.load_data_from_db, transport_dates)
+                # Агрегаты пересчитываются при загрузке на месте, поэтому перечитываются за те же даты
+                loads["rollups"] = (queries.load_rollups, transport_dates)
+            if pollution_dates is None or pollution_dates:
+                loads["air_pollution"] = (queries.load_pollution_data, pollution_dates)
+            results = _load_concurrently(loads) if loads else {}
+            timings = {name: elapsed for name, (_, elapsed) in results.items()}
+
+            new_transport = new_pollution = pd.DataFrame()
+            if "transport_metrics" in results:
+                new_transport = results["transport_metrics"][0]
+                hourly, daily = (prepare_rollup(frame) for frame in results["rollups"][0])
+                if transport_dates is None:
+                    self._transport_index = AddressIndex(prepare_transport(new_transport))
+                    self._hourly_index = AddressIndex(hourly, order=("date", "hour"))
+                    self._daily = daily
+                else:
+                    self._transport_index = self._transport_index.replace_dates(prepare_transport(new_transport), transport_dates)
+                    self._hourly_index = self._hourly_index.replace_dates(hourly, transport_dates)
+                    self._daily = _replace_dates(self._daily, daily, transport_dates)
+                self._transport = self._transport_index.frame
+                self._hourly = self._hourly_index.frame
+                _log_memory("transport_metrics", self._transport)
+
+            if "air_pollution" in results:
+                new_pollution = results["air_pollution"][0]
+                if pollution_dates is None:
+                    self._pollution_index = AddressIndex(prepare_pollution(new_pollution))
+                else:
+                    self._pollution_index = self._pollution_index.replace_dates(prepare_pollution(new_pollution), pollution_dates)
+                self._pollution = self._pollution_index.frame
+                _log_memory("air_pollution", self._pollution)
+            self._horizon = horizon
+
+            # Число перечитанных строк; версия меняется при любой загрузке, даже если строк не прибавилось
+            added = len(new_transport) + len(new_pollution)
+            if loads:
+                self.version += 1
+            self._loaded = True
+            queries_time = ", ".join(f"{name} {elapsed:.2f} с" for name, elapsed in timings.items())
+            logger.info(
+                f"Обновление хранилища: перечитано {added} строк за {time.perf_counter() - start:.2f} с "
+                f"(запросы: {queries_time}), версия {self.version}"
+            )
+            return added
+
+
+store = DataStore()
@@ -1,134 +1,323 @@
-import pandas as pd
-import psycopg2
-from psycopg2 import sql
-from psycopg2.extras import execute_batch
-import logging
-from db_config import DB_CONFIG
-
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filename='data_processing.log'
-)
-logger = logging.getLogger(__name__)
-
-
-def load_data_to_postgres(df, table_name, connection_params):
-    """Загружает DataFrame в PostgreSQL"""
-    try:
-        conn = psycopg2.connect(**connection_params)
-        cursor = conn.cursor()
-        
-        # Создаем таблицу, если она не существует
-        create_table_query = sql.SQL("""
-        CREATE TABLE IF NOT EXISTS {} (
-            id SERIAL PRIMARY KEY,
-            Адрес TEXT,
-            Время TIME,
-            Направление INT,
-            Номер_полосы INT,                          
-            Скорость NUMERIC,
-            Поток INT,
-            Широта NUMERIC,
-            Долгота NUMERIC,
-            Дата DATE
-        )
-        """).format(sql.Identifier(table_name))
-        
-        cursor.execute(create_table_query)
-        conn.commit()
-        
-        # Подготавливаем данные для вставки
-        records = []
-        for _, row in df.iterrows():
-            record = (
-                row['Адрес'],
-                row['Время'],
-                row['Направление'],
-                row['Номер полосы'],
-                row['Скорость'],
-                row['Поток'],
-                row['Широта'],
-                row['Долгота'],
-                row['Дата']
-            )
-            records.append(record)
-        
-        # Вставляем данные пачками
-        insert_query = sql.SQL("""
-        INSERT INTO {} (Адрес, Время, Направление, Номер_полосы, Скорость, Поток, Широта, Долгота, Дата)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """).format(sql.Identifier(table_name))
-        
-        execute_batch(cursor, insert_query, records)
-        conn.commit()
-        
-        logger.info(f"Успешно загружено {len(df)} записей в таблицу {table_name}")
-        
-    except Exception as e:
-        logger.error(f"Ошибка при загрузке в PostgreSQL: {str(e)}")
-        raise
-    finally:
-        if conn:
-            cursor.close()
-            conn.close()
-
-
-def process_excel_to_postgres(file_name):
-    """Основная функция обработки данных"""
-    try:
-        # Загрузка данных из Excel
-        logger.info("Начало обработки файла Excel")
-        
-        # Загружаем данные с первого листа (транспортные показатели)
-        df_metrics = pd.read_excel(
-            file_name, 
-            sheet_name=0
-        ).rename(columns={
-            "Средняя скорость, км/ч (за период)": "Скорость",
-            "Интенсивность, авто (за период)": "Поток"
-        })
-
-        # Загружаем данные со второго листа (адреса и координаты)
-        df_coords = pd.read_excel(
-            file_name, 
-            sheet_name=1,
-            usecols=["Адресная привязка", "Долгота", "Широта"]
-        ).rename(columns={"Адресная привязка": "Адрес"})
-
-        # Объединение данных
-        df_merged = pd.merge(
-            df_metrics,
-            df_coords,
-            on="Адрес",
-            how="left"
-        )
-
-        # Очистка данных
-        df_merged = df_merged[
-            (df_merged["Скорость"] > 0) & 
-            (df_merged["Поток"] > 0) &
-            (df_merged["Широта"].notna()) &
-            (df_merged["Долгота"].notna())
-        ]
-
-
-        date_value = pd.to_datetime(df_merged['Дата'].dropna().iloc[0])
-        date_str = date_value.strftime('%Y-%m-%d')
-        csv_filename = f"transport_mertics_{date_str}.csv"
-
-        # Сохранение в CSV
-        df_merged.to_csv(csv_filename, index=False, encoding="utf-8")
-        logger.info("Данные успешно сохранены в CSV файл")
-
-    
-        # Загрузка в PostgreSQL
-        load_data_to_postgres(df_merged, "transport_metrics", DB_CONFIG)
-        
-        return True
-        
-    except Exception as e:
-        logger.error(f"Ошибка при обработке данных: {str(e)}")
+import pandas as pd
+from psycopg2 import sql
+import logging
+from openpyxl import load_workbook
+from db_config import DB_CONFIG
+from db_pool import get_connection, checkout, release
+from bulk_load import bulk_load, ensure_unique_key, TRANSPORT_COLUMNS, TRANSPORT_KEY
+from rollups import ensure_rollup_tables, update_rollups, refresh_rollups, rebuild_rollups
+from file_registry import file_hash, find_ingested, mark_ingested
+from partitions import ensure_partitioned_table, ensure_partitions
+from change_log import ensure_change_log
+from archive import write_parquet, WRITE_CSV, WRITE_PARQUET, TRAFFIC_DATASET
+from metrics import timed, timed_iter, INGEST_STAGE_SECONDS, INGEST_ROWS
+
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    filename='data_processing.log'
+)
+logger = logging.getLogger(__name__)
+
+# Переименование колонок листа с транспортными показателями
+METRICS_RENAME = {
+    "Средняя скорость, км/ч (за период)": "Скорость",
+    "Интенсивность, авто (за период)": "Поток"
+}
+
+# Размер пачки строк при потоковой обработке
+CHUNK_SIZE = 50000
+
+
+def create_transport_table(cursor, table_name):
+    """Создает таблицу транспортных показателей, если она не существует"""
+    # Таблица секционирована по месяцам: запросы за период читают только нужные секции,
+    # а старые месяцы можно отсоединить (см. partitions.py)
+    create_table_query = sql.SQL("""
+    CREATE TABLE IF NOT EXISTS {} (
+        id SERIAL,
+        Адрес TEXT,
+        Время TIME,
+        Направление INT,
+        Номер_полосы INT,                          
+        Скорость NUMERIC,
+        Поток INT,
+        Широта NUMERIC,
+        Долгота NUMERIC,
+        Дата DATE NOT NULL,
+        PRIMARY KEY (id, Дата)
+    ) PARTITION BY RANGE (Дата)
+    """).format(sql.Identifier(table_name))
+    
+    ensure_partitioned_table(cursor, table_name, create_table_query)
+    ensure_change_log(cursor)
+
+    # Уникальный ключ начинается с (Адрес, Дата, Время) и заменяет прежний индекс по этим колонкам.
+    # Создается до остальных индексов: их SHARE-блокировка таблицы до конца транзакции
+    # взаимно заблокировала бы параллельную загрузку, удаляющую повторы под ensure_unique_key
+    if ensure_unique_key(cursor, table_name, TRANSPORT_KEY):
+        rebuild_rollups(cursor, table_name)
+    cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(
+        sql.Identifier(f"{table_name}_address_date_time_idx")))
+
+    # Индексы под запросы дашборда за период и по адресу
+    cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (Дата, Адрес)").format(
+        sql.Identifier(f"{table_name}_date_address_idx"), sql.Identifier(table_name)))
+
+
+def load_chunk(cursor, df, table_name, method="upsert"):
+    """Загружает пачку строк и обновляет агрегаты в той же транзакции"""
+    # Секции обычно уже созданы и зафиксированы вызывающим; здесь они создаются в транзакции загрузки
+    ensure_partitions(cursor, table_name, df["Дата"])
+    with timed(INGEST_STAGE_SECONDS, source=table_name, stage="load"):
+        bulk_load(cursor, df, table_name, TRANSPORT_COLUMNS, method=method, key=TRANSPORT_KEY)
+    with timed(INGEST_STAGE_SECONDS, source=table_name, stage="rollups"):
+        if method == "upsert":
+            # Повторно загруженные строки заменяют прежние, поэтому агрегаты за эти дни пересчитываются
+            refresh_rollups(cursor, df, table_name)
+        else:
+            update_rollups(cursor, df)
+    INGEST_ROWS.inc(len(df), source=table_name)
+
+
+def load_data_to_postgres(df, table_name, connection_params=None, method="upsert"):
+    """Загружает DataFrame в PostgreSQL"""
+    try:
+        with get_connection(connection_params) as conn, conn.cursor() as cursor:
+            # Создаем таблицу, если она не существует
+            create_transport_table(cursor, table_name)
+            ensure_rollup_tables(cursor, table_name)
+            ensure_partitions(cursor, table_name, df["Дата"])
+            conn.commit()
+        
+            # Загружаем данные одним потоком через COPY и дополняем агрегаты в той же транзакции
+            load_chunk(cursor, df, table_name, method)
+            conn.commit()
+        
+            logger.info(f"Успешно загружено {len(df)} записей в таблицу {table_name}")
+
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке в PostgreSQL: {str(e)}")
+        raise
+
+
+def filter_valid_rows(df):
+    """Оставляет строки с положительными скоростью и потоком, известными координатами и датой"""
+    return df[
+        (df["Скорость"] > 0) & 
+        (df["Поток"] > 0) &
+        (df["Широта"].notna()) &
+        (df["Долгота"].notna()) &
+        # Строка без даты не попадет ни в одну месячную секцию
+        (pd.to_datetime(df["Дата"], dayfirst=True, errors="coerce").notna())
+    ]
+
+
+def read_coordinates(file_name):
+    """Читает со второго листа словарь адрес -> (долгота, широта)"""
+    workbook = load_workbook(file_name, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[1].iter_rows(values_only=True)
+        header = list(next(rows))
+        address_idx = header.index("Адресная привязка")
+        lon_idx = header.index("Долгота")
+        lat_idx = header.index("Широта")
+
+        coords = {}
+        for row in rows:
+            address = row[address_idx]
+            # Как и при merge, берем координаты только для известных адресов
+            if address is not None and address not in coords:
+                coords[address] = (row[lon_idx], row[lat_idx])
+        return coords
+    finally:
+        workbook.close()
+
+
+def iter_metric_chunks(file_name, chunk_size=CHUNK_SIZE):
+    """Построчно читает первый лист и отдает его пачками DataFrame"""
+    workbook = load_workbook(file_name, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        columns = [METRICS_RENAME.get(name, name) for name in next(rows)]
+
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+
+def enrich_chunk(chunk, coords):
+    """Добавляет координаты из словаря и очищает пачку"""
+    points = chunk["Адрес"].map(coords)
+    chunk["Долгота"] = points.str[0]
+    chunk["Широта"] = points.str[1]
+
+    # В режиме read_only пустые ячейки приходят как None, а числа иногда строками
+    for column in ("Скорость", "Поток", "Долгота", "Широта"):
+        chunk[column] = pd.to_numeric(chunk[column], errors="coerce")
+    return filter_valid_rows(chunk)
+
+
+def read_traffic_file(file_name, chunk_size=CHUNK_SIZE):
+    """Читает книгу построчно и возвращает очищенные строки с координатами"""
+    coords = read_coordinates(file_name)
+    chunks = [enrich_chunk(chunk, coords) for chunk in iter_metric_chunks(file_name, chunk_size)]
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+
+def process_excel_streaming(file_name, chunk_size=CHUNK_SIZE, table_name="transport_metrics", progress=None,
+                            method="upsert", digest=None):
+    """Потоково обрабатывает Excel: пачки сразу пишутся в архив (CSV и/или Parquet) и в PostgreSQL"""
+    conn = None
+    csv_file = None
+    rows_parsed = 0
+    rows_loaded = 0
+    try:
+        coords = read_coordinates(file_name)
+        # Части архива Parquet называются по хешу содержимого файла
+        archive_key = digest or (file_hash(file_name) if WRITE_PARQUET else None)
+
+        # Соединение берется из пула на все время разбора файла
+        conn = checkout()
+        cursor = conn.cursor()
+        create_transport_table(cursor, table_name)
+        ensure_rollup_tables(cursor, table_name)
+        conn.commit()
+
+        chunks = timed_iter(iter_metric_chunks(file_name, chunk_size), INGEST_STAGE_SECONDS, source=table_name, stage="read")
+        for part, chunk in enumerate(chunks):
+            rows_parsed += len(chunk)
+            with timed(INGEST_STAGE_SECONDS, source=table_name, stage="clean"):
+                chunk = enrich_chunk(chunk, coords)
+            if progress:
+                progress(rows_parsed=rows_parsed, rows_loaded=rows_loaded)
+            if chunk.empty:
+                continue
+
+            # Новые секции фиксируются отдельно, чтобы не держать блокировку таблицы всю загрузку пачки
+            if ensure_partitions(cursor, table_name, chunk["Дата"]):
+                conn.commit()
+            # Фиксируем каждую пачку, чтобы данные появлялись в БД до конца разбора файла
+            load_chunk(cursor, chunk, table_name, method)
+            conn.commit()
+            rows_loaded += len(chunk)
+
+            # Архив пишется после фиксации: пачка, не попавшая в БД, не попадает и в архив.
+            # Имя CSV определяется по дате первой загруженной строки
+            if WRITE_CSV and csv_file is None:
+                date_value = pd.to_datetime(chunk['Дата'].dropna().iloc[0], dayfirst=True)
+                csv_filename = f"transport_mertics_{date_value.strftime('%Y-%m-%d')}.csv"
+                csv_file = open(csv_filename, "w", encoding="utf-8", newline="")
+                chunk.to_csv(csv_file, index=False)
+            elif WRITE_CSV:
+                chunk.to_csv(csv_file, index=False, header=False)
+            if WRITE_PARQUET:
+                write_parquet(chunk, TRAFFIC_DATASET, TRANSPORT_COLUMNS, archive_key, part=part)
+            logger.info(f"Обработано строк: {rows_parsed}, загружено: {rows_loaded}")
+            if progress:
+                progress(rows_parsed=rows_parsed, rows_loaded=rows_loaded)
+
+        if rows_loaded == 0:
+            raise ValueError(f"В файле {file_name} нет строк для загрузки")
+
+        if digest is not None:
+            mark_ingested(cursor, "traffic", digest, file_name, rows_loaded)
+            conn.commit()
+
+        logger.info(f"Потоковая загрузка завершена: {rows_loaded} записей в таблицу {table_name}")
+        return rows_loaded
+
+    finally:
+        if csv_file is not None:
+            csv_file.close()
+        if conn:
+            cursor.close()
+            release(conn)
+
+
+def process_excel_to_postgres(file_name, streaming=False, chunk_size=CHUNK_SIZE, progress=None):
+    """Основная функция обработки данных
+
+    progress - необязательная функция, в которую передается число
+    прочитанных (rows_parsed) и загруженных (rows_loaded) строк.
+    """
+    try:
+        # Файл с тем же содержимым уже загружен: не разбираем его повторно
+        digest = file_hash(file_name)
+        with get_connection() as conn, conn.cursor() as cursor:
+            previous = find_ingested(cursor, "traffic", digest)
+            conn.commit()
+        if previous:
+            logger.info(f"Файл {file_name} уже загружен ({previous[0]}, {previous[2]}), пропускаем")
+            return True
+
+        if streaming:
+            logger.info("Начало потоковой обработки файла Excel")
+            process_excel_streaming(file_name, chunk_size, progress=progress, digest=digest)
+            return True
+
+        # Загрузка данных из Excel
+        logger.info("Начало обработки файла Excel")
+        
+        # Загружаем данные с первого листа (транспортные показатели)
+        df_metrics = pd.read_excel(
+            file_name, 
+            sheet_name=0
+        ).rename(columns=METRICS_RENAME)
+
+        # Загружаем данные со второго листа (адреса и координаты)
+        df_coords = pd.read_excel(
+            file_name, 
+            sheet_name=1,
+            usecols=["Адресная привязка", "Долгота", "Широта"]
+        ).rename(columns={"Адресная привязка": "Адрес"})
+
+        # Объединение данных
+        df_merged = pd.merge(
+            df_metrics,
+            df_coords,
+            on="Адрес",
+            how="left"
+        )
+
+        # Очистка данных
+        df_merged = filter_valid_rows(df_merged)
+        if progress:
+            progress(rows_parsed=len(df_metrics), rows_loaded=0)
+
+        # Загрузка в PostgreSQL
+        load_data_to_postgres(df_merged, "transport_metrics", DB_CONFIG)
+
+        # Архив пишется после фиксации строк в БД, но до отметки о загрузке файла:
+        # если запись архива не удалась, повторная загрузка файла допишет его
+        if WRITE_CSV:
+            date_value = pd.to_datetime(df_merged['Дата'].dropna().iloc[0])
+            date_str = date_value.strftime('%Y-%m-%d')
+            csv_filename = f"transport_mertics_{date_str}.csv"
+
+            # Сохранение в CSV
+            df_merged.to_csv(csv_filename, index=False, encoding="utf-8")
+            logger.info("Данные успешно сохранены в CSV файл")
+        if WRITE_PARQUET:
+            write_parquet(df_merged, TRAFFIC_DATASET, TRANSPORT_COLUMNS, digest)
+
+        with get_connection() as conn, conn.cursor() as cursor:
+            mark_ingested(cursor, "traffic", digest, file_name, len(df_merged))
+            conn.commit()
+        if progress:
+            progress(rows_parsed=len(df_metrics), rows_loaded=len(df_merged))
+        
+        return True
+        
+    except Exception as e:
+        logger.error(f"Ошибка при обработке данных: {str(e)}")
         return False
\ No newline at end of file
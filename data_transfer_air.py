@@ -1,111 +1,220 @@
-import pandas as pd
-import psycopg2
-from psycopg2 import sql
-from psycopg2.extras import execute_batch
-import logging
-from db_config import DB_CONFIG
-
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filename='data_air_processing.log'
-)
-logger = logging.getLogger(__name__)
-
-
-def load_data_to_postgres(df, table_name, connection_params):
-    """Загружает DataFrame в PostgreSQL"""
-    try:
-        conn = psycopg2.connect(**connection_params)
-        cursor = conn.cursor()
-        
-        # Создаем таблицу, если она не существует
-        create_table_query = sql.SQL("""
-         CREATE TABLE IF NOT EXISTS {} (
-            id SERIAL PRIMARY KEY,
-            Адрес TEXT,
-            Время TIME,
-            CO NUMERIC,
-            NO NUMERIC,
-            NO2 NUMERIC,
-            SO2 NUMERIC,
-            Дата DATE
-            )
-        """).format(sql.Identifier(table_name))
-        
-        cursor.execute(create_table_query)
-        conn.commit()
-        
-        # Подготавливаем данные для вставки
-        records = []
-        for _, row in df.iterrows():
-            record = (
-                row['Адрес'],
-                row['Время'],
-                row['CO(мг/м3)'],
-                row['NO(мг/м3)'],
-                row['NO2(мг/м3)'],
-                row['SO2(мг/м3)'],
-                row['Дата']
-            )
-            records.append(record)
-        
-        # Вставляем данные пачками
-        insert_query = sql.SQL("""
-        INSERT INTO {} (Адрес, Время, CO, NO, NO2, SO2, Дата)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """).format(sql.Identifier(table_name))
-        
-        execute_batch(cursor, insert_query, records)
-        conn.commit()
-        
-        logger.info(f"Успешно загружено {len(df)} записей в таблицу {table_name}")
-        
-    except Exception as e:
-        logger.error(f"Ошибка при загрузке в PostgreSQL: {str(e)}")
-        raise
-    finally:
-        if conn:
-            cursor.close()
-            conn.close()
-
-
-def process_excel_to_postgres_air(file_name):
-    """Основная функция обработки данных"""
-    try:
-        # Загрузка данных из Excel
-        logger.info("Начало обработки файла Excel")
-        
-
-        df_CO = pd.read_excel(file_name, sheet_name=0)
-
-        df_NO = pd.read_excel(file_name, sheet_name=1)
-
-        df_NO2 = pd.read_excel(file_name, sheet_name=2)
-    
-        df_SO2 = pd.read_excel(file_name, sheet_name=3)
-
-        # Объединение данных
-        df_merged = df_CO.join(df_NO["NO(мг/м3)"]).join(df_NO2["NO2(мг/м3)"]).join(df_SO2["SO2(мг/м3)"])
-
-
-        date_value = pd.to_datetime(df_merged['Дата'].dropna().iloc[0])
-        date_str = date_value.strftime('%Y-%m-%d')
-        csv_filename = f"air_mertics_{date_str}.csv"
-
-
-        # Сохранение в CSV
-        df_merged.to_csv(csv_filename, index=False, encoding="utf-8")
-        logger.info("Данные успешно сохранены в CSV файл")
-
-    
-        # Загрузка в PostgreSQL
-        load_data_to_postgres(df_merged, "air_pollution", DB_CONFIG)
-        
-        return True
-        
-    except Exception as e:
-        logger.error(f"Ошибка при обработке данных: {str(e)}")
+import os
+import pandas as pd
+from psycopg2 import sql
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from openpyxl import load_workbook
+from db_config import DB_CONFIG
+from db_pool import get_connection
+from bulk_load import bulk_load, ensure_unique_key, AIR_COLUMNS, AIR_KEY
+from file_registry import file_hash, find_ingested, mark_ingested
+from partitions import ensure_partitioned_table, ensure_partitions
+from change_log import ensure_change_log
+from archive import write_parquet, WRITE_CSV, WRITE_PARQUET, AIR_DATASET
+from metrics import timed, INGEST_STAGE_SECONDS, INGEST_ROWS
+
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    filename='data_air_processing.log'
+)
+logger = logging.getLogger(__name__)
+
+# Колонки показателей; каждый лист книги содержит одну из них
+POLLUTANT_COLUMNS = ["CO(мг/м3)", "NO(мг/м3)", "NO2(мг/м3)", "SO2(мг/м3)"]
+
+# Ключ, по которому сопоставляются строки листов
+AIR_MERGE_KEY = ["Адрес", "Дата", "Время"]
+
+# Число процессов для разбора листов; 1 - все листы по очереди из одной открытой книги
+AIR_READ_WORKERS = int(os.environ.get("AIR_READ_WORKERS", 1))
+
+
+def create_air_table(cursor, table_name):
+    """Создает таблицу экологических показателей, если она не существует"""
+    create_table_query = sql.SQL("""
+     CREATE TABLE IF NOT EXISTS {} (
+        id SERIAL,
+        Адрес TEXT,
+        Время TIME,
+        CO NUMERIC,
+        NO NUMERIC,
+        NO2 NUMERIC,
+        SO2 NUMERIC,
+        Дата DATE NOT NULL,
+        PRIMARY KEY (id, Дата)
+        ) PARTITION BY RANGE (Дата)
+    """).format(sql.Identifier(table_name))
+
+    # Секции по месяцам, как и у транспортных данных
+    ensure_partitioned_table(cursor, table_name, create_table_query)
+    ensure_change_log(cursor)
+
+    # Уникальный индекс по (Адрес, Дата, Время) обслуживает и запросы дашборда по адресу за период
+    ensure_unique_key(cursor, table_name, AIR_KEY)
+    cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(
+        sql.Identifier(f"{table_name}_address_date_time_idx")))
+
+
+def load_chunk(cursor, df, table_name, method="upsert"):
+    """Загружает пачку строк в таблицу экологических показателей"""
+    ensure_partitions(cursor, table_name, df["Дата"])
+    with timed(INGEST_STAGE_SECONDS, source=table_name, stage="load"):
+        bulk_load(cursor, df, table_name, AIR_COLUMNS, method=method, key=AIR_KEY)
+    INGEST_ROWS.inc(len(df), source=table_name)
+
+
+def load_data_to_postgres(df, table_name, connection_params=None, method="upsert"):
+    """Загружает DataFrame в PostgreSQL"""
+    try:
+        with get_connection(connection_params) as conn, conn.cursor() as cursor:
+            # Создаем таблицу, если она не существует
+            create_air_table(cursor, table_name)
+            ensure_partitions(cursor, table_name, df["Дата"])
+            conn.commit()
+        
+            # Загружаем данные одним потоком через COPY
+            load_chunk(cursor, df, table_name, method)
+            conn.commit()
+        
+            logger.info(f"Успешно загружено {len(df)} записей в таблицу {table_name}")
+
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке в PostgreSQL: {str(e)}")
+        raise
+
+
+def _sheet_frame(rows):
+    """DataFrame из строк листа (первая строка - заголовок)"""
+    # Пустой лист дает пустую таблицу, merge_air_sheets его пропустит
+    header = next(rows, ())
+    return pd.DataFrame(list(rows), columns=header)
+
+
+def _read_sheet(file_name, index):
+    workbook = load_workbook(file_name, read_only=True, data_only=True)
+    try:
+        return _sheet_frame(workbook.worksheets[index].iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def read_air_sheets(file_name, workers=AIR_READ_WORKERS):
+    """Читает все листы книги: из одной открытой книги или параллельно по листу на процесс"""
+    workbook = load_workbook(file_name, read_only=True, data_only=True)
+    try:
+        if workers <= 1:
+            return [_sheet_frame(sheet.iter_rows(values_only=True)) for sheet in workbook.worksheets]
+        sheet_count = len(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+    with ProcessPoolExecutor(max_workers=min(workers, sheet_count)) as executor:
+        return list(executor.map(_read_sheet, [file_name] * sheet_count, range(sheet_count)))
+
+
+def _keyed_sheet(df, pollutant):
+    """Лист с нормализованным ключом (Адрес, Дата, Время), отсортированный по ключу"""
+    keyed = pd.DataFrame({
+        "Адрес": df["Адрес"].astype("string").str.strip(),
+        "Дата": pd.to_datetime(df["Дата"], dayfirst=True, errors="coerce"),
+        "Время": df["Время"].astype("string"),
+        pollutant: pd.to_numeric(df[pollutant], errors="coerce"),
+    })
+    invalid = keyed[AIR_MERGE_KEY].isna().any(axis=1)
+    if invalid.any():
+        logger.warning(f"Лист {pollutant}: {invalid.sum()} строк без адреса, даты или времени пропущено")
+    keyed = keyed[~invalid].set_index(AIR_MERGE_KEY).sort_index()
+
+    duplicated = keyed.index.duplicated()
+    if duplicated.any():
+        logger.warning(f"Лист {pollutant}: {duplicated.sum()} повторов ключа, оставлены первые значения")
+        keyed = keyed[~duplicated]
+    return keyed
+
+
+def merge_air_sheets(sheets):
+    """Сопоставляет листы показателей по (Адрес, Дата, Время) вместо порядка строк"""
+    keyed = []
+    for df in sheets:
+        pollutant = next((column for column in POLLUTANT_COLUMNS if column in df.columns), None)
+        if pollutant is None:
+            # Служебные листы (примечания, легенда) не мешают загрузке; отсутствие показателя проверяется ниже
+            logger.warning(f"Лист без колонок {POLLUTANT_COLUMNS} пропущен: {list(df.columns)}")
+            continue
+        keyed.append(_keyed_sheet(df, pollutant))
+
+    missing = [column for column in POLLUTANT_COLUMNS if column not in {sheet.columns[0] for sheet in keyed}]
+    if missing:
+        raise ValueError(f"В книге нет листов с показателями {missing}")
+
+    # Выравнивание по отсортированному ключу: внешнее объединение индексов
+    merged = pd.concat(keyed, axis=1, join="outer")
+
+    # Ключи, которых нет хотя бы на одном листе, загружаются с пустыми значениями отсутствующих показателей
+    for sheet in keyed:
+        absent = merged.index.difference(sheet.index)
+        if len(absent):
+            examples = ", ".join(f"{address} {date:%d.%m.%Y} {time}" for address, date, time in absent[:3])
+            logger.warning(f"Нет строк на листе {sheet.columns[0]} для {len(absent)} ключей, например: {examples}")
+
+    return merged.reset_index()[AIR_MERGE_KEY + POLLUTANT_COLUMNS]
+
+
+def process_excel_to_postgres_air(file_name, progress=None):
+    """Основная функция обработки данных
+
+    progress - необязательная функция, в которую передается число
+    прочитанных (rows_parsed) и загруженных (rows_loaded) строк.
+    """
+    try:
+        # Файл с тем же содержимым уже загружен: не разбираем его повторно
+        digest = file_hash(file_name)
+        with get_connection() as conn, conn.cursor() as cursor:
+            previous = find_ingested(cursor, "pollution", digest)
+            conn.commit()
+        if previous:
+            logger.info(f"Файл {file_name} уже загружен ({previous[0]}, {previous[2]}), пропускаем")
+            return True
+
+        # Загрузка данных из Excel
+        logger.info("Начало обработки файла Excel")
+
+        # Книга открывается один раз, листы сопоставляются по ключу, а не по порядку строк.
+        # Строки без даты отбрасываются: они не попали бы ни в одну месячную секцию
+        with timed(INGEST_STAGE_SECONDS, source="air_pollution", stage="read"):
+            sheets = read_air_sheets(file_name)
+        with timed(INGEST_STAGE_SECONDS, source="air_pollution", stage="clean"):
+            df_merged = merge_air_sheets(sheets)
+        if progress:
+            progress(rows_parsed=len(df_merged), rows_loaded=0)
+
+        # Загрузка в PostgreSQL
+        load_data_to_postgres(df_merged, "air_pollution", DB_CONFIG)
+
+        # Архив пишется после фиксации строк в БД, но до отметки о загрузке файла
+        if WRITE_CSV:
+            date_value = df_merged['Дата'].iloc[0]
+            date_str = date_value.strftime('%Y-%m-%d')
+            csv_filename = f"air_mertics_{date_str}.csv"
+
+
+            # Сохранение в CSV
+            df_merged.to_csv(csv_filename, index=False, encoding="utf-8")
+            logger.info("Данные успешно сохранены в CSV файл")
+        if WRITE_PARQUET:
+            write_parquet(df_merged, AIR_DATASET, AIR_COLUMNS, digest)
+
+        with get_connection() as conn, conn.cursor() as cursor:
+            mark_ingested(cursor, "pollution", digest, file_name, len(df_merged))
+            conn.commit()
+        if progress:
+            progress(rows_parsed=len(df_merged), rows_loaded=len(df_merged))
+        
+        return True
+        
+    except Exception as e:
+        logger.error(f"Ошибка при обработке данных: {str(e)}")
         return False
\ No newline at end of file
@@ -0,0 +1,137 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool
+from db_config import DB_CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+# Размеры пула и время ожидания свободного соединения, с
+POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN", 1))
+POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX", 10))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+
+# Ожидание дольше этого порога попадает в лог как предупреждение, с
+SLOW_WAIT = 1.0
+
+_lock = threading.Lock()
+_pool = None
+_slots = None
+_pool_pid = None
+_stats = {
+    "checkouts": 0,
+    "wait_total": 0.0,
+    "wait_max": 0.0,
+    "timeouts": 0,
+    "broken": 0,
+}
+
+
+def _get_pool():
+    """Создает пул при первом обращении (и заново в дочернем процессе после fork)"""
+    global _pool, _slots, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = pool.ThreadedConnectionPool(POOL_MIN_SIZE, POOL_MAX_SIZE, **DB_CONFIG)
+            # ThreadedConnectionPool не ждет свободного соединения, а сразу падает, поэтому ограничиваем выдачу семафором
+            _slots = threading.BoundedSemaphore(POOL_MAX_SIZE)
+            _pool_pid = os.getpid()
+            logger.info(f"Создан пул соединений PostgreSQL ({POOL_MIN_SIZE}-{POOL_MAX_SIZE})")
+        return _pool, _slots
+
+
+def _is_alive(conn):
+    """Проверяет соединение перед выдачей"""
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _record_wait(waited):
+    with _lock:
+        _stats["checkouts"] += 1
+        _stats["wait_total"] += waited
+        _stats["wait_max"] = max(_stats["wait_max"], waited)
+    if waited > SLOW_WAIT:
+        logger.warning(f"Ожидание соединения из пула заняло {waited:.2f} с")
+
+
+def checkout():
+    """Берет из пула проверенное соединение, при необходимости ожидая освобождения"""
+    connection_pool, slots = _get_pool()
+    start = time.perf_counter()
+    if not slots.acquire(timeout=POOL_TIMEOUT):
+        with _lock:
+            _stats["timeouts"] += 1
+        raise pool.PoolError(f"Нет свободных соединений в пуле за {POOL_TIMEOUT} с")
+
+    try:
+        conn = connection_pool.getconn()
+        # Сломанное соединение закрываем и берем новое
+        while not _is_alive(conn):
+            with _lock:
+                _stats["broken"] += 1
+            connection_pool.putconn(conn, close=True)
+            conn = connection_pool.getconn()
+    except Exception:
+        slots.release()
+        raise
+
+    _record_wait(time.perf_counter() - start)
+    return conn
+
+
+def release(conn):
+    """Возвращает соединение в пул; незавершенная транзакция откатывается пулом"""
+    connection_pool, slots = _get_pool()
+    try:
+        connection_pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        slots.release()
+
+
+@contextmanager
+def get_connection(connection_params=None):
+    """Соединение из общего пула; для нестандартных параметров открывается отдельное"""
+    if connection_params is not None and connection_params != DB_CONFIG:
+        conn = psycopg2.connect(**connection_params)
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+
+    conn = checkout()
+    try:
+        yield conn
+    finally:
+        release(conn)
+
+
+def pool_stats():
+    """Метрики ожидания соединений из пула"""
+    with _lock:
+        stats = dict(_stats)
+    stats["wait_avg"] = stats["wait_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+    stats["min_size"] = POOL_MIN_SIZE
+    stats["max_size"] = POOL_MAX_SIZE
+    return stats
+
+
+def close_pool():
+    """Закрывает все соединения пула"""
+    global _pool
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
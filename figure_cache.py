@@ -0,0 +1,99 @@
+import os
+import json
+import logging
+import threading
+import functools
+from collections import OrderedDict
+from plotly.utils import PlotlyJSONEncoder
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Предельный объем кэша, МБ
+FIGURE_CACHE_MB = float(os.environ.get("FIGURE_CACHE_MB", 64))
+
+
+def _freeze(value):
+    """Делает аргумент callback пригодным для ключа словаря"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+class FigureCache:
+    """LRU-кэш сериализованных результатов callback с ограничением по объему"""
+
+    def __init__(self, max_bytes=int(FIGURE_CACHE_MB * 2**20), version=lambda: 0):
+        self.max_bytes = max_bytes
+        # Версия данных входит в ключ, поэтому после загрузки новых данных старые записи не используются
+        self.version = version
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return json.loads(payload)
+
+    def put(self, key, value):
+        payload = json.dumps(value, cls=PlotlyJSONEncoder).encode("utf-8")
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = payload
+            self._size += len(payload)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def memoize(self, func):
+        """Декоратор для callback: результат кэшируется по аргументам и версии данных"""
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = (func.__name__, self.version()) + _freeze(args)
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+
+            result = func(*args)
+            # Кэшируем уже сериализованный результат, при попадании отдаем его копию
+            try:
+                with metrics.stage("serialize"):
+                    self.put(key, result)
+            except TypeError as e:
+                logger.warning(f"Результат {func.__name__} не сериализуется и не кэшируется: {e}")
+            return result
+        return wrapper
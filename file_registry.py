@@ -0,0 +1,46 @@
+import hashlib
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Журнал загруженных файлов: повторная загрузка того же содержимого пропускается без разбора
+REGISTRY_DDL = """
+CREATE TABLE IF NOT EXISTS ingested_files (
+    kind TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    filename TEXT,
+    rows_loaded INT,
+    loaded_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (kind, sha256)
+)
+"""
+
+
+def file_hash(file_name, block_size=2**20):
+    """SHA-256 содержимого файла, читается блоками"""
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_ingested(cursor, kind, digest):
+    """Запись о ранее загруженном файле с тем же содержимым или None"""
+    cursor.execute(REGISTRY_DDL)
+    cursor.execute(
+        "SELECT filename, rows_loaded, loaded_at FROM ingested_files WHERE kind = %s AND sha256 = %s",
+        (kind, digest)
+    )
+    return cursor.fetchone()
+
+
+def mark_ingested(cursor, kind, digest, file_name, rows_loaded):
+    """Отмечает файл загруженным (в той же транзакции, что и последние данные)"""
+    cursor.execute(REGISTRY_DDL)
+    cursor.execute("""
+    INSERT INTO ingested_files (kind, sha256, filename, rows_loaded) VALUES (%s, %s, %s, %s)
+    ON CONFLICT (kind, sha256) DO UPDATE
+    SET filename = EXCLUDED.filename, rows_loaded = EXCLUDED.rows_loaded, loaded_at = now()
+    """, (kind, digest, file_name, rows_loaded))
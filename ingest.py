@@ -0,0 +1,229 @@
+import os
+import sys
+import glob
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from openpyxl import load_workbook
+import data_transfer
+import data_transfer_air
+from db_pool import get_connection, checkout, release
+from file_registry import file_hash, find_ingested, mark_ingested
+from rollups import ensure_rollup_tables
+from partitions import ensure_partitions
+from archive import write_parquet, WRITE_PARQUET, TRAFFIC_DATASET, AIR_DATASET
+from bulk_load import TRANSPORT_COLUMNS, AIR_COLUMNS
+
+
+logger = logging.getLogger(__name__)
+
+TRAFFIC_TABLE = "transport_metrics"
+AIR_TABLE = "air_pollution"
+
+
+def find_files(patterns):
+    """Книги Excel из каталогов (рекурсивно) и шаблонов вида data/*.xlsx"""
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files.update(glob.glob(os.path.join(pattern, "**", "*.xlsx"), recursive=True))
+        else:
+            files.update(glob.glob(pattern, recursive=True))
+    # Временные файлы Excel (~$name.xlsx) пропускаем
+    return sorted(path for path in files if not os.path.basename(path).startswith("~$"))
+
+
+def detect_kind(file_name):
+    """Тип книги по структуре листов: 'traffic', 'pollution' или None"""
+    workbook = load_workbook(file_name, read_only=True, data_only=True)
+    try:
+        headers = [next(sheet.iter_rows(max_row=1, values_only=True), ()) for sheet in workbook.worksheets]
+    finally:
+        workbook.close()
+
+    if len(headers) >= 2 and "Адресная привязка" in headers[1]:
+        return "traffic"
+    pollutants = {column for header in headers for column in data_transfer_air.POLLUTANT_COLUMNS if column in header}
+    if pollutants == set(data_transfer_air.POLLUTANT_COLUMNS):
+        return "pollution"
+    return None
+
+
+def parse_file(file_name):
+    """Выполняется в процессе пула: определяет тип книги и разбирает ее в DataFrame"""
+    start = time.perf_counter()
+    kind = detect_kind(file_name)
+    df = None
+    if kind == "traffic":
+        df = data_transfer.read_traffic_file(file_name)
+    elif kind == "pollution":
+        # Процессы уже заняты разными файлами, листы одной книги читаем по очереди
+        df = data_transfer_air.merge_air_sheets(data_transfer_air.read_air_sheets(file_name, workers=1))
+    return kind, df, time.perf_counter() - start
+
+
+def write_file(kind, df, digest, file_name):
+    """Загружает разобранную книгу одной транзакцией, дописывает архив и отмечает файл загруженным"""
+    start = time.perf_counter()
+    conn = checkout()
+    try:
+        with conn.cursor() as cursor:
+            # Новые секции фиксируются до загрузки: создание секции блокирует всю таблицу
+            if ensure_partitions(cursor, TRAFFIC_TABLE if kind == "traffic" else AIR_TABLE, df["Дата"]):
+                conn.commit()
+            if kind == "traffic":
+                data_transfer.load_chunk(cursor, df, TRAFFIC_TABLE)
+            else:
+                data_transfer_air.load_chunk(cursor, df, AIR_TABLE)
+        conn.commit()
+
+        # Архив - только после фиксации строк в БД, отметка - после архива: если он не записался,
+        # повторный запуск загрузит файл заново (upsert не создаст повторов) и допишет архив
+        if WRITE_PARQUET:
+            if kind == "traffic":
+                write_parquet(df, TRAFFIC_DATASET, TRANSPORT_COLUMNS, digest)
+            else:
+                write_parquet(df, AIR_DATASET, AIR_COLUMNS, digest)
+        with conn.cursor() as cursor:
+            mark_ingested(cursor, kind, digest, file_name, len(df))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release(conn)
+    return time.perf_counter() - start
+
+
+def prepare_tables():
+    """Создает таблицы заранее, чтобы параллельные загрузчики не выполняли DDL одновременно"""
+    with get_connection() as conn, conn.cursor() as cursor:
+        data_transfer.create_transport_table(cursor, TRAFFIC_TABLE)
+        ensure_rollup_tables(cursor, TRAFFIC_TABLE)
+        data_transfer_air.create_air_table(cursor, AIR_TABLE)
+        conn.commit()
+
+
+def pending_files(files, stats):
+    """Отбрасывает файлы, содержимое которых уже загружено (повторный запуск продолжает с места остановки)"""
+    start = time.perf_counter()
+    pending = []
+    with get_connection() as conn, conn.cursor() as cursor:
+        for file_name in files:
+            digest = file_hash(file_name)
+            if any(find_ingested(cursor, kind, digest) for kind in ("traffic", "pollution")):
+                stats["skipped"] += 1
+                continue
+            pending.append((file_name, digest))
+        conn.commit()
+    stats["hash_time"] += time.perf_counter() - start
+    return pending
+
+
+def run(files, workers, writers):
+    """Разбирает книги в пуле процессов и загружает их ограниченным числом параллельных писателей"""
+    stats = {
+        "files": len(files), "loaded": 0, "skipped": 0, "unknown": 0, "failed": 0, "rows": 0,
+        "hash_time": 0.0, "parse_time": 0.0, "write_time": 0.0,
+    }
+    wall_start = time.perf_counter()
+    prepare_tables()
+    pending = pending_files(files, stats)
+    logger.info(f"К загрузке {len(pending)} из {len(files)} файлов")
+
+    lock = threading.Lock()
+    # Разобранные, но еще не записанные книги держатся в памяти: ограничиваем их число
+    slots = threading.BoundedSemaphore(workers + writers)
+    write_pool = ThreadPoolExecutor(max_workers=writers)
+
+    def on_written(file_name, rows, future):
+        try:
+            elapsed = future.result()
+            with lock:
+                stats["loaded"] += 1
+                stats["rows"] += rows
+                stats["write_time"] += elapsed
+            logger.info(f"{file_name}: загружено {rows} строк за {elapsed:.2f} с")
+        except Exception as e:
+            with lock:
+                stats["failed"] += 1
+            logger.error(f"{file_name}: ошибка загрузки: {e}")
+        finally:
+            slots.release()
+
+    def on_parsed(file_name, digest, future):
+        try:
+            kind, df, elapsed = future.result()
+            if kind is None:
+                problem = "unknown"
+                logger.warning(f"{file_name}: структура листов не похожа ни на транспортную, ни на экологическую выгрузку")
+            elif df.empty:
+                problem = "failed"
+                logger.error(f"{file_name}: нет строк для загрузки")
+            else:
+                problem = None
+        except Exception as e:
+            elapsed, problem = 0.0, "failed"
+            logger.error(f"{file_name}: ошибка разбора: {e}")
+
+        with lock:
+            stats["parse_time"] += elapsed
+            if problem:
+                stats[problem] += 1
+        if problem:
+            slots.release()
+            return
+
+        write_future = write_pool.submit(write_file, kind, df, digest, file_name)
+        write_future.add_done_callback(lambda f: on_written(file_name, len(df), f))
+
+    with ProcessPoolExecutor(max_workers=workers) as parse_pool:
+        for file_name, digest in pending:
+            slots.acquire()
+            future = parse_pool.submit(parse_file, file_name)
+            future.add_done_callback(lambda f, name=file_name, digest=digest: on_parsed(name, digest, f))
+    write_pool.shutdown(wait=True)
+
+    stats["wall_time"] = time.perf_counter() - wall_start
+    return stats
+
+
+def print_summary(stats):
+    wall = stats["wall_time"]
+    print(
+        f"Файлов: {stats['files']}, загружено {stats['loaded']}, пропущено (уже загружены) {stats['skipped']}, "
+        f"не распознано {stats['unknown']}, с ошибкой {stats['failed']}"
+    )
+    print(
+        f"Строк: {stats['rows']} за {wall:.2f} с: "
+        f"{stats['loaded'] / wall if wall else 0:.2f} файлов/с, {stats['rows'] / wall if wall else 0:.0f} строк/с"
+    )
+    # Время разбора и записи суммируется по процессам и потокам, поэтому может превышать общее
+    print(
+        f"Этапы (суммарно): хеширование {stats['hash_time']:.2f} с, "
+        f"разбор {stats['parse_time']:.2f} с, запись {stats['write_time']:.2f} с"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stdout,
+        force=True
+    )
+    parser = argparse.ArgumentParser(description="Пакетная загрузка транспортных и экологических выгрузок")
+    parser.add_argument("paths", nargs="+", help="каталоги или шаблоны файлов .xlsx")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="процессов для разбора книг")
+    parser.add_argument("--writers", type=int, default=2, help="одновременных загрузок в PostgreSQL")
+    args = parser.parse_args()
+
+    files = find_files(args.paths)
+    if not files:
+        sys.exit(f"Не найдено файлов .xlsx: {args.paths}")
+
+    stats = run(files, args.workers, args.writers)
+    print_summary(stats)
+    sys.exit(1 if stats["failed"] else 0)
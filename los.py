@@ -0,0 +1,62 @@
+import numpy as np
+
+
+Q_CAPACITY = 1800  # нормативная пропускная способность на одну полосу, авт./ч
+V_FREE = 20        # скорость свободного потока, км/ч
+
+LOS_LEVELS = ["A", "B", "C", "D", "E"]
+WORST_LEVEL = "F"
+
+# Нижние границы коэффициента скорости kv для уровней A-E (ниже последней - F)
+LOS_KV_THRESHOLDS = [0.9, 0.8, 0.7, 0.6, 0.5]
+
+# Верхние границы коэффициента загрузки z для уровней A-E (выше последней - F)
+LOS_Z_THRESHOLDS = [0.2, 0.45, 0.65, 0.9, 1]
+
+# Цветовая карта по уровням обслуживания
+LOS_COLORS = {
+    "A": "green",
+    "B": "lime",
+    "C": "yellow",
+    "D": "orange",
+    "E": "orangered",
+    "F": "red"
+}
+
+
+# Дискретная шкала: код уровня k (0 - A, ..., 5 - F) при cmin=0 и cmax=5 получает свой цвет.
+# Числовые коды plotly проверяет целым массивом, а не по одной строке на точку.
+LOS_COLORSCALE = [
+    [code / (len(LOS_COLORS) - 1), color]
+    for code, color in enumerate(LOS_COLORS.values())
+]
+LOS_CODE_MAX = len(LOS_COLORS) - 1
+
+
+def classify_kv(kv, thresholds=LOS_KV_THRESHOLDS):
+    """Уровень обслуживания по коэффициенту скорости: чем больше kv, тем лучше"""
+    kv = np.asarray(kv)
+    return np.select([kv >= bound for bound in thresholds], LOS_LEVELS[:len(thresholds)], WORST_LEVEL)
+
+
+def classify_z(z, thresholds=LOS_Z_THRESHOLDS):
+    """Уровень обслуживания по коэффициенту загрузки: чем меньше z, тем лучше"""
+    z = np.asarray(z)
+    return np.select([z <= bound for bound in thresholds], LOS_LEVELS[:len(thresholds)], WORST_LEVEL)
+
+
+def add_los_columns(df, q_capacity=Q_CAPACITY, v_free=V_FREE,
+                    kv_thresholds=LOS_KV_THRESHOLDS, z_thresholds=LOS_Z_THRESHOLDS):
+    """Добавляет коэффициенты загрузки и скорости, уровни обслуживания и их коды для раскраски"""
+    # Расчёт коэффициента загрузки z и коэффициента скорости kv.
+    # Считаем в float64, иначе граничные значения (например, 18 км/ч -> kv = 0.9) округляются в float32
+    df["z"] = df["Поток"].astype("float64") / q_capacity
+    df["kv"] = df["Скорость"].astype("float64") / v_free
+
+    df["LOS_kv"] = classify_kv(df["kv"], kv_thresholds)
+    df["LOS_z"] = classify_z(df["z"], z_thresholds)
+
+    levels = list(LOS_COLORS)
+    df["los_code_z"] = np.searchsorted(levels, df["LOS_z"]).astype("int8")
+    df["los_code_kv"] = np.searchsorted(levels, df["LOS_kv"]).astype("int8")
+    return df
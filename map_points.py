@@ -0,0 +1,74 @@
+import os
+import logging
+import numpy as np
+from los import add_los_columns
+
+
+logger = logging.getLogger(__name__)
+
+# Если точек на карте больше этого порога, они объединяются в ячейки сетки
+MAP_MAX_POINTS = int(os.environ.get("MAP_MAX_POINTS", 2000))
+
+# Начальный размер ячейки сетки, градусы (около 500 м по широте)
+MAP_GRID_CELL = float(os.environ.get("MAP_GRID_CELL", 0.005))
+
+
+def _finish_points(points):
+    """Средние значения по сумме и числу записей, уровни обслуживания по средним"""
+    points["Поток"] = (points["flow_sum"] / points["count"]).round(1)
+    points["Скорость"] = (points["speed_sum"] / points["count"]).round(1)
+    return add_los_columns(points)
+
+
+def aggregate_points(summary):
+    """Одна точка на уникальные координаты датчика; на вход - суммы по адресам за период"""
+    points = summary.dropna(subset=["lat", "lon"]).groupby(["lat", "lon"], sort=False).agg(
+        Адрес=("Адрес", "first"),
+        sensors=("Адрес", "size"),
+        flow_sum=("flow_sum", "sum"),
+        speed_sum=("speed_sum", "sum"),
+        count=("count", "sum")
+    ).reset_index()
+    points["Адрес"] = points["Адрес"].astype(str)
+    return points
+
+
+def bin_points(points, cell):
+    """Объединяет точки в ячейки квадратной сетки со стороной cell градусов"""
+    cells = points.assign(
+        cell_lat=np.floor(points["lat"] / cell),
+        cell_lon=np.floor(points["lon"] / cell),
+        # Координаты ячейки - центр ее точек, взвешенный по числу записей
+        lat_sum=points["lat"] * points["count"],
+        lon_sum=points["lon"] * points["count"]
+    )
+    binned = cells.groupby(["cell_lat", "cell_lon"], sort=False).agg(
+        Адрес=("Адрес", "first"),
+        sensors=("sensors", "sum"),
+        lat_sum=("lat_sum", "sum"),
+        lon_sum=("lon_sum", "sum"),
+        flow_sum=("flow_sum", "sum"),
+        speed_sum=("speed_sum", "sum"),
+        count=("count", "sum")
+    ).reset_index(drop=True)
+    binned["lat"] = binned["lat_sum"] / binned["count"]
+    binned["lon"] = binned["lon_sum"] / binned["count"]
+
+    grouped = binned["sensors"] > 1
+    binned.loc[grouped, "Адрес"] = (
+        "Датчиков: " + binned.loc[grouped, "sensors"].astype(str) + " (" + binned.loc[grouped, "Адрес"] + " и др.)"
+    )
+    return binned.drop(columns=["lat_sum", "lon_sum"])
+
+
+def map_points(summary, max_points=MAP_MAX_POINTS, cell=MAP_GRID_CELL):
+    """Точки для карты: по одной на датчик, а при большом числе датчиков - по ячейкам сетки"""
+    points = aggregate_points(summary)
+    binned = points
+    # Укрупняем сетку, пока точек больше порога; ячейки всегда строятся по исходным точкам
+    while len(binned) > max_points:
+        binned = bin_points(points, cell)
+        cell *= 2
+    if len(binned) < len(points):
+        logger.info(f"Карта: {len(points)} датчиков объединены в {len(binned)} ячеек сетки")
+    return _finish_points(binned)
@@ -0,0 +1,310 @@
+import os
+import time
+import bisect
+import cProfile
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм: время, с, и число строк
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROWS_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 5e6, 1e7, 5e7)
+
+# Каталог для профилей медленных callback (cProfile); не задан - профилирование выключено
+PROFILE_DIR = os.environ.get("METRICS_PROFILE_DIR")
+# Профиль сохраняется, если callback выполнялся дольше порога, с
+PROFILE_SLOW_SECONDS = float(os.environ.get("METRICS_PROFILE_SLOW", 1.0))
+
+# Имя callback, который выполняется в текущем потоке (для меток этапов)
+_current = threading.local()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """Счетчик с метками"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dump(self):
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, values):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(self.dump().items())]
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и метками (как histogram в Prometheus)"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: число наблюдений по корзинам (последняя - +Inf), сумма
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def dump(self):
+        with self._lock:
+            return {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+
+    def merge(self, values):
+        with self._lock:
+            for key, (counts, total) in values.items():
+                series = self._series.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = []
+        for key, (counts, total) in sorted(self.dump().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text):
+        return self._add(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=SECONDS_BUCKETS):
+        return self._add(Histogram(name, help_text, buckets))
+
+    def dump(self):
+        """Снимок значений, который можно передать из дочернего процесса"""
+        return {name: metric.dump() for name, metric in self._metrics.items()}
+
+    def merge(self, snapshot):
+        """Добавляет значения, накопленные в другом процессе"""
+        for name, values in (snapshot or {}).items():
+            if name in self._metrics:
+                self._metrics[name].merge(values)
+
+    def reset(self):
+        for metric in self._metrics.values():
+            metric.reset()
+
+    def render(self):
+        """Текстовый формат Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+CALLBACK_SECONDS = registry.histogram("dashboard_callback_seconds", "Время выполнения callback дашборда")
+CALLBACK_ERRORS = registry.counter("dashboard_callback_errors_total", "Исключения в callback дашборда")
+STAGE_SECONDS = registry.histogram("dashboard_stage_seconds", "Время этапов callback: фильтрация, группировка, построение графика, сериализация")
+REQUEST_SECONDS = registry.histogram("dashboard_request_seconds", "Время HTTP-запроса обновления компонентов, включая сериализацию ответа")
+RESPONSE_BYTES = registry.histogram("dashboard_response_bytes", "Размер ответа на запрос обновления компонентов", BYTES_BUCKETS)
+QUERY_SECONDS = registry.histogram("db_query_seconds", "Время запросов к PostgreSQL")
+QUERY_ROWS = registry.histogram("db_query_rows", "Число строк в результате запроса", ROWS_BUCKETS)
+INGEST_STAGE_SECONDS = registry.histogram("ingest_stage_seconds", "Время этапов загрузки файлов: чтение, архив, запись, агрегаты")
+INGEST_ROWS = registry.counter("ingest_rows_total", "Загружено строк")
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Контекстный менеджер: записывает время выполнения блока в гистограмму"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+def timed_iter(iterable, histogram, **labels):
+    """Записывает в гистограмму время получения каждого элемента (например, чтения пачки из файла)"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        histogram.observe(time.perf_counter() - start, **labels)
+        yield item
+
+
+class StageTimer:
+    """Засекает этапы callback подряд: lap("filter") записывает время с предыдущей отметки"""
+
+    def __init__(self):
+        self.callback = getattr(_current, "callback", None) or "unknown"
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        STAGE_SECONDS.observe(now - self._last, callback=self.callback, stage=stage)
+        self._last = now
+
+
+@contextmanager
+def stage(name):
+    """Контекстный менеджер для этапа текущего callback"""
+    timer = StageTimer()
+    try:
+        yield
+    finally:
+        timer.lap(name)
+
+
+def _start_profiler():
+    if not PROFILE_DIR:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # В потоке уже работает другой профилировщик
+        return None
+    return profiler
+
+
+def _save_profile(profiler, name, elapsed):
+    profiler.disable()
+    if elapsed < PROFILE_SLOW_SECONDS:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{elapsed:.2f}s.prof")
+    profiler.dump_stats(path)
+    logger.warning(f"{name}: медленный вызов ({elapsed:.2f} с), профиль сохранен в {path}")
+
+
+def instrument(func):
+    """Декоратор для callback: время в лог и в гистограмму, медленные вызовы - в профиль cProfile"""
+    @functools.wraps(func)
+    def wrapper(*args):
+        name = func.__name__
+        _current.callback = name
+        profiler = _start_profiler()
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        except Exception:
+            CALLBACK_ERRORS.inc(callback=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.callback = None
+            CALLBACK_SECONDS.observe(elapsed, callback=name)
+            logger.info(f"{name}: {elapsed:.3f} с")
+            if profiler is not None:
+                _save_profile(profiler, name, elapsed)
+    return wrapper
+
+
+def _result_rows(result):
+    # DataFrame или Series - число строк; кортеж таблиц - их сумма
+    if hasattr(result, "shape"):
+        return result.shape[0]
+    if isinstance(result, tuple):
+        frames = [item for item in result if hasattr(item, "shape")]
+        return sum(item.shape[0] for item in frames) if frames else None
+    return None
+
+
+def timed_query(func):
+    """Декоратор для функций чтения из БД: время запроса и число строк результата"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        QUERY_SECONDS.observe(time.perf_counter() - start, query=func.__name__)
+        rows = _result_rows(result)
+        if rows is not None:
+            QUERY_ROWS.observe(rows, query=func.__name__)
+        return result
+    return wrapper
+
+
+def register_flask(server):
+    """Добавляет маршрут /metrics и учет времени и размера ответов на обновление компонентов Dash"""
+    from flask import Response, g, request
+
+    @server.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def record_request(response):
+        start = g.get("metrics_start")
+        if start is not None and request.path.endswith("_dash-update-component"):
+            # Выход callback (id.свойство) определяет, какой callback обслуживал запрос
+            output = (request.get_json(silent=True) or {}).get("output", "")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, output=output)
+            RESPONSE_BYTES.observe(response.calculate_content_length() or 0, output=output)
+        return response
+
+    @server.route("/metrics")
+    def metrics():
+        return Response(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
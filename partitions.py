@@ -0,0 +1,148 @@
+import time
+import logging
+import argparse
+import pandas as pd
+from psycopg2 import sql
+from db_pool import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+
+def _relkind(cursor, table_name):
+    # 'r' - обычная таблица, 'p' - секционированная, None - таблицы нет
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table_name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def partition_name(table_name, month):
+    """Имя секции за месяц: transport_metrics_2025_03"""
+    return f"{table_name}_{month.year:04d}_{month.month:02d}"
+
+
+def list_partitions(cursor, table_name):
+    """Имена секций таблицы"""
+    cursor.execute("""
+    SELECT child.relname
+    FROM pg_inherits
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = to_regclass(%s)
+    ORDER BY child.relname
+    """, (table_name,))
+    return [name for (name,) in cursor.fetchall()]
+
+
+def _create_partitions(cursor, table_name, months):
+    months = sorted(set(months))
+    missing = set(partition_name(table_name, month) for month in months) - set(list_partitions(cursor, table_name))
+    if not missing:
+        return 0
+
+    # Параллельные загрузчики могут одновременно создавать одну секцию: сериализуем создание
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"partitions:{table_name}",))
+    existing = set(list_partitions(cursor, table_name))
+    created = 0
+    for month in months:
+        name = partition_name(table_name, month)
+        if name in existing:
+            continue
+        start = month.to_timestamp().date()
+        end = (month + 1).to_timestamp().date()
+        cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)").format(
+            sql.Identifier(name), sql.Identifier(table_name)), (start, end))
+        logger.info(f"Создана секция {name}")
+        created += 1
+    return created
+
+
+def ensure_partitions(cursor, table_name, dates):
+    """Создает недостающие месячные секции под даты загружаемой пачки и возвращает их число.
+
+    Транзакцию не фиксирует. Создание секции блокирует родительскую таблицу до фиксации,
+    поэтому вызывающий фиксирует новые секции до загрузки строк.
+    """
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        # В выгрузках дата приходит как '17.03.2025'
+        dates = pd.to_datetime(dates, dayfirst=True, errors="coerce")
+    return _create_partitions(cursor, table_name, dates.dropna().dt.to_period("M").unique())
+
+
+def _migrate_to_partitioned(cursor, table_name, create_query):
+    """Переносит обычную таблицу прежней версии в секционированную с сохранением id"""
+    start = time.perf_counter()
+    legacy = f"{table_name}_legacy"
+    cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(table_name), sql.Identifier(legacy)))
+    # Индексы и последовательность старой таблицы сохраняют имена, освобождаем их для новой
+    cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", (legacy,))
+    for (index_name,) in cursor.fetchall():
+        cursor.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+            sql.Identifier(index_name), sql.Identifier(f"{index_name}_legacy")))
+    cursor.execute(sql.SQL("ALTER SEQUENCE IF EXISTS {} RENAME TO {}").format(
+        sql.Identifier(f"{table_name}_id_seq"), sql.Identifier(f"{legacy}_id_seq")))
+
+    cursor.execute(create_query)
+    cursor.execute(sql.SQL("SELECT DISTINCT date_trunc('month', Дата)::date FROM {} WHERE Дата IS NOT NULL").format(
+        sql.Identifier(legacy)))
+    _create_partitions(cursor, table_name, [pd.Period(month, "M") for (month,) in cursor.fetchall()])
+
+    # Строки без даты ни в одну секцию не попадают, а дашбордом и так не используются
+    cursor.execute(sql.SQL("INSERT INTO {} SELECT * FROM {} WHERE Дата IS NOT NULL").format(
+        sql.Identifier(table_name), sql.Identifier(legacy)))
+    moved = cursor.rowcount
+    cursor.execute(sql.SQL("SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 1)) FROM {}").format(
+        sql.Identifier(table_name)), (table_name,))
+    cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(legacy)))
+    logger.info(f"Таблица {table_name} переведена на секции по месяцам: {moved} строк за {time.perf_counter() - start:.2f} с")
+
+
+def ensure_partitioned_table(cursor, table_name, create_query):
+    """Создает таблицу, секционированную по месяцам; обычную таблицу прежней версии переносит в секции"""
+    kind = _relkind(cursor, table_name)
+    if kind == "p":
+        return
+    # Две первые загрузки после обновления иначе обе увидят обычную таблицу и обе начнут перенос.
+    # Блокировка держится до конца транзакции вызывающего, вторая проверка выполняется уже под ней
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"partitions:ddl:{table_name}",))
+    kind = _relkind(cursor, table_name)
+    if kind == "p":
+        return
+    if kind is None:
+        cursor.execute(create_query)
+        return
+    _migrate_to_partitioned(cursor, table_name, create_query)
+
+
+def detach_partition(table_name, month, concurrently=True):
+    """Отсоединяет секцию за месяц; она остается отдельной таблицей, которую можно выгрузить в архив или удалить"""
+    name = partition_name(table_name, pd.Period(month, "M"))
+    with get_connection() as conn:
+        # DETACH ... CONCURRENTLY (PostgreSQL 14+) не держит долгую блокировку, но не работает внутри транзакции
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                concurrently = concurrently and conn.server_version >= 140000
+                cursor.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}" + (" CONCURRENTLY" if concurrently else "")).format(
+                    sql.Identifier(table_name), sql.Identifier(name)))
+        finally:
+            conn.autocommit = False
+    logger.info(f"Секция {name} отсоединена от {table_name}")
+    return name
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Управление месячными секциями таблиц")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    list_parser = subparsers.add_parser("list", help="Показать секции таблицы")
+    list_parser.add_argument("table")
+    detach_parser = subparsers.add_parser("detach", help="Отсоединить секцию за месяц (ГГГГ-ММ)")
+    detach_parser.add_argument("table")
+    detach_parser.add_argument("month")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        with get_connection() as conn, conn.cursor() as cursor:
+            print("\n".join(list_partitions(cursor, args.table)))
+    else:
+        detach_partition(args.table, args.month)
@@ -0,0 +1,314 @@
+import io
+import logging
+import pandas as pd
+from psycopg2.extensions import encodings
+from db_pool import get_connection
+from metrics import timed_query
+
+
+logger = logging.getLogger(__name__)
+
+
+TRANSPORT_SELECT = """
+    id,
+    Адрес,
+    Время,
+    Скорость,
+    Поток,
+    Широта AS "lat",
+    Долгота AS "lon",
+    Дата AS "date"
+"""
+
+POLLUTION_SELECT = """
+    id,
+    Адрес,
+    Время,
+    co,
+    no,
+    no2,
+    so2,
+    Дата AS "date"
+"""
+
+ROLLUP_SELECT = """
+    Поток_сумма AS "flow_sum",
+    Поток_мин AS "flow_min",
+    Поток_макс AS "flow_max",
+    Скорость_сумма AS "speed_sum",
+    Скорость_мин AS "speed_min",
+    Скорость_макс AS "speed_max",
+    Число_записей AS "count",
+    Широта AS "lat",
+    Долгота AS "lon"
+"""
+
+TRANSPORT_QUERY = "SELECT" + TRANSPORT_SELECT + "FROM transport_metrics"
+
+POLLUTION_QUERY = "SELECT" + POLLUTION_SELECT + "FROM air_pollution"
+
+HOURLY_ROLLUP_QUERY = 'SELECT Адрес, Дата AS "date", Час AS "hour",' + ROLLUP_SELECT + "FROM transport_rollup_hourly"
+
+DAILY_ROLLUP_QUERY = 'SELECT Адрес, Дата AS "date",' + ROLLUP_SELECT + "FROM transport_rollup_daily"
+
+# Запросы за период: фильтрация и группировка выполняются на стороне PostgreSQL
+TRANSPORT_RANGE_QUERY = "SELECT" + TRANSPORT_SELECT + """
+FROM transport_metrics
+WHERE Дата BETWEEN %(start)s AND %(end)s
+"""
+
+TRANSPORT_ADDRESS_RANGE_QUERY = TRANSPORT_RANGE_QUERY + """
+AND Адрес = %(address)s
+ORDER BY Дата, Время
+"""
+
+ADDRESS_SUMMARY_QUERY = """
+SELECT
+    Адрес,
+    SUM(Поток_сумма) AS "flow_sum",
+    SUM(Скорость_сумма) AS "speed_sum",
+    SUM(Число_записей) AS "count",
+    MIN(Широта) AS "lat",
+    MIN(Долгота) AS "lon"
+FROM transport_rollup_daily
+WHERE Дата BETWEEN %(start)s AND %(end)s
+GROUP BY Адрес
+"""
+
+# Записи с высокой скоростью и высоким потоком одновременно (выше 95-го процентиля за период).
+# Пороги считаются в PostgreSQL, наружу уходит только небольшая выборка строк.
+# Порядок по хешу id - та же выборка при каждом запросе, без сортировки всего периода по случайному числу
+RISKY_POINTS_QUERY = """
+WITH thresholds AS (
+    SELECT
+        percentile_cont(0.95) WITHIN GROUP (ORDER BY Скорость) AS speed,
+        percentile_cont(0.95) WITHIN GROUP (ORDER BY Поток) AS flow
+    FROM transport_metrics
+    WHERE Дата BETWEEN %(start)s AND %(end)s
+)
+SELECT t.Адрес, t.Скорость, t.Поток, t.Широта AS "lat", t.Долгота AS "lon"
+FROM transport_metrics t, thresholds
+WHERE t.Дата BETWEEN %(start)s AND %(end)s
+AND t.Скорость >= thresholds.speed
+AND t.Поток >= thresholds.flow
+ORDER BY md5(t.id::text)
+LIMIT %(limit)s
+"""
+
+ADDRESS_HOURLY_QUERY = """
+SELECT
+    Час AS "hour",
+    SUM(Поток_сумма) AS "flow_sum",
+    SUM(Скорость_сумма) AS "speed_sum",
+    SUM(Число_записей) AS "count"
+FROM transport_rollup_hourly
+WHERE Адрес = %(address)s AND Дата BETWEEN %(start)s AND %(end)s
+GROUP BY Час
+ORDER BY Час
+"""
+
+ADDRESSES_QUERY = """
+SELECT DISTINCT Адрес
+FROM transport_rollup_daily
+WHERE Дата BETWEEN %(start)s AND %(end)s
+ORDER BY Адрес
+"""
+
+POLLUTION_ADDRESS_RANGE_QUERY = "SELECT" + POLLUTION_SELECT + """
+FROM air_pollution
+WHERE Адрес = %(address)s AND Дата BETWEEN %(start)s AND %(end)s
+ORDER BY Дата, Время
+"""
+
+POLLUTION_ADDRESS_QUERY = "SELECT" + POLLUTION_SELECT + """
+FROM air_pollution
+WHERE Адрес = %(address)s
+ORDER BY Дата, Время
+"""
+
+# Поток каждого датчика по часам за период (для сопоставления с загрязнением)
+HOURLY_FLOW_QUERY = """
+SELECT
+    Адрес,
+    Дата AS "date",
+    Час AS "hour",
+    Поток_сумма AS "flow_sum",
+    Широта AS "lat",
+    Долгота AS "lon"
+FROM transport_rollup_hourly
+WHERE Дата BETWEEN %(start)s AND %(end)s
+"""
+
+POLLUTION_PERIOD_QUERY = "SELECT" + POLLUTION_SELECT + """
+FROM air_pollution
+WHERE Дата BETWEEN %(start)s AND %(end)s
+"""
+
+POLLUTION_ADDRESSES_QUERY = "SELECT DISTINCT Адрес FROM air_pollution ORDER BY Адрес"
+
+# Дополнение к запросам загрузки: только строки за перечисленные даты
+DATES_FILTER = " WHERE Дата = ANY(%(dates)s)"
+
+# Транзакции с номером меньше горизонта завершены: их изменения видны любому следующему запросу
+CHANGE_HORIZON_QUERY = 'SELECT txid_snapshot_xmin(txid_current_snapshot()) AS "horizon"'
+
+CHANGE_LOG_EXISTS_QUERY = "SELECT to_regclass('data_changes') IS NOT NULL AS \"exists\""
+
+CHANGES_QUERY = 'SELECT DISTINCT Таблица AS "table", Дата AS "date" FROM data_changes WHERE Транзакция >= %(since)s'
+
+DATE_RANGE_QUERY = 'SELECT MIN(Дата) AS "min_date", MAX(Дата) AS "max_date" FROM transport_rollup_daily'
+
+
+def read_query(query, params=None, error_message="Ошибка при загрузке данных из БД"):
+    """Выполняет запрос и возвращает результат в виде DataFrame"""
+    try:
+        with get_connection() as conn:
+            return pd.read_sql(query, conn, params=params)
+    except Exception as e:
+        logger.error(f"{error_message}: {e}")
+        raise
+
+
+def read_copy(query, params=None, dtype=None, parse_dates=None, error_message="Ошибка при загрузке данных из БД"):
+    """Выполняет запрос через COPY ... TO STDOUT: CSV разбирается парсером pandas сразу в колонки NumPy,
+    без построчных кортежей Python, как в pd.read_sql"""
+    try:
+        with get_connection() as conn:
+            buffer = io.BytesIO()
+            with conn.cursor() as cursor:
+                sql = cursor.mogrify(query, params)
+                cursor.copy_expert(b"COPY (" + sql + b") TO STDOUT WITH (FORMAT csv, HEADER)", buffer)
+            encoding = encodings.get(conn.encoding, "utf-8")
+        buffer.seek(0)
+        return pd.read_csv(buffer, dtype=dtype, parse_dates=parse_dates, encoding=encoding)
+    except Exception as e:
+        logger.error(f"{error_message}: {e}")
+        raise
+
+
+def _range(start_date, end_date, **params):
+    # Даты из DatePickerRange приходят строками 'YYYY-MM-DD' (иногда с временем)
+    params["start"] = pd.to_datetime(start_date).date()
+    params["end"] = pd.to_datetime(end_date).date()
+    return params
+
+
+# Адрес и время повторяются из строки в строку: категории вместо миллионов строковых объектов
+LOAD_DTYPES = {"Адрес": "category", "Время": "category"}
+
+
+def _load(query, dates, error_message="Ошибка при загрузке данных из БД"):
+    # Без дат - таблица целиком
+    if dates is None:
+        return read_copy(query, None, LOAD_DTYPES, ["date"], error_message)
+    return read_copy(query + DATES_FILTER, {"dates": list(dates)}, LOAD_DTYPES, ["date"], error_message)
+
+
+@timed_query
+def load_data_from_db(dates=None):
+    """Загружает транспортные данные (все или за перечисленные даты)"""
+    return _load(TRANSPORT_QUERY, dates)
+
+
+@timed_query
+def load_pollution_data(dates=None):
+    """Загружает экологические данные (все или за перечисленные даты)"""
+    return _load(POLLUTION_QUERY, dates, "Ошибка при загрузке экологических данных")
+
+
+@timed_query
+def load_rollups(dates=None):
+    """Загружает часовые и суточные агрегаты транспортных данных (все или за перечисленные даты)"""
+    hourly = _load(HOURLY_ROLLUP_QUERY, dates, "Ошибка при загрузке агрегатов")
+    daily = _load(DAILY_ROLLUP_QUERY, dates, "Ошибка при загрузке агрегатов")
+    return hourly, daily
+
+
+def fetch_change_horizon():
+    """Номер самой старой незавершенной транзакции: изменения до него уже зафиксированы"""
+    return int(read_query(CHANGE_HORIZON_QUERY).iloc[0]["horizon"])
+
+
+def fetch_changes(since):
+    """Таблицы и даты, которые загрузки изменили в транзакциях с номером не меньше since"""
+    if not read_query(CHANGE_LOG_EXISTS_QUERY).iloc[0]["exists"]:
+        # Журнал создается первой загрузкой после обновления
+        return pd.DataFrame(columns=["table", "date"])
+    return read_query(CHANGES_QUERY, {"since": since})
+
+
+@timed_query
+def fetch_transport_range(start_date, end_date, address=None):
+    """Сырые транспортные данные за период (и, если задан, для одного адреса)"""
+    if address is None:
+        return read_query(TRANSPORT_RANGE_QUERY, _range(start_date, end_date))
+    return read_query(TRANSPORT_ADDRESS_RANGE_QUERY, _range(start_date, end_date, address=address))
+
+
+@timed_query
+def fetch_address_summary(start_date, end_date):
+    """Суммарный поток и сумма скоростей по адресам за период"""
+    return read_query(ADDRESS_SUMMARY_QUERY, _range(start_date, end_date))
+
+
+@timed_query
+def fetch_risky_points(start_date, end_date, limit):
+    """Не более limit записей с потоком и скоростью выше 95-го процентиля за период"""
+    return read_query(RISKY_POINTS_QUERY, _range(start_date, end_date, limit=limit))
+
+
+@timed_query
+def fetch_address_hourly(address, start_date, end_date):
+    """Поток и сумма скоростей адреса по часам суток за период"""
+    return read_query(ADDRESS_HOURLY_QUERY, _range(start_date, end_date, address=address))
+
+
+@timed_query
+def fetch_addresses(start_date, end_date):
+    """Адреса, по которым есть данные за период"""
+    return read_query(ADDRESSES_QUERY, _range(start_date, end_date))["Адрес"]
+
+
+@timed_query
+def fetch_pollution_range(address, start_date=None, end_date=None):
+    """Экологические данные адреса за период (без дат - за все время)"""
+    if start_date is None:
+        return read_query(
+            POLLUTION_ADDRESS_QUERY,
+            {"address": address},
+            "Ошибка при загрузке экологических данных"
+        )
+    return read_query(
+        POLLUTION_ADDRESS_RANGE_QUERY,
+        _range(start_date, end_date, address=address),
+        "Ошибка при загрузке экологических данных"
+    )
+
+
+@timed_query
+def fetch_hourly_flow(start_date, end_date):
+    """Поток всех датчиков по часам за период из часовых агрегатов"""
+    return read_query(HOURLY_FLOW_QUERY, _range(start_date, end_date))
+
+
+@timed_query
+def fetch_pollution_period(start_date, end_date):
+    """Экологические данные всех постов за период"""
+    return read_query(
+        POLLUTION_PERIOD_QUERY,
+        _range(start_date, end_date),
+        "Ошибка при загрузке экологических данных"
+    )
+
+
+@timed_query
+def fetch_pollution_addresses():
+    """Адреса постов контроля загрязнения"""
+    return read_query(POLLUTION_ADDRESSES_QUERY, error_message="Ошибка при загрузке экологических данных")["Адрес"]
+
+
+@timed_query
+def fetch_date_range():
+    """Минимальная и максимальная даты по суточным агрегатам (без чтения сырых строк)"""
+    row = read_query(DATE_RANGE_QUERY).iloc[0]
+    return row["min_date"], row["max_date"]
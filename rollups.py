@@ -0,0 +1,221 @@
+import sys
+import logging
+import pandas as pd
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from bulk_load import prepare_frame, TRANSPORT_COLUMNS
+from change_log import ensure_change_log
+from db_pool import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+
+HOURLY_TABLE = "transport_rollup_hourly"
+DAILY_TABLE = "transport_rollup_daily"
+
+# Агрегаты, которые можно дополнять новыми данными без пересчета
+AGGREGATE_COLUMNS = """
+    Поток_сумма BIGINT NOT NULL,
+    Поток_мин INT,
+    Поток_макс INT,
+    Скорость_сумма DOUBLE PRECISION NOT NULL,
+    Скорость_мин DOUBLE PRECISION,
+    Скорость_макс DOUBLE PRECISION,
+    Число_записей INT NOT NULL,
+    Широта NUMERIC,
+    Долгота NUMERIC
+"""
+
+HOURLY_DDL = sql.SQL("""
+CREATE TABLE IF NOT EXISTS {} (
+    Адрес TEXT NOT NULL,
+    Дата DATE NOT NULL,
+    Час SMALLINT NOT NULL,
+""" + AGGREGATE_COLUMNS + """,
+    PRIMARY KEY (Адрес, Дата, Час)
+)
+""").format(sql.Identifier(HOURLY_TABLE))
+
+DAILY_DDL = sql.SQL("""
+CREATE TABLE IF NOT EXISTS {} (
+    Адрес TEXT NOT NULL,
+    Дата DATE NOT NULL,
+""" + AGGREGATE_COLUMNS + """,
+    PRIMARY KEY (Адрес, Дата)
+)
+""").format(sql.Identifier(DAILY_TABLE))
+
+# При совпадении ключа суммы складываются, минимумы и максимумы уточняются
+MERGE_AGGREGATES = """
+    Поток_сумма = r.Поток_сумма + EXCLUDED.Поток_сумма,
+    Поток_мин = LEAST(r.Поток_мин, EXCLUDED.Поток_мин),
+    Поток_макс = GREATEST(r.Поток_макс, EXCLUDED.Поток_макс),
+    Скорость_сумма = r.Скорость_сумма + EXCLUDED.Скорость_сумма,
+    Скорость_мин = LEAST(r.Скорость_мин, EXCLUDED.Скорость_мин),
+    Скорость_макс = GREATEST(r.Скорость_макс, EXCLUDED.Скорость_макс),
+    Число_записей = r.Число_записей + EXCLUDED.Число_записей
+"""
+
+AGGREGATE_NAMES = [
+    "Поток_сумма", "Поток_мин", "Поток_макс",
+    "Скорость_сумма", "Скорость_мин", "Скорость_макс",
+    "Число_записей", "Широта", "Долгота"
+]
+
+# Первичное заполнение из уже загруженных сырых данных
+BACKFILL_SELECT = """
+    SUM(Поток), MIN(Поток), MAX(Поток),
+    SUM(Скорость), MIN(Скорость), MAX(Скорость),
+    COUNT(*), MIN(Широта), MIN(Долгота)
+"""
+
+
+def _table_exists(cursor, table_name):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table_name,))
+    return cursor.fetchone()[0]
+
+
+def ensure_rollup_tables(cursor, source_table="transport_metrics"):
+    """Создает таблицы агрегатов; новые таблицы один раз заполняет из сырых данных"""
+    # Индекс создается последним в той же транзакции: если он есть, таблицы созданы и заполнены
+    if _table_exists(cursor, f"{DAILY_TABLE}_date_idx"):
+        return
+    # Две первые загрузки (или загрузка и запуск дашборда) иначе обе увидят, что таблиц нет, и заполнят их дважды.
+    # Блокировка держится до конца транзакции вызывающего, вторая проверка выполняется уже под ней
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('rollups:ddl'))")
+    created = not _table_exists(cursor, HOURLY_TABLE)
+    cursor.execute(HOURLY_DDL)
+    cursor.execute(DAILY_DDL)
+    # Первичные ключи начинаются с адреса, для выборок по периоду нужен индекс по дате
+    cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (Дата)").format(
+        sql.Identifier(f"{DAILY_TABLE}_date_idx"), sql.Identifier(DAILY_TABLE)))
+
+    if created and _table_exists(cursor, source_table):
+        _backfill(cursor, source_table)
+        logger.info("Таблицы агрегатов заполнены по уже загруженным данным")
+
+
+def migrate(source_table="transport_metrics"):
+    """Создает журнал изменений и таблицы агрегатов в уже существующей БД, заполняя агрегаты по сырым данным"""
+    with get_connection() as conn, conn.cursor() as cursor:
+        ensure_change_log(cursor)
+        ensure_rollup_tables(cursor, source_table)
+        conn.commit()
+
+
+def _backfill(cursor, source_table, where=sql.SQL("")):
+    """Пересчитывает агрегаты по сырым данным (всем или отобранным условием where)"""
+    cursor.execute(sql.SQL("""
+    INSERT INTO {} (Адрес, Дата, Час, {})
+    SELECT Адрес, Дата, EXTRACT(HOUR FROM Время)::SMALLINT, """ + BACKFILL_SELECT + """
+    FROM {} {}
+    GROUP BY Адрес, Дата, EXTRACT(HOUR FROM Время)
+    """).format(
+        sql.Identifier(HOURLY_TABLE),
+        sql.SQL(", ").join(map(sql.SQL, AGGREGATE_NAMES)),
+        sql.Identifier(source_table),
+        where
+    ))
+    cursor.execute(sql.SQL("""
+    INSERT INTO {} (Адрес, Дата, {})
+    SELECT Адрес, Дата, """ + BACKFILL_SELECT + """
+    FROM {} {}
+    GROUP BY Адрес, Дата
+    """).format(
+        sql.Identifier(DAILY_TABLE),
+        sql.SQL(", ").join(map(sql.SQL, AGGREGATE_NAMES)),
+        sql.Identifier(source_table),
+        where
+    ))
+
+
+def rebuild_rollups(cursor, source_table="transport_metrics"):
+    """Полностью пересчитывает существующие таблицы агрегатов (например, после удаления повторов)"""
+    if not _table_exists(cursor, HOURLY_TABLE):
+        # Таблиц еще нет: их заполнит ensure_rollup_tables
+        return
+    cursor.execute(sql.SQL("TRUNCATE {}, {}").format(sql.Identifier(HOURLY_TABLE), sql.Identifier(DAILY_TABLE)))
+    _backfill(cursor, source_table)
+    logger.info("Таблицы агрегатов пересчитаны")
+
+
+def compute_rollups(df):
+    """Считает агрегаты по адресу, дате и часу, а также по адресу и дате"""
+    rows = prepare_frame(df, TRANSPORT_COLUMNS)
+    rows["Час"] = pd.to_datetime(rows["Время"], format="%H:%M:%S", errors="coerce").dt.hour
+    rows = rows.dropna(subset=["Адрес", "Дата", "Час", "Поток", "Скорость"])
+    rows["Час"] = rows["Час"].astype(int)
+
+    aggregations = {
+        "Поток_сумма": ("Поток", "sum"),
+        "Поток_мин": ("Поток", "min"),
+        "Поток_макс": ("Поток", "max"),
+        "Скорость_сумма": ("Скорость", "sum"),
+        "Скорость_мин": ("Скорость", "min"),
+        "Скорость_макс": ("Скорость", "max"),
+        "Число_записей": ("Поток", "size"),
+        "Широта": ("Широта", "first"),
+        "Долгота": ("Долгота", "first"),
+    }
+    hourly = rows.groupby(["Адрес", "Дата", "Час"], as_index=False).agg(**aggregations)
+    daily = rows.groupby(["Адрес", "Дата"], as_index=False).agg(**aggregations)
+    return hourly, daily
+
+
+def _upsert(cursor, table_name, key_columns, frame):
+    if frame.empty:
+        return
+    query = sql.SQL("""
+    INSERT INTO {} AS r ({}) VALUES %s
+    ON CONFLICT ({}) DO UPDATE SET """ + MERGE_AGGREGATES).format(
+        sql.Identifier(table_name),
+        sql.SQL(", ").join(map(sql.SQL, key_columns + AGGREGATE_NAMES)),
+        sql.SQL(", ").join(map(sql.SQL, key_columns))
+    )
+    # astype(object) превращает числа numpy в обычные int/float, которые понимает psycopg2
+    values = frame[key_columns + AGGREGATE_NAMES].astype(object).where(frame.notna(), None)
+    execute_values(cursor, query, values.itertuples(index=False, name=None))
+
+
+def update_rollups(cursor, df):
+    """Дополняет таблицы агрегатов новыми строками (в той же транзакции, что и COPY)"""
+    hourly, daily = compute_rollups(df)
+    _upsert(cursor, HOURLY_TABLE, ["Адрес", "Дата", "Час"], hourly)
+    _upsert(cursor, DAILY_TABLE, ["Адрес", "Дата"], daily)
+    logger.info(f"Агрегаты обновлены: {len(hourly)} часовых и {len(daily)} суточных строк")
+
+
+def refresh_rollups(cursor, df, source_table="transport_metrics"):
+    """Пересчитывает агрегаты за затронутые пачкой адреса и даты по сырым данным.
+
+    Нужен после upsert: повторно загруженные строки заменяют прежние, и простое
+    прибавление сумм к агрегатам учло бы их дважды.
+    """
+    keys = prepare_frame(df, TRANSPORT_COLUMNS)[["Адрес", "Дата"]].dropna().drop_duplicates()
+    if keys.empty:
+        return
+
+    # Параллельные загрузчики с общими днями иначе одновременно удалят и вставят одни и те же строки агрегатов.
+    # Блокируются только затронутые дни, загрузки разных дней идут параллельно; дни берутся по порядку,
+    # чтобы две загрузки с общими днями не ждали друг друга взаимно. Блокировки держатся до конца транзакции
+    for day in sorted(keys["Дата"].unique()):
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"rollups:{day}",))
+
+    cursor.execute("DROP TABLE IF EXISTS rollup_keys")
+    cursor.execute("CREATE TEMP TABLE rollup_keys (Адрес TEXT, Дата DATE) ON COMMIT DROP")
+    execute_values(cursor, "INSERT INTO rollup_keys VALUES %s", keys.itertuples(index=False, name=None))
+    for table_name in (HOURLY_TABLE, DAILY_TABLE):
+        cursor.execute(sql.SQL("""
+        DELETE FROM {} r USING rollup_keys k
+        WHERE r.Адрес = k.Адрес AND r.Дата = k.Дата
+        """).format(sql.Identifier(table_name)))
+    _backfill(cursor, source_table, sql.SQL("WHERE (Адрес, Дата) IN (SELECT Адрес, Дата FROM rollup_keys)"))
+    logger.info(f"Агрегаты пересчитаны за {len(keys)} пар адрес-дата")
+
+
+if __name__ == "__main__":
+    # python rollups.py - подготовить БД, загруженную до появления агрегатов, без запуска загрузки
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+                        stream=sys.stdout)
+    migrate()
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import pandas as pd
+import pyarrow as pa
+
+
+logger = logging.getLogger(__name__)
+
+# Каталог снимков данных для режима shared: <SHARED_DIR>/v<версия>/<таблица>.arrow и указатель current.json
+SHARED_DIR = os.environ.get("DASHBOARD_SHARED_DIR", "shared_data")
+
+# Как часто загрузчик проверяет БД (или архив) на новые данные, с
+PUBLISH_INTERVAL = float(os.environ.get("DASHBOARD_SHARED_INTERVAL", 10))
+
+MANIFEST = "current.json"
+TABLES = ("transport", "pollution", "hourly", "daily")
+
+
+def _to_arrow(frame):
+    """Таблица Arrow, колонки которой после отображения в память читаются в pandas без копирования"""
+    columns = {}
+    for name, series in frame.items():
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Код -1 - пропуск (например, адрес NULL в строках старого загрузчика): в Arrow это null
+            codes = series.cat.codes.to_numpy()
+            columns[name] = pa.DictionaryArray.from_arrays(
+                pa.array(codes, mask=codes < 0), pa.array(series.cat.categories.astype(str))
+            )
+        else:
+            # NaN остается значением, а не null: колонка с маской null при чтении копируется
+            columns[name] = pa.array(series.to_numpy(), from_pandas=False)
+    return pa.table(columns)
+
+
+def _to_pandas(table):
+    """DataFrame поверх буферов таблицы: числа и даты - без копирования, адреса - категории по тем же кодам"""
+    frame = table.to_pandas(split_blocks=True)
+    for name in table.column_names:
+        column = table.column(name)
+        if pa.types.is_dictionary(column.type) and column.num_chunks == 1:
+            array = column.chunk(0)
+            # Коды с пропусками копируются с заменой null на -1; без пропусков берутся без копирования
+            codes = (array.indices.fill_null(-1).to_numpy() if array.null_count
+                     else array.indices.to_numpy(zero_copy_only=True))
+            frame[name] = pd.Categorical.from_codes(codes, array.dictionary.to_pylist(), validate=False)
+    return frame
+
+
+def _write_table(frame, path):
+    table = _to_arrow(frame)
+    # Формат файла IPC без сжатия: буферы лежат в файле как в памяти
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _read_table(path):
+    # Файл отображается в память: страницы общие для всех процессов, подключивших снимок
+    return _to_pandas(pa.ipc.open_file(pa.memory_map(path, "r")).read_all())
+
+
+def read_manifest(shared_dir=None):
+    """Описание текущего снимка или None, если снимков еще нет"""
+    path = os.path.join(shared_dir or SHARED_DIR, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _remove_old(shared_dir, keep):
+    # Предыдущий снимок оставляем: воркер может как раз его подключать.
+    # Удаление файла, уже отображенного в память, не мешает процессам, которые его читают (кроме Windows)
+    for name in os.listdir(shared_dir):
+        if name.startswith("v") and name not in keep:
+            try:
+                shutil.rmtree(os.path.join(shared_dir, name))
+            except OSError as e:
+                logger.warning(f"Не удалось удалить старый снимок {name}: {e}")
+
+
+def _next_version(shared_dir, current):
+    # Загрузчик мог упасть после переименования каталога снимка, но до записи указателя:
+    # номер такого каталога уже занят, хотя указатель на него не ссылается
+    taken = [int(name[1:]) for name in os.listdir(shared_dir) if name.startswith("v") and name[1:].isdigit()]
+    return max([current["version"] if current else 0, *taken]) + 1
+
+
+def publish(frames, date_range, shared_dir=None):
+    """Записывает таблицы новой версией снимка и атомарно переключает на нее указатель"""
+    shared_dir = shared_dir or SHARED_DIR
+    os.makedirs(shared_dir, exist_ok=True)
+    start = time.perf_counter()
+    current = read_manifest(shared_dir)
+    version = _next_version(shared_dir, current)
+    name = f"v{version}"
+
+    # Снимок пишется во временный каталог и переименовывается целиком: воркеры не видят его недописанным
+    tmp = os.path.join(shared_dir, f".{name}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for table in TABLES:
+        _write_table(frames[table], os.path.join(tmp, f"{table}.arrow"))
+    os.replace(tmp, os.path.join(shared_dir, name))
+
+    manifest = {
+        "version": version,
+        "path": name,
+        "rows": {table: len(frames[table]) for table in TABLES},
+        "date_range": [None if date is None else str(date) for date in date_range],
+        "published": time.time(),
+    }
+    pointer = os.path.join(shared_dir, MANIFEST + ".tmp")
+    with open(pointer, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(pointer, os.path.join(shared_dir, MANIFEST))
+
+    _remove_old(shared_dir, {name, current["path"] if current else name})
+    logger.info(f"Снимок {name} опубликован за {time.perf_counter() - start:.2f} с: {manifest['rows']}")
+    return version
+
+
+def attach(manifest, shared_dir=None):
+    """Таблицы снимка, отображенные в память: воркеры делят одну копию данных"""
+    start = time.perf_counter()
+    path = os.path.join(shared_dir or SHARED_DIR, manifest["path"])
+    frames = {table: _read_table(os.path.join(path, f"{table}.arrow")) for table in TABLES}
+    mapped = sum(os.path.getsize(os.path.join(path, f"{table}.arrow")) for table in TABLES)
+    logger.info(
+        f"Снимок {manifest['path']} подключен за {time.perf_counter() - start:.3f} с: "
+        f"{mapped / 2**20:.1f} МБ в общей памяти, собственная память процесса {private_memory() / 2**20:.1f} МБ"
+    )
+    return frames
+
+
+def private_memory():
+    """Анонимная (не разделяемая с другими процессами) память процесса, байт; 0, если /proc недоступен"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def date_range(shared_dir=None):
+    """Диапазон дат текущего снимка без его подключения"""
+    manifest = read_manifest(shared_dir)
+    if manifest is None:
+        return None, None
+    return tuple(None if date is None else pd.to_datetime(date).date() for date in manifest["date_range"])
+
+
+def serve(source, interval=PUBLISH_INTERVAL, once=False):
+    """Загрузчик: держит данные в памяти (режим memory или archive) и публикует снимок при каждом их изменении"""
+    from data_store import DataStore
+
+    store = DataStore(source)
+    published = None
+    while True:
+        try:
+            store.refresh()
+            if store.version != published:
+                publish(store.shared_frames(), store.date_range())
+                published = store.version
+        except Exception as e:
+            logger.error(f"Не удалось обновить снимок данных: {e}")
+            if once:
+                raise
+        if once:
+            return
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Публикация данных дашборда в общую память для нескольких воркеров")
+    parser.add_argument("--source", choices=("memory", "archive"), default="memory",
+                        help="откуда загрузчик читает данные")
+    parser.add_argument("--interval", type=float, default=PUBLISH_INTERVAL, help="пауза между проверками, с")
+    parser.add_argument("--once", action="store_true", help="опубликовать один снимок и выйти")
+    args = parser.parse_args()
+    serve(args.source, args.interval, args.once)
@@ -0,0 +1,152 @@
+import re
+import math
+import logging
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+# Условие фильтра DataTable: {колонка} оператор значение.
+# Префикс i/s у оператора (ieq, s=, i<= ...) - сравнение без учета или с учетом регистра
+_CONDITION = re.compile(
+    r"^\{(?P<column>[^}]+)\}\s*"
+    r"(?:(?P<blank>is not blank|is blank)"
+    r"|(?P<case>[is])?(?P<operator>contains|datestartswith|eq|ne|lt|le|gt|ge|<=|>=|!=|<|>|=))"
+    r"\s*(?P<value>.*)$"
+)
+
+# Связки условий вне кавычек; && связывает сильнее ||, как в DataTable
+_LOGICAL = re.compile(r"\s+(&&|\|\||and|or)\s+", re.IGNORECASE)
+_QUOTES = "\"'`"
+
+_OPERATOR_ALIASES = {"=": "eq", "!=": "ne", "<": "lt", "<=": "le", ">": "gt", ">=": "ge"}
+
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'`":
+        return value[1:-1]
+    return value
+
+
+def _split_logical(filter_query):
+    """Делит запрос на условия и связки между ними; связки внутри значений в кавычках не учитываются"""
+    parts, operators = [], []
+    start = position = 0
+    quote = None
+    while position < len(filter_query):
+        char = filter_query[position]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in _QUOTES and (position == 0 or filter_query[position - 1] in " =<>"):
+            # Кавычка открывает значение только в его начале: апостроф внутри слова - обычный символ
+            quote = char
+        elif char.isspace():
+            match = _LOGICAL.match(filter_query, position)
+            if match:
+                parts.append(filter_query[start:position])
+                operators.append("or" if match[1].lower() in ("||", "or") else "and")
+                start = position = match.end()
+                continue
+        position += 1
+    parts.append(filter_query[start:])
+    return parts, operators
+
+
+def _parse_condition(part):
+    match = _CONDITION.match(part.strip())
+    if match is None:
+        logger.warning(f"Условие фильтра не распознано и пропущено: {part.strip()}")
+        return None
+    if match["blank"]:
+        return match["column"], match["blank"], "", True
+    operator = _OPERATOR_ALIASES.get(match["operator"], match["operator"])
+    return match["column"], operator, _unquote(match["value"]), match["case"] != "i"
+
+
+def parse_filter(filter_query):
+    """Разбирает filter_query DataTable в варианты, объединенные ИЛИ.
+
+    Вариант - список условий (колонка, оператор, значение, с учетом регистра), объединенных И.
+    """
+    filter_query = (filter_query or "").strip()
+    if not filter_query:
+        return []
+    parts, operators = _split_logical(filter_query)
+    alternatives = [[]]
+    for index, part in enumerate(parts):
+        if index and operators[index - 1] == "or":
+            alternatives.append([])
+        condition = _parse_condition(part)
+        if condition is not None:
+            alternatives[-1].append(condition)
+    return alternatives
+
+
+def _compare(series, operator, value, case_sensitive):
+    if operator == "is blank":
+        return series.isna() | (series.astype("string") == "")
+    if operator == "is not blank":
+        return series.notna() & (series.astype("string") != "")
+
+    if pd.api.types.is_numeric_dtype(series):
+        value = pd.to_numeric(value, errors="coerce")
+        if pd.isna(value):
+            return pd.Series(False, index=series.index)
+    else:
+        series = series.astype("string")
+        if not case_sensitive:
+            series, value = series.str.lower(), value.lower()
+
+    if operator == "contains":
+        return series.astype("string").str.contains(str(value), regex=False).fillna(False)
+    if operator == "datestartswith":
+        return series.astype("string").str.startswith(str(value)).fillna(False)
+    mask = {
+        "eq": lambda: series == value,
+        "ne": lambda: series != value,
+        "lt": lambda: series < value,
+        "le": lambda: series <= value,
+        "gt": lambda: series > value,
+        "ge": lambda: series >= value,
+    }[operator]()
+    return mask.fillna(False).astype(bool)
+
+
+def filter_frame(df, filter_query):
+    """Строки, удовлетворяющие фильтру (маски по колонкам, без обхода строк)"""
+    alternatives = parse_filter(filter_query)
+    if not alternatives:
+        return df
+    mask = pd.Series(False, index=df.index)
+    for conditions in alternatives:
+        matched = pd.Series(True, index=df.index)
+        for column, operator, value, case_sensitive in conditions:
+            if column not in df:
+                logger.warning(f"Фильтр по неизвестной колонке {column} пропущен")
+                continue
+            matched &= _compare(df[column], operator, value, case_sensitive)
+        mask |= matched
+    return df[mask]
+
+
+def sort_frame(df, sort_by, sort_keys=None):
+    """Сортировка по sort_by DataTable: [{'column_id': ..., 'direction': 'asc' | 'desc'}].
+
+    sort_keys сопоставляет колонке таблицы колонку, по которой она сортируется (например, время - по минутам).
+    """
+    sort_keys = sort_keys or {}
+    columns = [sort_keys.get(item["column_id"], item["column_id"]) for item in sort_by or []]
+    if not columns:
+        return df
+    ascending = [item["direction"] == "asc" for item in sort_by]
+    return df.sort_values(columns, ascending=ascending, kind="stable")
+
+
+def page(df, page_current, page_size, columns):
+    """Строки одной страницы, число страниц и номер страницы (после фильтра или новых данных - не дальше последней)"""
+    page_count = max(1, math.ceil(len(df) / page_size))
+    page_current = min(max(page_current or 0, 0), page_count - 1)
+    start = page_current * page_size
+    return df.iloc[start:start + page_size][columns].to_dict("records"), page_count, page_current
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+from correlation import GridIndex, EARTH_RADIUS_M, lagged_correlation, station_flow
+
+
+def _degrees(x, y):
+    """Широта и долгота точек, заданных в метрах от (0, 0): у экватора проекция индекса почти не искажает"""
+    return np.degrees(np.asarray(y, dtype="float64") / EARTH_RADIUS_M), np.degrees(np.asarray(x, dtype="float64") / EARTH_RADIUS_M)
+
+
+@pytest.fixture
+def grid():
+    # Точки на линиях сетки с ячейкой 1000 м и рядом с ними
+    x = [1005, 1990, -4, -6, 1000, 995, 2000, 0]
+    y = [1005, 995, 995, 995, 0, -995, 1995, 0]
+    lat, lon = _degrees(x, y)
+    return GridIndex(lat, lon, cell_m=1000)
+
+
+def test_query_crosses_cell_boundaries(grid):
+    lat, lon = _degrees(995, 995)
+    found, distances = grid.query(lat, lon, 1000)
+    # Точки соседних ячеек по диагонали и по сторонам; (-6, 995) дальше радиуса на 1 м
+    assert sorted(found) == [0, 1, 2, 4]
+    assert np.allclose(distances[np.argsort(found)], np.hypot([10, 995, 999, 5], [10, 0, 0, 995]), atol=0.01)
+
+
+def test_query_matches_brute_force():
+    rng = np.random.default_rng(0)
+    lat, lon = _degrees(rng.uniform(-3000, 3000, 500), rng.uniform(-3000, 3000, 500))
+    index = GridIndex(lat, lon, cell_m=700)
+    for x, y in rng.uniform(-3000, 3000, (20, 2)):
+        plat, plon = _degrees(x, y)
+        found, _ = index.query(plat, plon, 700)
+        px, py = index.x - x, index.y - y
+        assert sorted(found) == list(np.flatnonzero(np.hypot(px, py) <= 700))
+
+
+def test_query_radius_larger_than_cell(grid):
+    with pytest.raises(ValueError):
+        grid.query(0.0, 0.0, 1500)
+
+
+def test_lagged_correlation_finds_shift():
+    rng = np.random.default_rng(1)
+    x = rng.normal(size=(200, 1))
+    y = np.full_like(x, np.nan)
+    y[3:] = 2 * x[:-3] + 1
+    r, n = lagged_correlation(x, y, max_lag=6, min_hours=8)
+    assert r.shape == n.shape == (7, 1)
+    assert r[3, 0] == pytest.approx(1.0)
+    assert np.nanargmax(np.abs(r[:, 0])) == 3
+    assert np.all(np.abs(np.delete(r[:, 0], 3)) < 0.5)
+
+
+def test_lagged_correlation_excludes_missing_hours():
+    x = np.arange(24, dtype="float64").reshape(-1, 1).repeat(2, axis=1)
+    y = x.copy()
+    x[[2, 5, 7], 0] = np.nan
+    y[10:, 1] = np.nan
+    r, n = lagged_correlation(x, y, max_lag=2, min_hours=11)
+    assert list(n[:, 0]) == [21, 20, 19]
+    assert list(n[:, 1]) == [10, 9, 8]
+    assert r[0, 0] == pytest.approx(1.0)
+    # Меньше min_hours общих часов - коэффициент не считается
+    assert np.isnan(r[:, 1]).all()
+
+
+def test_station_flow_sums_reporting_sensors():
+    flow = np.array([
+        [1.0, 2.0, 5.0],
+        [np.nan, 3.0, np.nan],
+        [np.nan, np.nan, 7.0],
+    ])
+    assignments = pd.DataFrame({"station": ["П1", "П1", "П2"], "sensor": ["a", "b", "c"]})
+    result = station_flow(flow, assignments, ["a", "b", "c"], ["П1", "П2", "П3"])
+    expected = np.array([
+        [3.0, 5.0, np.nan],
+        [3.0, np.nan, np.nan],
+        [np.nan, 7.0, np.nan],
+    ])
+    np.testing.assert_array_equal(result, expected)
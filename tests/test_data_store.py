@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+from data_store import AddressIndex, format_minutes
+
+
+@pytest.fixture
+def index():
+    df = pd.DataFrame({
+        "Адрес": pd.Categorical(["b", "a", None, "b", "a", "b"]),
+        "date": pd.to_datetime(["2024-01-02", "2024-01-01", "2024-01-01", "2024-01-01", "2024-01-03", "2024-01-03"]),
+        "minutes": [0, 60, 30, 120, 0, 0],
+    })
+    return AddressIndex(df)
+
+
+def test_block_offsets(index):
+    assert index.offsets == {"a": (0, 2), "b": (2, 5)}
+    assert list(index.frame["date"].iloc[2:5].dt.day) == [1, 2, 3]
+
+
+def test_lookup_date_bounds(index):
+    assert list(index.lookup("b")["date"].dt.day) == [1, 2, 3]
+    assert list(index.lookup("b", "2024-01-02", "2024-01-03")["date"].dt.day) == [2, 3]
+    assert list(index.lookup("a", "2024-01-01", "2024-01-01")["minutes"]) == [60]
+    assert index.lookup("a", "2024-01-04", "2024-01-05").empty
+
+
+def test_null_address_is_not_indexed(index):
+    # Строка без адреса не должна затирать блок последнего адреса
+    assert index.offsets["b"] == (2, 5)
+    assert len(index.lookup("b")) == 3
+    assert index.lookup(None).empty
+    assert index.lookup("c").empty
+
+
+def test_format_minutes_missing_time():
+    assert list(format_minutes(pd.Series([0, 75, 1439, -1]))) == ["00:00", "01:15", "23:59", ""]
@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+from table_query import parse_filter, filter_frame, page
+
+
+@pytest.fixture
+def los():
+    return pd.DataFrame({
+        "Адрес": ["Ленина 1", "ленина 2", "Мира 3", "Мира 4"],
+        "LOS_kv": ["A", "a", "B", None],
+        "Поток": [10, 20, 30, 40],
+    })
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("{LOS_kv} s= A", ("LOS_kv", "eq", "A", True)),
+    ("{LOS_kv} i= A", ("LOS_kv", "eq", "A", False)),
+    ("{Поток} i< 5", ("Поток", "lt", "5", False)),
+    ("{Поток} s>= 5", ("Поток", "ge", "5", True)),
+    ("{Поток} != 5", ("Поток", "ne", "5", True)),
+    ("{Адрес} icontains ленина", ("Адрес", "contains", "ленина", False)),
+    ("{Адрес} scontains Ленина", ("Адрес", "contains", "Ленина", True)),
+    ('{Адрес} eq "Мира 3"', ("Адрес", "eq", "Мира 3", True)),
+    ("{LOS_kv} is blank", ("LOS_kv", "is blank", "", True)),
+    ("{LOS_kv} is not blank", ("LOS_kv", "is not blank", "", True)),
+])
+def test_parse_operators(query, expected):
+    assert parse_filter(query) == [[expected]]
+
+
+def test_parse_empty():
+    assert parse_filter("") == []
+    assert parse_filter(None) == []
+
+
+def test_and_binds_tighter_than_or():
+    alternatives = parse_filter("{Поток} > 10 && {Поток} < 40 || {LOS_kv} = A")
+    assert alternatives == [
+        [("Поток", "gt", "10", True), ("Поток", "lt", "40", True)],
+        [("LOS_kv", "eq", "A", True)],
+    ]
+    assert parse_filter("{Поток} > 10 and {LOS_kv} = B or {Поток} = 10") == parse_filter(
+        "{Поток} > 10 && {LOS_kv} = B || {Поток} = 10"
+    )
+
+
+def test_logical_operators_inside_quotes():
+    assert parse_filter('{Адрес} contains "a || b && c"') == [[("Адрес", "contains", "a || b && c", True)]]
+
+
+def test_unrecognized_condition_is_skipped():
+    assert parse_filter("{Поток} ~ 5 && {Поток} > 5") == [[("Поток", "gt", "5", True)]]
+
+
+def test_filter_case_prefix_on_symbolic_operator(los):
+    assert list(filter_frame(los, "{LOS_kv} s= A")["Поток"]) == [10]
+    assert list(filter_frame(los, "{LOS_kv} i= A")["Поток"]) == [10, 20]
+    assert list(filter_frame(los, "{Адрес} i< м")["Поток"]) == [10, 20]
+
+
+def test_filter_or(los):
+    assert list(filter_frame(los, "{LOS_kv} = B || {Поток} >= 40")["Поток"]) == [30, 40]
+    assert list(filter_frame(los, "{Поток} > 10 && {LOS_kv} is blank || {Поток} = 10")["Поток"]) == [10, 40]
+
+
+def test_filter_numeric_and_unknown_column(los):
+    assert list(filter_frame(los, "{Поток} > 15 && {Нет} = 1")["Поток"]) == [20, 30, 40]
+    assert list(filter_frame(los, "{Поток} > abc")["Поток"]) == []
+    assert filter_frame(los, "").equals(los)
+
+
+def test_page_is_clamped_to_last(los):
+    assert page(los, 5, 3, ["Поток"]) == ([{"Поток": 40}], 2, 1)
+    assert page(los, None, 3, ["Поток"])[2] == 0
+    assert page(los.iloc[:0], 2, 3, ["Поток"]) == ([], 1, 0)
@@ -0,0 +1,132 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from multiprocessing import Manager
+from concurrent.futures import ProcessPoolExecutor
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Число файлов, которые могут обрабатываться одновременно
+MAX_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 2))
+
+# Статусы задач
+QUEUED = "в очереди"
+RUNNING = "обрабатывается"
+DONE = "готово"
+FAILED = "ошибка"
+
+_lock = threading.Lock()
+_executor = None
+_manager = None
+_jobs = None
+_listeners = []
+
+
+def _get_executor():
+    """Лениво создает пул процессов и общий словарь состояния задач"""
+    global _executor, _manager, _jobs
+    with _lock:
+        if _executor is None:
+            _manager = Manager()
+            _jobs = _manager.dict()
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+        return _executor
+
+
+def _update_job(jobs, job_id, **values):
+    # Прокси словаря Manager не видит изменений вложенных объектов, поэтому перезаписываем запись целиком
+    job = dict(jobs[job_id])
+    job.update(values)
+    jobs[job_id] = job
+
+
+def _run_job(jobs, job_id, kind, file_path):
+    """Выполняется в дочернем процессе: обрабатывает файл и сообщает о прогрессе"""
+    _update_job(jobs, job_id, status=RUNNING, started=time.time())
+
+    def progress(rows_parsed, rows_loaded):
+        _update_job(jobs, job_id, rows_parsed=rows_parsed, rows_loaded=rows_loaded)
+
+    # Метрики дочернего процесса передаются с задачей и добавляются к метрикам дашборда
+    metrics.registry.reset()
+    try:
+        # Импортируем здесь, чтобы не тянуть конвейер загрузки в процесс дашборда
+        if kind == "traffic":
+            from data_transfer import process_excel_to_postgres
+            return process_excel_to_postgres(file_path, streaming=True, progress=progress)
+        if kind == "pollution":
+            from data_transfer_air import process_excel_to_postgres_air
+            return process_excel_to_postgres_air(file_path, progress=progress)
+        raise ValueError(f"Неизвестный тип загрузки: {kind}")
+    finally:
+        _update_job(jobs, job_id, metrics=metrics.registry.dump())
+
+
+def _on_job_done(job_id, future):
+    """Фиксирует итог задачи в основном процессе"""
+    try:
+        result = future.result()
+        error = None if result else "Проверьте содержимое файла"
+    except Exception as e:
+        result = False
+        error = str(e)
+
+    _update_job(_jobs, job_id, status=DONE if result else FAILED, finished=time.time(), error=error)
+    metrics.registry.merge(_jobs[job_id].get("metrics"))
+    logger.info(f"Задача {job_id} завершена: {'успешно' if result else error}")
+
+    if result:
+        for listener in _listeners:
+            try:
+                listener(dict(_jobs[job_id]))
+            except Exception as e:
+                logger.error(f"Ошибка обработчика завершения задачи {job_id}: {e}")
+
+
+def add_job_listener(listener):
+    """Регистрирует функцию, вызываемую после успешного завершения задачи"""
+    _listeners.append(listener)
+
+
+def submit_upload(kind, file_path, filename):
+    """Ставит файл в очередь на обработку и сразу возвращает идентификатор задачи"""
+    executor = _get_executor()
+    job_id = uuid.uuid4().hex[:8]
+    _jobs[job_id] = {
+        "id": job_id,
+        "kind": kind,
+        "filename": filename,
+        "status": QUEUED,
+        "rows_parsed": 0,
+        "rows_loaded": 0,
+        "submitted": time.time(),
+        "started": None,
+        "finished": None,
+        "error": None,
+    }
+
+    future = executor.submit(_run_job, _jobs, job_id, kind, file_path)
+    future.add_done_callback(lambda f: _on_job_done(job_id, f))
+    logger.info(f"Файл {filename} поставлен в очередь, задача {job_id}")
+    return job_id
+
+
+def list_jobs():
+    """Возвращает снимок состояния всех задач, начиная с последней"""
+    if _jobs is None:
+        return []
+
+    now = time.time()
+    jobs = []
+    for job in _jobs.values():
+        job = dict(job)
+        if job["started"]:
+            job["elapsed"] = (job["finished"] or now) - job["started"]
+        else:
+            job["elapsed"] = 0.0
+        jobs.append(job)
+    return sorted(jobs, key=lambda job: job["submitted"], reverse=True)